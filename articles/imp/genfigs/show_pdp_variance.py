@@ -1,5 +1,6 @@
 from support import *
 from stratx.featimp import *
+from stratx.partdep import avg_pd_curve
 
 figsize = (3.5, 3.0)
 use_oob=False
@@ -54,23 +55,10 @@ for i in range(trials):
 pd.DataFrame()
 
 
-def avg_pd_curve(all_pdpx, all_pdpy):
-    m = defaultdict(float)
-    c = defaultdict(int)
-    count = 0
-    for i in range(trials):
-        for px, py in zip(all_pdpx, all_pdpy):
-            for x, y in zip(px, py):
-                m[x] += y
-                c[x] += 1
-    for x in m.keys():
-        m[x] /= c[x]
-    return m
+# might be diff len; avg_pd_curve() groups by x. how much does importance vary?
+curve = avg_pd_curve(all_pdpx, all_pdpy)
 
-# might be diff len, do manually; how much does importance vary?
-m = avg_pd_curve(all_pdpx, all_pdpy)
-
-ax.scatter(m.keys(), m.values(), c='k', s=7)
+ax.scatter(curve['pdpx'], curve['pdpy'], c='k', s=7)
 
 std_imp = np.std( [np.mean(np.abs(v)) for v in all_pdpy] )
 ax.set_xlabel(colname)
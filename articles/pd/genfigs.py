@@ -214,7 +214,7 @@ def rent():
     # print("Keras training R^2", r2_score(y, y_pred)) # y_test in y
     ice = predict_ice(model, X_train_, colname, 'price', numx=30, nlines=100)
     # replace normalized unique X with unnormalized
-    ice.iloc[0, :] = np.linspace(np.min(X_train[colname]), np.max(X_train[colname]), 30, endpoint=True)
+    ice.linex = np.linspace(np.min(X_train[colname]), np.max(X_train[colname]), 30, endpoint=True)
     plot_ice(ice, colname, 'price', alpha=.3, ax=axes[4], show_ylabel=True)
 
     pdpx, pdpy, ignored = \
@@ -49,6 +49,7 @@ setup(
     author='Terence Parr',
     author_email='parrt@antlr.org',
     install_requires=['sklearn','pandas','numpy','matplotlib','scipy','numba','colour'],
+    extras_require={'parquet': ['pyarrow']},
     description='Model-independent partial dependence plots in Python 3 that works even for codependent variables',
     keywords='model-independent net-effect plots, visualization, partial dependence plots, partial derivative plots, ICE plots, feature importance',
     classifiers=['License :: OSI Approved :: MIT License',
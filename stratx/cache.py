@@ -0,0 +1,365 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import os
+import json
+import hashlib
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import issparse, csc_matrix, csr_matrix
+
+from stratx.datasource import DataSource
+
+
+def fingerprint(*data) -> str:
+    """
+    Return a hex digest identifying the content of data, which can be a mix of
+    dataframes, series, arrays, data sources, and simple values like strings,
+    numbers, dicts. Dataframes are hashed column by column, including column names,
+    so we never need a full copy of X. Non-numeric columns go through pandas' own
+    hashing. Data sources provide their own fingerprint; file-based sources use
+    file names, sizes, and modification times rather than reading everything.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for d in data:
+        if isinstance(d, pd.DataFrame):
+            h.update(b'DataFrame')
+            for colname in d.columns:
+                h.update(repr(colname).encode('utf-8'))
+                _update_with_array(h, np.asarray(d[colname]))
+        elif isinstance(d, DataSource):
+            h.update(b'DataSource')
+            h.update(d.fingerprint().encode('utf-8'))
+        elif isinstance(d, pd.Series):
+            h.update(b'Series')
+            _update_with_array(h, np.asarray(d))
+        elif isinstance(d, np.ndarray):
+            h.update(b'ndarray')
+            _update_with_array(h, d)
+        elif isinstance(d, dict):
+            h.update(repr(sorted(d.items())).encode('utf-8'))
+        else:
+            h.update(repr(d).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _update_with_array(h, a:np.ndarray):
+    h.update(f"{a.dtype.str}{a.shape}".encode('utf-8'))
+    if a.dtype.kind in 'biufcmM':
+        h.update(np.ascontiguousarray(a).view(np.uint8))
+    else:
+        h.update(pd.util.hash_array(a.astype(object).ravel()).view(np.uint8))
+
+
+class StratificationCache:
+    """
+    A store of stratifications, the leaves of the forest trained on X not colname,
+    so that StratPD and CatStratPD don't have to refit a forest every time we look
+    at the same feature of the same data set. E.g., plot_stratpd_gridsearch() plots
+    the same partitioning for every min_slopes_per_x value and
+    importances() looks at every feature again each time it's called.
+
+    Entries are keyed by a fingerprint of (X, y), the dropped column, the forest
+    hyper parameters, and the random seed, and hold the CSR-style leaf_offsets and
+    leaf_sample_idxs arrays from leaf_samples_csr().  We keep at most maxsize
+    entries in memory, evicting the least recently used. If cache_dir is given,
+    entries are also saved there as .npz files and are loaded from there on a
+    memory miss, which lets separate processes (e.g., importances() with n_jobs>1)
+    and separate runs share stratifications.
+
+    Hashing X and y for every key would be a full pass over the data per feature,
+    so we remember the fingerprint of the last few (X, y) objects we've seen and
+    key() only hashes colname and the hyper parameters for them. Don't modify X or
+    y in place while using the cache; make a new X instead.
+
+    Typical use:
+
+        stratcache = StratificationCache()
+        plot_stratpd(X, y, 'x1', 'y', stratcache=stratcache)
+        plot_stratpd(X, y, 'x1', 'y', stratcache=stratcache, show_slope_lines=True) # no refit
+    """
+    def __init__(self, maxsize=32, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._leaves = OrderedDict()
+        self._data_fingerprints = OrderedDict() # (id(X), id(y)) -> (ref to X, ref to y, digest)
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, X, y, colname, **hyperparams) -> str:
+        return fingerprint(self.data_fingerprint(X, y), colname, hyperparams)
+
+    def data_fingerprint(self, X, y) -> str:
+        "Return fingerprint(X, y), hashing the data only the first time we see these objects"
+        ids = id(X), id(y)
+        if ids in self._data_fingerprints:
+            xref, yref, digest = self._data_fingerprints[ids]
+            if xref() is X and yref() is y: # not a new object that reused a dead one's id
+                self._data_fingerprints.move_to_end(ids)
+                return digest
+        digest = fingerprint(X, y)
+        try:
+            self._data_fingerprints[ids] = weakref.ref(X), weakref.ref(y), digest
+        except TypeError: # can't tell if these objects die so don't remember them
+            return digest
+        self._data_fingerprints.move_to_end(ids)
+        while len(self._data_fingerprints) > self.maxsize:
+            self._data_fingerprints.popitem(last=False)
+        return digest
+
+    def get(self, key):
+        "Return (leaf_offsets, leaf_sample_idxs) for key or None if we don't have it"
+        if key in self._leaves:
+            self._leaves.move_to_end(key)
+            self.hits += 1
+            return self._leaves[key]
+        if self.cache_dir is not None:
+            filename = self._filename(key)
+            if os.path.exists(filename):
+                with np.load(filename) as f:
+                    leaves = f['leaf_offsets'], f['leaf_sample_idxs']
+                self._remember(key, leaves)
+                self.hits += 1
+                return leaves
+        self.misses += 1
+        return None
+
+    def put(self, key, leaf_offsets, leaf_sample_idxs):
+        leaves = leaf_offsets, leaf_sample_idxs
+        self._remember(key, leaves)
+        if self.cache_dir is not None:
+            filename = self._filename(key)
+            tmpfilename = f"{filename}.{os.getpid()}.tmp.npz" # other processes might be reading
+            np.savez(tmpfilename, leaf_offsets=leaf_offsets, leaf_sample_idxs=leaf_sample_idxs)
+            os.replace(tmpfilename, filename)
+
+    def clear(self):
+        "Forget all in-memory entries; files in cache_dir are left alone"
+        self._leaves.clear()
+
+    def __len__(self):
+        return len(self._leaves)
+
+    def __contains__(self, key):
+        return key in self._leaves or \
+               (self.cache_dir is not None and os.path.exists(self._filename(key)))
+
+    def _remember(self, key, leaves):
+        self._leaves[key] = leaves
+        self._leaves.move_to_end(key)
+        while len(self._leaves) > self.maxsize:
+            self._leaves.popitem(last=False)
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir, f"strat-{key}.npz")
+
+    def __getstate__(self):
+        # Weak references don't pickle and object ids mean nothing in another process
+        state = self.__dict__.copy()
+        state['_data_fingerprints'] = OrderedDict()
+        return state
+
+
+class ResultCache:
+    """
+    A content-addressed cache on disk of finished results, such as the arrays from
+    partial_dependence() and cat_partial_dependence() or the dataframe from
+    importances(), so that rerunning a script with the same inputs doesn't
+    redo minutes of work. Pass cache_dir to those functions to turn it on.
+
+    Entries are keyed by a fingerprint of the function name, X, y, the column, and
+    all hyper parameters that affect the result, including random_state, which
+    must not be None; see check_seeded(). Each entry
+    is one compressed .npz file holding arrays, scalars, sparse matrices, and
+    dataframes (columns stored as arrays, names as JSON) so loading never
+    unpickles anything.
+
+    When the files in cache_dir add up to more than max_bytes, we delete the least
+    recently used ones; a hit updates a file's modification time.
+    """
+    def __init__(self, cache_dir, max_bytes=2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, name, *data, **params) -> str:
+        params = {k: sorted(v, key=repr) if isinstance(v, (set, frozenset)) else v
+                  for k, v in params.items()}
+        return fingerprint(name, *data, params)
+
+    def get(self, key):
+        "Return the list of values stored under key or None"
+        filename = self._filename(key)
+        try:
+            with np.load(filename, allow_pickle=False) as f:
+                values = _decode_values(f)
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        os.utime(filename) # most recently used
+        self.hits += 1
+        return values
+
+    def put(self, key, values):
+        "Store a sequence of values (arrays, numbers, sparse matrices, dataframes) under key"
+        filename = self._filename(key)
+        tmpfilename = f"{filename}.{os.getpid()}.tmp.npz" # other processes might be reading
+        np.savez_compressed(tmpfilename, **_encode_values(values))
+        os.replace(tmpfilename, filename)
+        self.evict()
+
+    def cached(self, compute, name, *data, **params) -> tuple:
+        """
+        Return the tuple computed by compute() or the tuple it returned before
+        for the same name, data, and params.
+        """
+        key = self.key(name, *data, **params)
+        values = self.get(key)
+        if values is None:
+            values = compute()
+            self.put(key, values)
+        return tuple(values)
+
+    def evict(self):
+        "Delete least recently used entries until we're within max_bytes"
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.startswith('result-') and not filename.endswith('.tmp.npz'):
+                st = os.stat(os.path.join(self.cache_dir, filename))
+                entries.append((st.st_mtime_ns, st.st_size, filename))
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, filename))
+            except FileNotFoundError: # another process beat us to it
+                pass
+            total -= size
+
+    def clear(self):
+        "Delete all entries in cache_dir"
+        for filename in os.listdir(self.cache_dir):
+            if filename.startswith('result-'):
+                os.remove(os.path.join(self.cache_dir, filename))
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir, f"result-{key}.npz")
+
+
+def as_result_cache(cache_dir) -> ResultCache:
+    "Return cache_dir if it's already a ResultCache else a ResultCache on that directory"
+    return cache_dir if isinstance(cache_dir, ResultCache) else ResultCache(cache_dir)
+
+
+def check_seeded(cache_dir, random_state, caller:str):
+    """
+    Raise a ValueError if we're asked to cache results (cache_dir is not None) that
+    are random because random_state is None. Fresh seeds make every call a different
+    result, so the cache would never hit and just fill up with new entries.
+    """
+    if cache_dir is not None and random_state is None:
+        raise ValueError(f"{caller}() needs a random_state to use cache_dir; with "
+                         f"random_state=None, every call gives new random results")
+
+
+def cached_call(f, args:dict, ignore=(), unpack=True):
+    """
+    Return f(**args) or, if we've seen the same arguments, its stored result from
+    the ResultCache given by args['cache_dir'].  args['X'] and args['y'] are
+    fingerprinted as data and all other arguments except those in ignore as hyper
+    parameters; ignore the arguments that don't affect the result, like n_jobs and
+    verbose.  f must return a tuple unless unpack is False, in which case it
+    returns a single value. args['random_state'] must not be None; see check_seeded().
+    Functions call this first thing with their locals():
+
+        if cache_dir is not None:
+            return cached_call(partial_dependence, locals(), ignore=('verbose',))
+    """
+    check_seeded(args['cache_dir'], args['random_state'], f.__name__)
+    args = dict(args)
+    cache = as_result_cache(args['cache_dir'])
+    args['cache_dir'] = None
+    params = {k: v for k, v in args.items()
+              if k not in ('X', 'y', 'cache_dir') and k not in ignore}
+    if unpack:
+        compute = lambda: f(**args)
+    else:
+        compute = lambda: (f(**args),)
+    values = cache.cached(compute, f.__name__, args['X'], args['y'], **params)
+    return values if unpack else values[0]
+
+
+def _encode_values(values) -> dict:
+    arrays = {}
+    kinds = []
+    for i, v in enumerate(values):
+        if isinstance(v, pd.DataFrame):
+            kinds.append({'kind': 'frame', 'columns': list(v.columns), 'index': list(v.index),
+                          'index_name': v.index.name})
+            for j, colname in enumerate(v.columns):
+                arrays[f"{i}.{j}"] = v[colname].values
+        elif issparse(v):
+            kinds.append({'kind': 'sparse', 'format': v.format, 'shape': list(v.shape)})
+            arrays[f"{i}.data"], arrays[f"{i}.indices"], arrays[f"{i}.indptr"] = v.data, v.indices, v.indptr
+        elif isinstance(v, np.ndarray):
+            kinds.append({'kind': 'array'})
+            arrays[str(i)] = v
+        else:
+            kinds.append({'kind': 'scalar'})
+            arrays[str(i)] = np.asarray(v)
+    arrays['__meta__'] = np.array(json.dumps(kinds, default=_json_default))
+    return arrays
+
+
+def _decode_values(f) -> list:
+    values = []
+    for i, kind in enumerate(json.loads(str(f['__meta__']))):
+        if kind['kind'] == 'frame':
+            df = pd.DataFrame({colname: f[f"{i}.{j}"] for j, colname in enumerate(kind['columns'])},
+                              index=pd.Index(kind['index'], name=kind['index_name']))
+            values.append(df)
+        elif kind['kind'] == 'sparse':
+            cls = csc_matrix if kind['format'] == 'csc' else csr_matrix
+            values.append(cls((f[f"{i}.data"], f[f"{i}.indices"], f[f"{i}.indptr"]),
+                              shape=tuple(kind['shape'])))
+        elif kind['kind'] == 'array':
+            values.append(f[str(i)])
+        else:
+            values.append(f[str(i)].item())
+    return values
+
+
+def _json_default(o):
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError(f"Can't store {type(o).__name__} {o!r} in a ResultCache")
@@ -0,0 +1,390 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+class DataSource:
+    """
+    A read-only, column-at-a-time view of the explanatory variables X. StratPD
+    needs X[colname] and the "X not colname" matrix to train the stratification
+    forest, but never a copy of all of X, so a source only has to hand back
+    individual columns. For big data sets, that lets X live on disk (memory-mapped
+    .npy files, a directory of per-column .npy files, or a Parquet/Arrow file)
+    rather than in a dataframe; we read just the columns each step needs.
+
+    Subclasses set self.columns and define __len__() and column().
+    """
+    columns = []
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    @property
+    def shape(self):
+        return len(self), len(self.columns)
+
+    def column(self, colname) -> np.ndarray:
+        "Return X[colname] as a 1D array; a view where the storage allows it"
+        raise NotImplementedError()
+
+    def matrix(self, colnames, dtype=np.float32) -> np.ndarray:
+        """
+        Return an n x len(colnames) matrix holding colnames, filled one column at a
+        time so we never hold more than the result plus one column in memory.
+        The default float32 is what sklearn's trees use internally, so handing
+        this to a forest doesn't cause yet another copy.
+        """
+        M = np.empty(shape=(len(self), len(colnames)), dtype=dtype, order='F')
+        for j, colname in enumerate(colnames):
+            M[:, j] = self.column(colname)
+        return M
+
+    def not_column(self, colname, dtype=np.float32) -> np.ndarray:
+        "Return the matrix for X not colname; see matrix()"
+        return self.matrix([c for c in self.columns if c != colname], dtype=dtype)
+
+    def take(self, idxs) -> 'ColumnSource':
+        "Return a new in-memory source with just the rows in idxs (e.g., a bootstrap trial)"
+        return ColumnSource({colname: self.column(colname)[idxs] for colname in self.columns})
+
+    def to_frame(self, colnames=None) -> pd.DataFrame:
+        "Materialize colnames (or all columns) as a dataframe"
+        if colnames is None:
+            colnames = self.columns
+        return pd.DataFrame({colname: self.column(colname) for colname in colnames})
+
+    def fingerprint(self) -> str:
+        "Return a string identifying this source's data; see cache.fingerprint()"
+        from stratx.cache import fingerprint
+        return fingerprint(*[d for colname in self.columns for d in (colname, self.column(colname))])
+
+
+class DataFrameSource(DataSource):
+    def __init__(self, df:pd.DataFrame):
+        self.df = df
+        self.columns = list(df.columns)
+
+    def __len__(self):
+        return len(self.df)
+
+    def column(self, colname) -> np.ndarray:
+        return self.df[colname].values
+
+    def to_frame(self, colnames=None) -> pd.DataFrame:
+        return self.df if colnames is None else self.df[colnames]
+
+    def fingerprint(self) -> str:
+        from stratx.cache import fingerprint
+        return fingerprint(self.df)
+
+
+class ArraySource(DataSource):
+    """
+    A source for a 2D array, such as np.load(filename, mmap_mode='r') or an
+    np.memmap. Columns are views into the array so nothing is read until used.
+    Fortran-order (column-major) files are faster here because each column is
+    contiguous on disk.
+    """
+    def __init__(self, X:np.ndarray, columns=None):
+        if X.ndim != 2:
+            raise ValueError(f"Expecting a 2D array but got shape {X.shape}")
+        if columns is None:
+            columns = [f"x{j}" for j in range(X.shape[1])]
+        if len(columns) != X.shape[1]:
+            raise ValueError(f"Got {len(columns)} column names for {X.shape[1]} columns")
+        self.X = X
+        self.columns = list(columns)
+        self._colindex = {colname: j for j, colname in enumerate(self.columns)}
+
+    def __len__(self):
+        return self.X.shape[0]
+
+    def column(self, colname) -> np.ndarray:
+        return self.X[:, self._colindex[colname]]
+
+
+class ColumnSource(DataSource):
+    "A source for a dict mapping column name to a 1D array (or memmap) of equal length"
+    def __init__(self, columns:dict):
+        self._columns = dict(columns)
+        self.columns = list(self._columns.keys())
+        lens = {len(col) for col in self._columns.values()}
+        if len(lens) > 1:
+            raise ValueError(f"Columns must all have the same length but got lengths {lens}")
+        self._n = lens.pop() if lens else 0
+
+    def __len__(self):
+        return self._n
+
+    def column(self, colname) -> np.ndarray:
+        return self._columns[colname]
+
+
+class NpyDirSource(ColumnSource):
+    """
+    A column store on disk: a directory with one colname.npy file per column, as
+    written by save_npy_dir(). Each column is memory-mapped, so a column is paged in
+    only when we touch it. The column order is kept in a columns.txt file.
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        with open(os.path.join(dirname, 'columns.txt')) as f:
+            colnames = [line.rstrip('\n') for line in f]
+        super().__init__({colname: np.load(os.path.join(dirname, f"{colname}.npy"), mmap_mode='r')
+                          for colname in colnames})
+
+    def fingerprint(self) -> str:
+        # Don't read gigabytes just to get a cache key; files are replaced not edited
+        return _files_fingerprint([os.path.join(self.dirname, f"{colname}.npy")
+                                   for colname in self.columns])
+
+
+class FeatureMatrix(DataSource):
+    """
+    A view of source X in which every feature's X not colname matrix is a refill of
+    one contiguous Fortran-order float32 (or float64) scratch buffer, not a new
+    n x (p-1) array from X.drop(colname, axis=1).values. In Fortran order the
+    scratch buffer's columns are contiguous, and going from excluding column k to
+    excluding column j only recopies the columns between k and j, read one at a
+    time from the source. Looping over the features in order (as importances()
+    does) copies one column per feature. We never hold a copy of all of X, so for
+    an out-of-core source, such as an NpyDirSource, the scratch buffer is the only
+    big array in memory.
+
+    not_column() returns the scratch buffer itself, which is valid only until the
+    next not_column() call from the same thread. stratify() is done with it
+    once the forest has been fit and applied. Each thread gets its own buffer and
+    processes get their own copy, so FeatureMatrix is safe with joblib.
+
+    X[colname] itself comes from the original source, so it has the exact values
+    and dtype. allocations and allocated_bytes count the big arrays we've made,
+    for benchmarking. The source's fingerprint is computed once and kept, even in
+    copies sent to other processes, so every feature's stratification can be
+    looked up in a StratificationCache without rehashing X.
+    """
+    def __init__(self, X, dtype=np.float32):
+        self.source = as_datasource(X)
+        self.columns = list(self.source.columns)
+        self.dtype = np.dtype(dtype)
+        self._colindex = {colname: j for j, colname in enumerate(self.columns)}
+        self.allocations = 0
+        self.allocated_bytes = 0
+        self._local = threading.local()
+        self._fingerprint = None
+
+    def __len__(self):
+        return len(self.source)
+
+    def column(self, colname) -> np.ndarray:
+        return self.source.column(colname)
+
+    def not_column(self, colname, dtype=np.float32) -> np.ndarray:
+        if np.dtype(dtype) != self.dtype:
+            M = super().not_column(colname, dtype=dtype)
+            self.allocations += 1
+            self.allocated_bytes += M.nbytes
+            return M
+        j = self._colindex[colname]
+        scratch = getattr(self._local, 'scratch', None)
+        if scratch is None:
+            scratch = self._allocate((len(self), len(self.columns)-1))
+            self._fill(scratch, range(0, j), 0)
+            self._fill(scratch, range(j+1, len(self.columns)), j)
+            self._local.scratch = scratch
+        else:
+            k = self._local.excluded
+            if j > k:   # slots k..j-1 now hold columns k..j-1 not k+1..j
+                self._fill(scratch, range(k, j), k)
+            elif j < k: # slots j..k-1 now hold columns j+1..k not j..k-1
+                self._fill(scratch, range(j+1, k+1), j)
+        self._local.excluded = j
+        return scratch
+
+    def _fill(self, scratch, colindexes, slot):
+        "Copy source columns colindexes into scratch columns slot, slot+1, ..."
+        for i, c in enumerate(colindexes):
+            scratch[:, slot+i] = self.source.column(self.columns[c])
+
+    def take(self, idxs) -> 'FeatureMatrix':
+        return FeatureMatrix(self.source.take(idxs), dtype=self.dtype)
+
+    def to_frame(self, colnames=None) -> pd.DataFrame:
+        return self.source.to_frame(colnames)
+
+    def fingerprint(self) -> str:
+        if self._fingerprint is None:
+            self._fingerprint = self.source.fingerprint()
+        return self._fingerprint
+
+    def _allocate(self, shape):
+        M = np.empty(shape=shape, dtype=self.dtype, order='F')
+        self.allocations += 1
+        self.allocated_bytes += M.nbytes
+        return M
+
+    def __getstate__(self):
+        # Scratch buffers are per thread so don't ship them to other processes
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+
+def save_npy_dir(X, dirname):
+    "Save dataframe or DataSource X as a directory of .npy files; see NpyDirSource"
+    src = as_datasource(X)
+    os.makedirs(dirname, exist_ok=True)
+    for colname in src.columns:
+        np.save(os.path.join(dirname, f"{colname}.npy"), np.asarray(src.column(colname)))
+    with open(os.path.join(dirname, 'columns.txt'), 'w') as f:
+        f.write(''.join(f"{colname}\n" for colname in src.columns))
+
+
+class ParquetSource(DataSource):
+    """
+    A Parquet file read one column at a time with pyarrow, which must be installed.
+    Parquet is columnar and compressed so reading a column decodes just that column.
+
+    Stratifying each feature reads every other column, so we keep the maxsize most
+    recently decoded columns rather than hit the disk and decompress again. If X
+    fits in memory, set maxsize to the number of columns. Otherwise, LRU can't
+    help a loop over more than maxsize columns; for repeated access to big data,
+    convert the file once to a NpyDirSource or ArrowSource, which map columns
+    without decoding.
+    """
+    def __init__(self, filename, maxsize=8):
+        self.filename = filename
+        self.maxsize = maxsize
+        self._open()
+        self.columns = list(self._file.schema_arrow.names)
+        self._n = self._file.metadata.num_rows
+
+    def __len__(self):
+        return self._n
+
+    def column(self, colname) -> np.ndarray:
+        with self._lock: # FeatureMatrix fills scratch buffers from many threads
+            if colname in self._decoded:
+                self._decoded.move_to_end(colname)
+                return self._decoded[colname]
+        col = self._file.read(columns=[colname]).column(colname).to_numpy()
+        with self._lock:
+            self._decoded[colname] = col
+            while len(self._decoded) > self.maxsize:
+                self._decoded.popitem(last=False)
+        return col
+
+    def fingerprint(self) -> str:
+        return _files_fingerprint([self.filename])
+
+    def _open(self):
+        pq = _import_pyarrow('pyarrow.parquet')
+        self._file = pq.ParquetFile(self.filename)
+        self._decoded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Other processes reopen the file and decode their own columns
+        state = self.__dict__.copy()
+        for name in ['_file', '_decoded', '_lock']:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+
+class ArrowSource(DataSource):
+    """
+    An Arrow IPC (Feather v2) file, memory-mapped with pyarrow, which must be
+    installed. Uncompressed primitive columns without nulls come back as
+    zero-copy views of the mapped file.
+    """
+    def __init__(self, filename):
+        pa = _import_pyarrow('pyarrow')
+        self.filename = filename
+        self._table = pa.ipc.open_file(pa.memory_map(filename, 'r')).read_all()
+        self.columns = list(self._table.column_names)
+
+    def __len__(self):
+        return self._table.num_rows
+
+    def column(self, colname) -> np.ndarray:
+        return self._table.column(colname).to_numpy()
+
+    def fingerprint(self) -> str:
+        return _files_fingerprint([self.filename])
+
+
+def as_datasource(X) -> DataSource:
+    """
+    Return X as a DataSource. X can already be a source, a dataframe, a 2D array
+    or memmap, a directory created by save_npy_dir(), or the name of a .npy,
+    .parquet, .arrow, or .feather file.
+    """
+    if isinstance(X, DataSource):
+        return X
+    if isinstance(X, pd.DataFrame):
+        return DataFrameSource(X)
+    if isinstance(X, np.ndarray):
+        return ArraySource(X)
+    if isinstance(X, (str, os.PathLike)):
+        filename = os.fspath(X)
+        if os.path.isdir(filename):
+            return NpyDirSource(filename)
+        ext = os.path.splitext(filename)[1].lower()
+        if ext == '.npy':
+            return ArraySource(np.load(filename, mmap_mode='r'))
+        if ext in ('.parquet', '.pq'):
+            return ParquetSource(filename)
+        if ext in ('.arrow', '.feather', '.ipc'):
+            return ArrowSource(filename)
+        raise ValueError(f"Don't know how to read {filename}")
+    raise ValueError(f"Can't use {type(X).__name__} as a data source")
+
+
+def _import_pyarrow(module):
+    import importlib
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        raise ImportError("Reading Parquet or Arrow files requires pyarrow (pip install pyarrow)") from e
+
+
+def _files_fingerprint(filenames) -> str:
+    from stratx.cache import fingerprint
+    stats = [os.stat(filename) for filename in filenames]
+    return fingerprint([(os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+                        for filename, st in zip(filenames, stats)])
@@ -24,29 +24,38 @@ SOFTWARE.
 
 import numpy as np
 import pandas as pd
+import warnings
 
 from sklearn.utils import resample
 
-import matplotlib.pyplot as plt
-from matplotlib.collections import PatchCollection
-from matplotlib.patches import Rectangle
 
 import stratx.partdep as partdep
 import stratx.ice as ice
+from stratx.parallel import run_trials, trial_seeds, parallel_jit_safe, \
+    worker_numba_threads, with_numba_threads
+from stratx.datasource import DataSource, FeatureMatrix, as_datasource
+from stratx.cache import cached_call
+from stratx.lazy import LazyModule
 
 
 from timeit import default_timer as timer
 from joblib import parallel_backend, Parallel, delayed
-from matplotlib.ticker import FormatStrFormatter
 from os import getpid
 import tempfile
+from functools import partial
+from scipy import stats
 
-def importances(X: pd.DataFrame,
+# Only the plotting code needs matplotlib so don't load it until then
+plt = LazyModule('matplotlib.pyplot')
+mticker = LazyModule('matplotlib.ticker')
+
+def importances(X,
                 y: pd.Series,
                 catcolnames=set(),
                 sortby='Importance',  # sort by importance or impact
                 n_trials: int = 1,
                 min_slopes_per_x=5,   # ignore pdp y values derived from too few slopes (usually at edges); for smallerData sets, drop this to five or so
+                n_bins=None,          # bin numerical features into at most n_bins quantile bins
                 min_samples_leaf=15,
                 cat_min_samples_leaf=5,
                 drop_high_stddev=2.0,
@@ -57,11 +66,38 @@ def importances(X: pd.DataFrame,
                 rf_bootstrap=False, max_features=1.0,
                 pvalues=False,  # use to get p-values for each importance; it's number trials
                 pvalues_n_trials=80,
+                pvalues_h=None,  # stop shuffling a feature after h null importances reach it
                 supervised=True,
                 n_jobs=1,
+                backend='loky',
+                random_state=None,
+                stratcache=None,
+                stratifier=None,
+                cache_dir=None,
                 verbose=False) -> pd.DataFrame:
-    if not isinstance(X, pd.DataFrame):
-        raise ValueError("Can only operate on dataframes at the moment")
+    """
+    With n_trials>1, the bootstrap (or subsample) trials run in parallel using n_jobs
+    workers from joblib's backend ('loky' processes or 'threading'); otherwise,
+    n_jobs workers compute the features' importances in parallel. Set random_state
+    to get the same trials, and so the same importances, every time regardless of n_jobs.
+
+    X can be a dataframe or a DataSource such as an NpyDirSource or ArraySource on a
+    memory-mapped array, in which case we read only the columns needed at each
+    step. The categorical columns of a DataSource must already be compact integer
+    codes because compress_catcodes() only works on dataframes.
+
+    Pass a Stratifier (see stratifiers.py) to partition X not colname with something
+    other than the random forest, for both numerical and categorical features.
+
+    Pass cache_dir to keep the resulting importance table in a ResultCache on disk
+    (see cache.py); calling again with the same X, y, and arguments just loads it.
+    Caching needs a random_state; otherwise every call gives different importances.
+    """
+    if not isinstance(X, (pd.DataFrame, DataSource)):
+        raise ValueError("Can only operate on dataframes or DataSources")
+    if cache_dir is not None:
+        return cached_call(importances, locals(), unpack=False,
+                           ignore=('n_jobs', 'backend', 'stratcache', 'verbose'))
 
     print(f"PARAMETERS:")
     print(f"\tn=|X|                {len(X)}")
@@ -72,61 +108,67 @@ def importances(X: pd.DataFrame,
     print(f"\tbootstrap            {bootstrap}")
     print(f"\tn_trees              {n_trees}")
 
-    X = partdep.compress_catcodes(X, catcolnames)
-
-    n,p = X.shape
-    impact_trials = np.zeros(shape=(p, n_trials))
-    importance_trials = np.zeros(shape=(p, n_trials))
+    if isinstance(X, pd.DataFrame):
+        X = partdep.compress_catcodes(X, catcolnames)
+
+    # Parallelize trials if we have them, else parallelize across features
+    trial = partial(importances_,
+                    catcolnames=catcolnames,
+                    normalize=normalize,
+                    supervised=supervised,
+                    n_jobs=n_jobs if n_trials==1 else 1,
+                    backend=backend,
+                    parallel_jit=parallel_jit_safe(n_jobs, backend),
+                    n_trees=n_trees,
+                    min_samples_leaf=min_samples_leaf,
+                    cat_min_samples_leaf=cat_min_samples_leaf,
+                    min_slopes_per_x=min_slopes_per_x,
+                    n_bins=n_bins,
+                    rf_bootstrap=rf_bootstrap,
+                    max_features=max_features,
+                    stratcache=stratcache,
+                    stratifier=stratifier,
+                    verbose=verbose)
+    trials = run_trials(trial, X, y, n_trials=n_trials,
+                        bootstrap=bootstrap, subsample_size=subsample_size,
+                        random_state=random_state,
+                        n_jobs=n_jobs if n_trials>1 else 1,
+                        backend=backend)
     # track p var importances for ntrials; cols are trials
-    for i in range(n_trials):
-        if n_trials==1: # don't shuffle if not bootstrapping
-            idxs = range(n)
-        else:
-            if bootstrap:
-                idxs = resample(range(n), n_samples=n, replace=True) # bootstrap
-            else: # subsample
-                idxs = resample(range(n), n_samples=int(n*subsample_size), replace=False)
-        X_, y_ = X.iloc[idxs], y.iloc[idxs]
-        impacts, importances = importances_(X_, y_, catcolnames=catcolnames,
-                                            normalize=normalize,
-                                            supervised=supervised,
-                                            n_jobs=n_jobs,
-                                            n_trees=n_trees,
-                                            min_samples_leaf=min_samples_leaf,
-                                            cat_min_samples_leaf=cat_min_samples_leaf,
-                                            min_slopes_per_x=min_slopes_per_x,
-                                            rf_bootstrap=rf_bootstrap,
-                                            max_features=max_features,
-                                            verbose=verbose)
-        impact_trials[:,i] = impacts
-        importance_trials[:,i] = importances
+    impact_trials = np.array([impacts for impacts, _ in trials]).T
+    importance_trials = np.array([importances for _, importances in trials]).T
 
-    I = pd.DataFrame(data={'Feature': X.columns})
+    I = pd.DataFrame(data={'Feature': as_datasource(X).columns})
     I = I.set_index('Feature')
     I['Importance'] = np.mean(importance_trials, axis=1)
     I['Impact'] = np.mean(impact_trials, axis=1)
     I['Importance sigma'] = np.std(importance_trials, axis=1)
     I['Impact sigma'] = np.std(impact_trials, axis=1)
 
-    I['Impact p-value'] = 0.0
-    I['Importance p-value'] = 0.0
+    pvalue_colnames = ['Importance p-value', 'Importance p-value lo', 'Importance p-value hi',
+                       'Impact p-value', 'p-value shuffles']
+    for colname in pvalue_colnames:
+        I[colname] = 0.0
     if pvalues:
-        impact_pvalues, importance_pvalues = \
-            importances_pvalues(X, y, catcolnames,
-                                baseline_impacts=I['Impact'].values,
-                                baseline_importances=I['Importance'].values,
+        P = importances_pvalues(X, y, catcolnames,
                                 supervised=supervised,
-                                normalize=normalize,
                                 n_jobs=n_jobs,
+                                backend=backend,
+                                random_state=random_state,
+                                stratcache=stratcache,
+                                stratifier=stratifier,
                                 n_trials=pvalues_n_trials,
                                 min_slopes_per_x=min_slopes_per_x,
+                                n_bins=n_bins,
                                 n_trees=n_trees,
                                 min_samples_leaf=min_samples_leaf,
                                 cat_min_samples_leaf=cat_min_samples_leaf,
                                 rf_bootstrap=rf_bootstrap,
-                                max_features=max_features)
-        I['Impact p-value'] = importance_pvalues
-        I['Importance p-value'] = importance_pvalues
+                                max_features=max_features,
+                                h=pvalues_h,
+                                return_details=True)
+        for colname in pvalue_colnames:
+            I[colname] = P[colname]
         # I['Rank'] = I['Importance'] * (1.0 - importance_pvalues)
 
     if sortby:
@@ -143,12 +185,13 @@ def importances(X: pd.DataFrame,
     # I = I.drop('stable', axis=1)
 
     # Set reasonable column order
-    I = I[['Importance', 'Importance sigma', 'Importance p-value',
-           'Impact', 'Impact sigma', 'Impact p-value']]
+    I = I[['Importance', 'Importance sigma',
+           'Importance p-value', 'Importance p-value lo', 'Importance p-value hi',
+           'Impact', 'Impact sigma', 'Impact p-value', 'p-value shuffles']]
     if n_trials==1:
         I = I.drop(['Importance sigma', 'Impact sigma'], axis=1)
     if not pvalues:
-        I = I.drop(['Importance p-value', 'Impact p-value'], axis=1)
+        I = I.drop(pvalue_colnames, axis=1)
     return I
 
 
@@ -168,50 +211,74 @@ def Isortby(I, sortby, stddev_threshold=2.0, ascending=False):
     return I
 
 
-def importances_(X: pd.DataFrame, y: pd.Series, catcolnames=set(),
+def importances_(X, y: pd.Series, catcolnames=set(),
                  normalize=True,
                  supervised=True,
                  n_jobs=1,
+                 backend='loky',
+                 parallel_jit=True,
                  n_trees=1,
                  min_samples_leaf=10,
                  cat_min_samples_leaf=5,
                  min_slopes_per_x=5,
+                 n_bins=None,
                  rf_bootstrap=False, max_features=1.0,
+                 random_state=None,
+                 stratcache=None,
+                 stratifier=None,
                  verbose=False) -> np.ndarray:
-    if not isinstance(X, pd.DataFrame):
-        raise ValueError("Can only operate on dataframes at the moment")
+    """
+    Compute the impact and importance of each feature, in parallel across n_jobs
+    joblib workers from backend if n_jobs>1. Pass parallel_jit=False if we're
+    running inside a worker that can't run numba's parallel kernels; see
+    parallel_jit_safe().
+    """
+    if not isinstance(X, (pd.DataFrame, DataSource)):
+        raise ValueError("Can only operate on dataframes or DataSources")
 
     all_start = timer()
-
+    # Every feature's stratification reuses the one X not colname buffer, and
+    # all features share one y
+    if not isinstance(X, FeatureMatrix):
+        X = FeatureMatrix(X)
+    if not isinstance(y, pd.Series):
+        y = pd.Series(y)
+    colnames = X.columns
+    feature = partial(single_feature_importance, X, y,
+                      catcolnames=catcolnames,
+                      supervised=supervised,
+                      parallel_jit=parallel_jit and parallel_jit_safe(n_jobs, backend),
+                      n_trees=n_trees,
+                      min_samples_leaf=min_samples_leaf,
+                      cat_min_samples_leaf=cat_min_samples_leaf,
+                      min_slopes_per_x=min_slopes_per_x,
+                      n_bins=n_bins,
+                      rf_bootstrap=rf_bootstrap,
+                      max_features=max_features,
+                      random_state=random_state,
+                      stratcache=stratcache,
+                      stratifier=stratifier,
+                      verbose=verbose)
+
+    impacts = np.empty(shape=(len(colnames),))
+    importances = np.empty(shape=(len(colnames),))
     if n_jobs>1 or n_jobs==-1:
-        # Do n_jobs in parallel; in case it flips to shared mem, make it readonly
-        impacts_importances = Parallel(verbose=0, n_jobs=n_jobs, mmap_mode='r') \
-            (delayed(single_feature_importance)(X, y, colname,
-                                                catcolnames=catcolnames,
-                                                supervised=supervised,
-                                                n_jobs=n_jobs,
-                                                n_trees=n_trees,
-                                                min_samples_leaf=min_samples_leaf,
-                                                cat_min_samples_leaf=cat_min_samples_leaf,
-                                                min_slopes_per_x=min_slopes_per_x,
-                                                max_features=max_features,
-                                                verbose=verbose) for colname in X.columns)
+        if stratcache is not None:
+            X.fingerprint() # hash X once here, not once per feature in the workers
+        # Start the most expensive features first so one big feature doesn't
+        # finish long after the others (longest-processing-time-first scheduling).
+        # In case it flips to shared mem, make it readonly.
+        order = lpt_order(feature_costs(X, colnames))
+        n_threads = worker_numba_threads(n_jobs, backend)
+        results = Parallel(verbose=0, n_jobs=n_jobs, backend=backend, mmap_mode='r', batch_size=1) \
+            (delayed(with_numba_threads)(n_threads, feature, colnames[j]) for j in order)
     else:
-        impacts_importances = [single_feature_importance(X, y, colname,
-                                                         catcolnames=catcolnames,
-                                                         supervised=supervised,
-                                                         n_jobs=n_jobs,
-                                                         n_trees=n_trees,
-                                                         min_samples_leaf=min_samples_leaf,
-                                                         cat_min_samples_leaf=cat_min_samples_leaf,
-                                                         min_slopes_per_x=min_slopes_per_x,
-                                                         rf_bootstrap=rf_bootstrap,
-                                                         max_features=max_features,
-                                                         verbose=verbose) for colname in X.columns]
-
-    impacts_importances = np.array(impacts_importances)
-    impacts = impacts_importances[:,0]
-    importances = impacts_importances[:,1]
+        # Column order lets FeatureMatrix refill one column of its scratch buffer per feature
+        order = range(len(colnames))
+        results = (feature(colname) for colname in colnames)
+    for j, (impact, importance) in zip(order, results):
+        impacts[j] = impact
+        importances[j] = importance
 
     total_impact = np.sum(impacts)
     total_importance = np.sum(importances)
@@ -226,19 +293,42 @@ def importances_(X: pd.DataFrame, y: pd.Series, catcolnames=set(),
     return impacts, importances
 
 
-def single_feature_importance(X: pd.DataFrame, y: pd.Series,
+def feature_costs(X, colnames) -> np.ndarray:
+    """
+    Estimate the relative cost of computing each feature's importance. Fitting the
+    stratification forest costs about the same for every feature, so what varies is
+    the work per unique value: averaging slopes at each unique x or merging the
+    leaf deltas of each category. Use the number of unique values; it's a sort per
+    column and far cheaper than the features themselves.
+    """
+    src = as_datasource(X)
+    return np.array([len(np.unique(src.column(colname))) for colname in colnames])
+
+
+def lpt_order(costs) -> np.ndarray:
+    "Return job indexes in longest-processing-time-first order, ties in original order"
+    return np.argsort(-np.asarray(costs), kind='stable')
+
+
+def single_feature_importance(X, y: pd.Series,
                               colname,
                               catcolnames=set(),
                               supervised=True,
-                              n_jobs=1,
+                              parallel_jit=True,
                               n_trees=1,
                               min_samples_leaf=10,
                               cat_min_samples_leaf=5,
                               min_slopes_per_x=5,
+                              n_bins=None,
                               rf_bootstrap=False, max_features=1.0,
+                              random_state=None,
+                              stratcache=None,
+                              stratifier=None,
                               verbose=False):
     "Return impact=unweighted avg abs, importance=weighted avg abs"
-    X_col = X[colname].values.round(decimals=10)
+    X_col = np.asarray(as_datasource(X).column(colname)).round(decimals=10)
+    if n_bins is not None and colname not in catcolnames:
+        X_col = partdep.quantile_bins(X_col, n_bins) # weight pdpy by counts per bin
 
     #print(f"Start {'catvar' if (colname in catcolnames) else 'numerical'} {colname}")
     if colname in catcolnames:
@@ -248,6 +338,9 @@ def single_feature_importance(X: pd.DataFrame, y: pd.Series,
                                            min_samples_leaf=cat_min_samples_leaf,
                                            rf_bootstrap=rf_bootstrap,
                                            max_features=max_features,
+                                           random_state=random_state,
+                                           stratcache=stratcache,
+                                           stratifier=stratifier,
                                            verbose=verbose,
                                            supervised=supervised)
         impact, importance = cat_compute_importance(avg_per_cat, count_per_cat)
@@ -257,10 +350,14 @@ def single_feature_importance(X: pd.DataFrame, y: pd.Series,
                                        n_trees=n_trees,
                                        min_samples_leaf=min_samples_leaf,
                                        min_slopes_per_x=min_slopes_per_x,
+                                       n_bins=n_bins,
                                        rf_bootstrap=rf_bootstrap,
                                        max_features=max_features,
+                                       random_state=random_state,
+                                       stratcache=stratcache,
+                                       stratifier=stratifier,
                                        verbose=verbose,
-                                       parallel_jit=n_jobs == 1,
+                                       parallel_jit=parallel_jit,
                                        supervised=supervised)
         impact, importance = compute_importance(X_col, pdpx, pdpy)
     #print("IGNORED", ignored)
@@ -270,16 +367,20 @@ def single_feature_importance(X: pd.DataFrame, y: pd.Series,
 
 
 def compute_importance(X_col, pdpx, pdpy):
+    # pdpy can also be a matrix with one pdpy column per y, in which case
+    # we get vectors of impacts and importances back.
     # Weight pdpy values by how many X[colname] values there are at the associated pdpx
     _, count_at_uniq_x = np.unique(X_col[np.isin(X_col, pdpx)], return_counts=True)
+    if pdpy.ndim==2:
+        count_at_uniq_x = count_at_uniq_x.reshape(-1, 1)
     if len(count_at_uniq_x) > 0:
         # weighted average of pdpy using count_at_uniq_x
-        weighted_avg_abs_pdp = np.sum(np.abs(pdpy * count_at_uniq_x)) / np.sum(count_at_uniq_x)
+        weighted_avg_abs_pdp = np.sum(np.abs(pdpy * count_at_uniq_x), axis=0) / np.sum(count_at_uniq_x)
     else:
-        weighted_avg_abs_pdp = np.mean(np.abs(pdpy))
+        weighted_avg_abs_pdp = np.mean(np.abs(pdpy), axis=0)
 
     # unweighted
-    avg_abs_pdp = np.mean(np.abs(pdpy))
+    avg_abs_pdp = np.mean(np.abs(pdpy), axis=0)
     return avg_abs_pdp, weighted_avg_abs_pdp
 
 
@@ -299,16 +400,21 @@ def cat_compute_importance(avg_per_cat, count_per_cat):
     # in one leaf means we know exact deltas between categories; more specifically
     # between avg y at each category. By mean-centering a marginal plot, we take
     # the same shape down from y-intercept and make it 0. Then they look the same.
-    centered_avg_per_cat = avg_per_cat.copy() - np.nanmean(avg_per_cat)
+    #
+    # avg_per_cat can also be a matrix with one column per y, in which case
+    # we get vectors of impacts and importances back.
+    centered_avg_per_cat = avg_per_cat.copy() - np.nanmean(avg_per_cat, axis=0)
+    if avg_per_cat.ndim==2:
+        count_per_cat = count_per_cat.reshape(-1, 1)
 
     # weight each cat value by how many were used to create it
     abs_avg_per_cat = np.abs(centered_avg_per_cat)
-    weighted_avg_abs_pdp = np.nansum(abs_avg_per_cat * count_per_cat) / np.sum(count_per_cat)
+    weighted_avg_abs_pdp = np.nansum(abs_avg_per_cat * count_per_cat, axis=0) / np.sum(count_per_cat)
 
     # do unweighted
     # some cats have NaN, such as 0th which is often for "missing values"
     # depending on label encoding scheme.
-    avg_abs_pdp = np.nanmean(abs_avg_per_cat)
+    avg_abs_pdp = np.nanmean(abs_avg_per_cat, axis=0)
     return avg_abs_pdp, weighted_avg_abs_pdp
 
 
@@ -390,60 +496,192 @@ def all_pairs_deltas_foo(avg_per_cat):
     return all_pairwise_deltas
 '''
 
-def importances_pvalues(X: pd.DataFrame,
+def importances_pvalues(X,
                         y: pd.Series,
                         catcolnames=set(),
-                        baseline_impacts=None,
-                        baseline_importances=None, # importances to use as baseline; must be in X column order!
+                        baseline_impacts=None,     # deprecated; see below
+                        baseline_importances=None, # deprecated
                         supervised=True,
-                        normalize=True,
+                        normalize=None,            # deprecated
                         n_jobs=1,
+                        backend='loky',
                         n_trials: int = 1,
                         min_slopes_per_x=5,
+                        n_bins=None,
                         n_trees=1,
                         min_samples_leaf=10,
                         cat_min_samples_leaf=5,
                         rf_bootstrap=False,
-                        max_features=1.0):
+                        max_features=1.0,
+                        batch_size=20,
+                        alpha=0.05,
+                        early_stopping=True,
+                        h=None,
+                        random_state=None,
+                        stratcache=None,
+                        stratifier=None,
+                        return_details=False):
     """
     For each feature, compute and return empirical p-values.  The idea is to shuffle y
     and then compute feature importances; do this repeatedly to get a null distribution.
     The importances for feature j form a distribution and we can count how many times the
     importance value (obtained with shuffled y) reaches the importance value computed
     using unshuffled y.
+
+    Shuffling y doesn't change X so, for each feature, we fit the stratification
+    forest (on unshuffled y) once and reuse its leaves for all n_trials shuffles,
+    computing the partial dependence for batch_size shuffles at a time; see
+    partdep.partial_dependence_batch(). Each feature is tested on its own, comparing
+    its raw (not normalized) importance to the raw importance from the same leaves and
+    unshuffled y, so normalize, baseline_impacts, and baseline_importances no
+    longer matter; passing them gets a DeprecationWarning. With n_bins, numerical
+    features are binned as in partial_dependence() so the shuffled and real
+    importances use the same x grid as importances(..., n_bins=n_bins). Likewise,
+    a stratifier (see stratifiers.py) partitions X not colname instead of the
+    forest, as in importances(), so p-values test the same partitioning. With
+    early_stopping, we stop shuffling for a feature once the confidence interval
+    around its p-value is clearly above or below alpha.
+
+    If h is not None, we also use Besag and Clifford's sequential rule ("Sequential
+    Monte Carlo p-values", Biometrika 1991): stop shuffling as soon as h shuffled
+    importances reach the real importance and report p-value h/n for the n shuffles
+    it took. Unimportant features hit h exceedances after about h/p shuffles so, with h=10,
+    a useless feature costs 10-20 shuffles rather than n_trials. Features that
+    never reach h exceedances get the usual (r+1)/(n_trials+1).
+
+    Features are tested in parallel if n_jobs>1, using joblib's backend ('loky'
+    processes or 'threading') and capping each worker's numba threads as
+    importances_() does.
+
+    Returns impact p-values and importance p-values in X column order. If
+    return_details, return a dataframe indexed by feature instead, with the p-values,
+    a 95% Clopper-Pearson interval around the importance p-value, and how many
+    shuffles each feature needed. The exact binomial interval assumes the number of
+    shuffles was fixed ahead of time, which isn't true for a feature we stopped
+    early (by h or early_stopping), so those features get NaN for lo and hi. Their
+    p-value is still reported; with h, it's Besag and Clifford's h/n, which is valid
+    for a sequentially chosen n.
     """
-    if baseline_importances is None or baseline_impacts is None:
-        baseline_impacts, baseline_importances = \
-            importances_(X, y, catcolnames=catcolnames,
-                         normalize=normalize,
-                         supervised=supervised,
-                         n_jobs=n_jobs,
+    if baseline_impacts is not None or baseline_importances is not None or normalize is not None:
+        warnings.warn("importances_pvalues() ignores baseline_impacts, baseline_importances, "
+                      "and normalize; each feature is compared to its own raw importance",
+                      DeprecationWarning, stacklevel=2)
+    if not isinstance(X, FeatureMatrix):
+        X = FeatureMatrix(X)
+    colnames = X.columns
+    seeds = trial_seeds(len(colnames), random_state)
+    kwargs = dict(catcolnames=catcolnames,
+                  supervised=supervised,
+                  n_trials=n_trials,
+                  min_slopes_per_x=min_slopes_per_x,
+                  n_bins=n_bins,
+                  n_trees=n_trees,
+                  min_samples_leaf=min_samples_leaf,
+                  cat_min_samples_leaf=cat_min_samples_leaf,
+                  rf_bootstrap=rf_bootstrap,
+                  max_features=max_features,
+                  batch_size=batch_size,
+                  alpha=alpha,
+                  early_stopping=early_stopping,
+                  h=h,
+                  stratcache=stratcache,
+                  stratifier=stratifier)
+    if n_jobs>1 or n_jobs==-1:
+        if stratcache is not None:
+            X.fingerprint() # hash X once here, not once per feature in the workers
+        order = lpt_order(feature_costs(X, colnames)) # biggest features first
+        n_threads = worker_numba_threads(n_jobs, backend)
+        results = Parallel(verbose=0, n_jobs=n_jobs, backend=backend, mmap_mode='r', batch_size=1) \
+            (delayed(with_numba_threads)(n_threads, single_feature_pvalues,
+                                         X, y, colnames[j], random_state=seeds[j], **kwargs)
+             for j in order)
+        pvalues = [None] * len(colnames)
+        for j, result in zip(order, results):
+            pvalues[j] = result
+    else:
+        pvalues = [single_feature_pvalues(X, y, colname, random_state=seed, **kwargs)
+                   for colname, seed in zip(colnames, seeds)]
+
+    pvalues = pd.DataFrame(pvalues, index=colnames)
+    pvalues.index.name = 'Feature'
+    if return_details:
+        return pvalues
+    return pvalues['Impact p-value'].values, pvalues['Importance p-value'].values
+
+
+def single_feature_pvalues(X, y: pd.Series,
+                           colname,
+                           catcolnames=set(),
+                           supervised=True,
+                           n_trials: int = 1,
+                           min_slopes_per_x=5,
+                           n_bins=None,
+                           n_trees=1,
+                           min_samples_leaf=10,
+                           cat_min_samples_leaf=5,
+                           rf_bootstrap=False,
+                           max_features=1.0,
+                           batch_size=20,
+                           alpha=0.05,
+                           early_stopping=True,
+                           h=None,
+                           random_state=None,
+                           stratcache=None,
+                           stratifier=None) -> dict:
+    "Return dict with impact, importance p-values etc... for X[colname]; see importances_pvalues()"
+    is_catcol = colname in catcolnames
+    leaf_offsets, leaf_sample_idxs = \
+        partdep.stratify(X, y, colname,
                          n_trees=n_trees,
-                         min_samples_leaf=min_samples_leaf,
-                         cat_min_samples_leaf=cat_min_samples_leaf,
-                         min_slopes_per_x=min_slopes_per_x,
+                         min_samples_leaf=cat_min_samples_leaf if is_catcol else min_samples_leaf,
                          rf_bootstrap=rf_bootstrap,
-                         max_features=max_features)
-
-    impact_counts = np.zeros(shape=X.shape[1])
-    importance_counts = np.zeros(shape=X.shape[1])
-    for i in range(n_trials):
-        impacts, importances = importances_(X, y.sample(frac=1.0, replace=False),
-                                            catcolnames=catcolnames,
-                                            normalize=normalize,
-                                            supervised=supervised,
-                                            n_jobs=n_jobs,
-                                            n_trees=n_trees,
-                                            min_samples_leaf=min_samples_leaf,
-                                            cat_min_samples_leaf=cat_min_samples_leaf,
-                                            min_slopes_per_x=min_slopes_per_x,
-                                            rf_bootstrap=rf_bootstrap,
-                                            max_features=max_features)
-        # print("Shuffled impacts\n",impacts)
-        # print("Shuffled importances\n",importances)
-        # print("Counts\n", impacts >= I_baseline['Impact'].values)
-        impact_counts += impacts >= baseline_impacts
-        importance_counts += importances >= baseline_importances
+                         max_features=max_features,
+                         supervised=supervised,
+                         random_state=random_state,
+                         stratcache=stratcache,
+                         stratifier=stratifier)
+    X_col = np.asarray(as_datasource(X).column(colname))
+    if n_bins is not None and not is_catcol:
+        # same x grid as partial_dependence(..., n_bins=n_bins)
+        X_col = partdep.quantile_bins(X_col.round(decimals=10), n_bins)
+
+    def impacts_importances(Y):
+        if is_catcol:
+            avg_per_cat, count_per_cat = \
+                partdep.cat_partial_dependence_batch(X_col, Y, leaf_offsets, leaf_sample_idxs)
+            return cat_compute_importance(avg_per_cat, count_per_cat)
+        pdpx, pdpy, ignored = \
+            partdep.partial_dependence_batch(X_col, Y, leaf_offsets, leaf_sample_idxs,
+                                             min_slopes_per_x=min_slopes_per_x)
+        return compute_importance(X_col.round(decimals=10), pdpx, pdpy)
+
+    y = np.asarray(y)
+    baseline_impact, baseline_importance = impacts_importances(y.reshape(-1, 1))
+    baseline = np.array([baseline_impact, baseline_importance]).reshape(2, 1)
+
+    # Track impact (row 0) and importance (row 1) separately; each stops on its own
+    rng = np.random.default_rng(random_state)
+    counts = np.zeros(shape=2, dtype=int)  # how many shuffles reached the baseline
+    ns = np.zeros(shape=2, dtype=int)      # out of how many shuffles
+    done = np.zeros(shape=2, dtype=bool)
+    reached_h = np.zeros(shape=2, dtype=bool)
+    n_shuffles = 0
+    while n_shuffles < n_trials and not done.all():
+        b = min(batch_size, n_trials - n_shuffles)
+        Y = rng.permuted(np.tile(y, (b, 1)), axis=1).T # each column is a shuffled y
+        exceeds = np.array(impacts_importances(Y)) >= baseline
+        for k in np.where(~done)[0]:
+            running_counts = counts[k] + np.cumsum(exceeds[k])
+            if h is not None and running_counts[-1] >= h:
+                # Stop at the shuffle that got the hth exceedance, even mid-batch
+                i = np.argmax(running_counts >= h)
+                counts[k], ns[k] = h, n_shuffles + i + 1
+                done[k] = reached_h[k] = True
+            else:
+                counts[k], ns[k] = running_counts[-1], n_shuffles + b
+                if early_stopping:
+                    done[k] = pvalue_decided(counts[k], ns[k], alpha)
+        n_shuffles += b
 
     # https://www.ncbi.nlm.nih.gov/pmc/articles/PMC379178/ says don't use r/n
     # "Typically, the estimate of the P value is obtained as equation p_hat = r/n, where n
@@ -451,16 +689,46 @@ def importances_pvalues(X: pd.DataFrame,
     # of these replicates that produce a test statistic greater than or equal to that
     # calculated for the actual data. However, Davison and Hinkley (1997) give the
     # correct formula for obtaining an empirical P value as (r+1)/(n+1)."
-    impact_pvalues = (impact_counts + 1) / (n_trials + 1)
-    importance_pvalues = (importance_counts + 1) / (n_trials + 1)
-
-    return impact_pvalues, importance_pvalues
+    # Besag-Clifford's h/n is the exception, once we have seen h exceedances.
+    pvalues = np.where(reached_h, counts / np.maximum(ns, 1), (counts + 1) / (ns + 1))
+    if ns[1] == n_trials:
+        lo, hi = clopper_pearson(counts[1], ns[1])
+    else: # n depends on the counts so the exact interval would under-cover
+        lo, hi = np.nan, np.nan
+    return {'Impact p-value': pvalues[0],
+            'Importance p-value': pvalues[1],
+            'Importance p-value lo': lo,
+            'Importance p-value hi': hi,
+            'p-value shuffles': ns.max()}
+
+
+def clopper_pearson(count, n, confidence=0.95):
+    "Return the exact binomial confidence interval around count/n"
+    if n == 0:
+        return 0.0, 1.0
+    a = 1 - confidence
+    lo = stats.beta.ppf(a / 2, count, n - count + 1) if count > 0 else 0.0
+    hi = stats.beta.ppf(1 - a / 2, count + 1, n - count) if count < n else 1.0
+    return lo, hi
+
+
+def pvalue_decided(count, n, alpha, z=2.576):
+    """
+    Return true if the (99% by default) Wilson score interval around the
+    p-value estimate count/n lies entirely above or below alpha. Then more
+    shuffles won't change the conclusion.
+    """
+    p = count / n
+    center = (p + z*z / (2*n)) / (1 + z*z / n)
+    halfwidth = z * np.sqrt(p * (1 - p) / n + z*z / (4*n*n)) / (1 + z*z / n)
+    return center - halfwidth > alpha or center + halfwidth < alpha
 
 
 def pdp_importances(model,X,numx=30,normalize=True):
     """
     Use standard PDP then mean center and take average magnitude as impact. Return
-    an importance dataframe
+    an importance dataframe. For sklearn tree and forest regressors, the PDPs come
+    from walking the trees rather than calling predict(); see treepd.py.
     """
     pdpxs,pdpys = ice.friedman_partial_dependences(model, X, numx=numx, mean_centered=True)
     I = pd.DataFrame(data={'Feature': X.columns})
@@ -609,7 +877,7 @@ def plot_importances(df_importances,
         ax.set_title(title, fontsize=title_fontsize, fontname=fontname, color=GREY, pad=0)
 
     #ax.invert_yaxis()  # labels read top-to-bottom
-    ax.xaxis.set_major_formatter(FormatStrFormatter(f'%.{xtick_precision}f'))
+    ax.xaxis.set_major_formatter(mticker.FormatStrFormatter(f'%.{xtick_precision}f'))
     ax.set_xlim(*imp_range)
     if xlabel is not None:
         ax.set_xlabel(xlabel)
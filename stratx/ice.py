@@ -24,10 +24,16 @@ SOFTWARE.
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from  matplotlib.collections import LineCollection
 import time
 
+import stratx.partdep as partdep
+from stratx.lazy import LazyModule
+from stratx.treepd import tree_regressors, tree_partial_dependence, tree_ice
+
+# Only the plotting functions need matplotlib so don't load it until then
+plt = LazyModule('matplotlib.pyplot')
+mcollections = LazyModule('matplotlib.collections')
+
 """
 This code was built just to generate ICE plots for comparison in the paper.
 We just hacked it together.
@@ -56,25 +62,23 @@ def friedman_partial_dependences(model,X,numx=100,mean_centered=True):
     return pdpxs, pdpys
 
 
-def friedman_partial_dependence(model,X,colname,numx=100,mean_centered=True):
+def friedman_partial_dependence(model,X,colname,numx=100,mean_centered=True,max_bytes=256*2**20):
     """
     Return the partial dependence curve for y on X[colname] using all
     unique x values. For each unique x, replace entire X[colname] with
     it then compute average prediction. That is PDP for that x.
+    For sklearn tree and forest regressors, we get the exact same curve by walking
+    the trees instead (see treepd.py); otherwise, see predict_at_values() for max_bytes.
     """
-    save_x = X[colname].copy()
     if numx is not None:
         uniq_x = np.random.choice(X[colname], numx)
     else:
         uniq_x = np.unique(X[colname])
     pdpx = uniq_x
-    pdpy = np.empty(shape=(len(uniq_x),))
-    for i,x in enumerate(uniq_x):
-        X[colname] = x
-    #     print(X)
-        y_pred = model.predict(X)
-        pdpy[i] = y_pred.mean()
-    X[colname] = save_x
+    if tree_regressors(model) is not None:
+        pdpy = tree_partial_dependence(model, X, colname, uniq_x)
+    else:
+        pdpy = predict_at_values(model, X, colname, uniq_x, max_bytes=max_bytes).mean(axis=1)
     if mean_centered:
         pdpy = pdpy - np.mean(pdpy)
     return pdpx, pdpy
@@ -86,12 +90,11 @@ def original_pdp(model, X, colname):
     Attempt is made to get first pdp y to 0.
     """
     ice = predict_ice(model, X, colname)
-    #  Row 0 is actually the sorted unique X[colname] values used to get predictions.
-    pdp_curve = np.mean(ice[1:], axis=0)
+    pdp_curve = ice.pdp()
     min_pdp_y = pdp_curve[0]
     # if 0 is in x feature and not on left/right edge, get y at 0
     # and shift so that is x,y 0 point.
-    linex = ice.iloc[0, :]  # get unique x values from first row
+    linex = ice.linex
     nx = len(linex)
     if linex[int(nx * 0.05)] < 0 or linex[-int(nx * 0.05)] > 0:
         closest_x_to_0 = np.argmin(
@@ -99,7 +102,7 @@ def original_pdp(model, X, colname):
         min_pdp_y = pdp_curve[closest_x_to_0]
 
     pdp_curve -= min_pdp_y
-    return pdp_curve.values
+    return pdp_curve
 
 
 def original_catpdp(model, X, colname):
@@ -108,38 +111,107 @@ def original_catpdp(model, X, colname):
     Attempt is made to get first pdp y to 0.
     """
     ice = predict_catice(model, X, colname)
-    #  Row 0 is actually the sorted unique X[colname] values used to get predictions.
-    pdp_curve = np.mean(ice[1:], axis=0)
+    return ice.pdp()
 
-    return pdp_curve.values
 
-
-def predict_catice(model, X:pd.DataFrame, colname:str, targetname="target", cats=None, ncats=None):
+def predict_catice(model, X:pd.DataFrame, colname:str, targetname="target", cats=None, ncats=None,
+                   random_state=None):
     if cats is None:
         cats = np.unique(X[colname]) # get unique codes
     return predict_ice(model=model, X=X, colname=colname, targetname=targetname,
-                       cats=cats, nlines=ncats)
+                       cats=cats, nlines=ncats, random_state=random_state)
 
 
-def predict_ice(model, X:pd.DataFrame, colname:str, targetname="target", cats=None, numx=50, nlines=None):
+class ICE:
+    """
+    The ICE lines from predict_ice(). linex holds the X[colname] values where we
+    predicted and lines[i] holds the predictions at those values for observation
+    rows[i] of X. The lines are kept as one float32 (nlines, len(linex), 2) array of
+    [x,y] points, ready for a LineCollection, so ice2lines() just returns it
+    and lines is a view of its y coordinates.
+    """
+    def __init__(self, linex, points, colname, targetname="target", rows=None):
+        self.points = points
+        self.linex = linex
+        self.colname = colname
+        self.targetname = targetname
+        self.rows = rows
+
+    @property
+    def linex(self) -> np.ndarray:
+        return self._linex
+
+    @linex.setter
+    def linex(self, linex):
+        "Relabel the x values, such as when the model saw normalized X[colname]"
+        self._linex = np.asarray(linex, dtype=float)
+        self.points[:, :, 0] = self._linex
+
+    @property
+    def lines(self) -> np.ndarray:
+        return self.points[:, :, 1]
+
+    def pdp(self) -> np.ndarray:
+        "Average of the ICE lines, which is the Friedman partial dependence for the sampled rows"
+        return np.mean(self.lines, axis=0, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.points)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Return the older dataframe layout: one column per linex value and one row per
+        line, plus row 0 holding linex.
+        """
+        columns = [f"predicted {self.targetname}\n{self.colname}={str(v)}" for v in self.linex]
+        return pd.DataFrame(np.vstack([self.linex, self.lines]), columns=columns)
+
+
+def predict_at_values(model, X:pd.DataFrame, colname:str, values, max_bytes=256*2**20) -> np.ndarray:
     """
-    Return dataframe with one row per observation in X and one column
-    per unique value of column identified by colname.
-    Row 0 is actually the sorted unique X[colname] values used to get predictions.
-    It's handy to have so we don't have to pass X around to other methods.
-    Points in a single ICE line are the unique values of colname zipped
-    with one row of returned dataframe. E.g.,
-
-    	predicted weight          predicted weight         ...
-    	height=62.3638789416112	  height=62.78667197542318 ...
-    0	62.786672	              70.595222                ... unique X[colname] values
-    1	109.270644	              161.270843               ...
+    Return a (len(values), len(X)) matrix whose row i holds model.predict() of X
+    with all of X[colname] set to values[i]. Rather than call predict once per value,
+    we stack copies of X, one per value, into a single design matrix and call
+    predict once per chunk of values; each chunk holds as many values as fit in
+    max_bytes of design matrix, at least one. That cuts per-call overhead, which
+    dominates for tree ensembles. X is not modified.
+    """
+    values = np.asarray(values)
+    n = len(X)
+    chunk_bytes_per_value = max(1, X.memory_usage(index=False).sum())
+    values_per_chunk = int(max(1, max_bytes // chunk_bytes_per_value))
+    preds = np.empty(shape=(len(values), n))
+    for start in range(0, len(values), values_per_chunk):
+        chunk = values[start:start+values_per_chunk]
+        k = len(chunk)
+        stacked = pd.DataFrame({c: np.repeat(chunk, n) if c==colname else np.tile(X[c].values, k)
+                                for c in X.columns})
+        preds[start:start+k] = np.asarray(model.predict(stacked)).reshape(k, n)
+    return preds
+
+
+def predict_ice(model, X:pd.DataFrame, colname:str, targetname="target", cats=None, numx=50, nlines=None,
+                max_bytes=256*2**20, random_state=None) -> ICE:
+    """
+    Return an ICE object with one line per observation in X, or per nlines randomly
+    chosen observations, giving the model's prediction as we sweep X[colname] across
+    numx evenly spaced values (or the cats, or all unique values if numx is None).
+    E.g., ice.linex might be heights 62.36, 62.78, ... and ice.lines[0] the
+    predicted weights 109.27, 161.27, ... for the first sampled observation.
+
+    We sample the nlines observations before predicting and then predict a chunk of
+    rows at a time, writing into a preallocated float32 array, so that the design
+    matrices and temporary predictions stay within about max_bytes. The model sees
+    all of a chunk's grid values in one predict() call; see predict_at_values(). For
+    sklearn tree and forest regressors, we walk the trees instead of calling
+    predict(); see treepd.py.
     """
     start = time.time()
-    save = X[colname].copy()
 
-    if nlines is not None and nlines > len(X):
-        nlines = len(X)
+    rows = np.arange(len(X))
+    if nlines is not None and nlines < len(X):
+        rs = np.random.RandomState(random_state)
+        rows = np.sort(rs.choice(len(X), size=nlines, replace=False))
 
     if cats is not None:
         linex = np.unique(cats)
@@ -149,68 +221,59 @@ def predict_ice(model, X:pd.DataFrame, colname:str, targetname="target", cats=No
     else:
         linex = sorted(X[colname].unique())
 
-    lines = np.zeros(shape=(len(X) + 1, len(linex)))
-    lines[0, :] = linex
-    i = 0
-    for v in linex:
-        X[colname] = v
-        y_pred = model.predict(X)
-        lines[1:, i] = y_pred.flatten()
-        i += 1
-    X[colname] = save
-    columns = [f"predicted {targetname}\n{colname}={str(v)}"
-               for v in linex]
-    df = pd.DataFrame(lines, columns=columns)
-
-    if nlines is not None:
-        # sample lines (first row is special: linex)
-        df_ = pd.DataFrame(lines)
-        df_ = df_.sample(n=nlines, axis=0, replace=False)
-        lines = df_.values
-        lines = np.concatenate([linex.reshape(1,-1),lines], axis=0)
-        df = pd.DataFrame(lines, columns=columns)
+    linex = np.asarray(linex)
+    points = np.empty(shape=(len(rows), len(linex), 2), dtype=np.float32)
+    use_trees = tree_regressors(model) is not None
+    # Each row costs its bytes in the design matrix plus a float64 prediction per linex value
+    X_row_bytes = X.memory_usage(index=False).sum() / max(len(X), 1)
+    chunk_rows = int(max(1, max_bytes // (len(linex) * (X_row_bytes + 8) + 1)))
+    for i in range(0, len(rows), chunk_rows):
+        X_chunk = X.iloc[rows[i:i+chunk_rows]]
+        if use_trees:
+            preds = tree_ice(model, X_chunk, colname, linex)
+        else:
+            preds = predict_at_values(model, X_chunk, colname, linex, max_bytes=max_bytes)
+        points[i:i+chunk_rows, :, 1] = preds.T
+    ice = ICE(linex, points, colname, targetname, rows)
 
     stop = time.time()
     print(f"ICE_predict {stop - start:.3f}s")
-    return df
+    return ice
 
 
-def ice2lines(ice:np.ndarray) -> np.ndarray:
+def ice2lines(ice:ICE) -> np.ndarray:
     """
     Return a 3D array of 2D matrices holding X coordinates in col 0 and
     Y coordinates in col 1. result[0] is first 2D matrix of [X,Y] points
     in a single ICE line for single observations. Shape of result is:
-    (nobservations,nuniquevalues,2)
+    (nobservations,nuniquevalues,2). That's how ICE stores them so this
+    doesn't copy anything; don't modify the result.
     """
-    start = time.time()
-    linex = ice.iloc[0,:] # get unique x values from first row
-    # If needed, apply_along_axis() is faster than the loop
-    # def getline(liney): return np.array(list(zip(linex, liney)))
-    # lines = np.apply_along_axis(getline, axis=1, arr=ice.iloc[1:])
-    lines = []
-    for i in range(1,len(ice)): # ignore first row
-        liney = ice.iloc[i].values
-        line = np.array(list(zip(linex, liney)))
-        lines.append(line)
-    stop = time.time()
-    # print(f"ICE_lines {stop - start:.3f}s")
-    return np.array(lines)
+    return ice.points
 
 
 def plot_ice(ice, colname, targetname="target", ax=None, linewidth=.5, linecolor='#9CD1E3',
              min_y_shifted_to_zero=False, # easier to read if values are relative to 0 (usually)
              alpha=.1, title=None, xrange=None, yrange=None, pdp=True, pdp_linewidth=.5, pdp_alpha=1,
-             pdp_color='black', show_xlabel=True, show_ylabel=True):
+             pdp_color='black', show_xlabel=True, show_ylabel=True,
+             render='vector', hist_bins=100, hist_cmap='Blues'):
+    """
+    Plot the ICE lines in ice, from predict_ice(), as one LineCollection plus the
+    average (PDP) line. For very many lines, set render='raster' to keep vector
+    output (svg, pdf) small by rasterizing the lines, or render='hist2d' to draw the
+    density of the lines' points instead: a hist_bins-tall histogram at each linex
+    value shown as a single image, so plotting costs the same no matter how many lines.
+    """
     start = time.time()
     if ax is None:
         fig, ax = plt.subplots(1,1)
 
-    avg_y = np.mean(ice[1:], axis=0)
+    avg_y = ice.pdp()
 
     min_pdp_y = avg_y[0]
     # if 0 is in x feature and not on left/right edge, get y at 0
     # and shift so that is x,y 0 point.
-    linex = ice.iloc[0,:] # get unique x values from first row
+    linex = ice.linex
     nx = len(linex)
     if linex[int(nx*0.05)]<0 or linex[-int(nx*0.05)]>0:
         closest_x_to_0 = np.argmin(np.abs(np.array(linex - 0.0))) # do argmin w/o depr warning
@@ -218,7 +281,7 @@ def plot_ice(ice, colname, targetname="target", ax=None, linewidth=.5, linecolor
 
     lines = ice2lines(ice)
     if min_y_shifted_to_zero:
-        lines[:,:,1] = lines[:,:,1] - min_pdp_y
+        lines = lines - np.array([0, min_pdp_y], dtype=lines.dtype) # don't touch ice's points
     # lines[:,:,0] scans all lines, all points in a line, and gets x column
     minx, maxx = np.min(lines[:,:,0]), np.max(lines[:,:,0])
     miny, maxy = np.min(lines[:,:,1]), np.max(lines[:,:,1])
@@ -232,15 +295,20 @@ def plot_ice(ice, colname, targetname="target", ax=None, linewidth=.5, linecolor
         ax.set_ylabel(targetname)
     if title is not None:
         ax.set_title(title)
-    lines = LineCollection(lines, linewidth=linewidth, alpha=alpha, color=linecolor)
-    ax.add_collection(lines)
+    if render=='hist2d':
+        plot_density(ax, lines[:,:,0].ravel(), lines[:,:,1].ravel(),
+                     xedges=bin_edges(linex), ybins=hist_bins, cmap=hist_cmap)
+    else:
+        lines = mcollections.LineCollection(lines, linewidth=linewidth, alpha=alpha, color=linecolor,
+                                            rasterized=render=='raster')
+        ax.add_collection(lines)
 
     if xrange is not None:
         ax.set_xlim(*xrange)
     # else:
     #     ax.set_xlim(minx, maxx)
 
-    uniq_x = ice.iloc[0, :]
+    uniq_x = ice.linex
     if min_y_shifted_to_zero:
         pdp_curve = avg_y - min_pdp_y
     else:
@@ -254,6 +322,25 @@ def plot_ice(ice, colname, targetname="target", ax=None, linewidth=.5, linecolor
     # print(f"plot_ICE {stop - start:.3f}s")
     return uniq_x, pdp_curve
 
+def bin_edges(centers) -> np.ndarray:
+    "Return histogram bin edges halfway between sorted centers, with outer bins as wide as their neighbors"
+    centers = np.asarray(centers, dtype=float)
+    if len(centers)==1:
+        return np.array([centers[0]-.5, centers[0]+.5])
+    mids = (centers[1:] + centers[:-1]) / 2
+    return np.concatenate([[2*centers[0] - mids[0]], mids, [2*centers[-1] - mids[-1]]])
+
+
+def plot_density(ax, x, y, xedges, ybins=100, cmap='Blues'):
+    """
+    Draw the 2D histogram of points (x,y) as a single mesh with empty bins left
+    blank. It costs O(len(x)) to bin and the same to draw regardless of len(x).
+    """
+    counts, xedges, yedges = np.histogram2d(x, y, bins=[xedges, ybins])
+    counts = np.ma.masked_equal(counts, 0)
+    return ax.pcolormesh(xedges, yedges, counts.T, cmap=cmap, shading='flat')
+
+
 def plot_catice(ice, colname, targetname,
                 catnames,  # cat names indexed by cat code
                 ax=None,
@@ -264,26 +351,31 @@ def plot_catice(ice, colname, targetname,
                 pdp_color='black',
                 marker_size=10,
                 show_xlabel=True, show_ylabel=True,
-                show_xticks=True):
+                show_xticks=True,
+                render='vector', hist_bins=100, hist_cmap='Blues'):
+    """
+    Plot each observation's predictions in ice, from predict_catice(), as dots
+    at each category, all in one scatter call, plus the average (PDP) dots.
+    render='raster' rasterizes the dots and render='hist2d' draws their density
+    per category as a single image instead; see plot_ice().
+    """
     start = time.time()
     if ax is None:
         fig, ax = plt.subplots(1,1)
 
     ncats = len(catnames)
 
-    avg_y = np.mean(ice[1:], axis=0)
-
     lines = ice2lines(ice)
 
     nobs = lines.shape[0]
 
-    catcodes, _, catcode2name = getcats(None, colname, catnames)
+    catcodes, _, catcode2name = partdep.getcats(None, colname, catnames)
 
-    avg_y = np.mean(ice[1:], axis=0)
+    avg_y = ice.pdp()
     min_pdp_y = np.min(avg_y)
     # min_pdp_y = 0
 
-    lines[:,:,1] = lines[:,:,1] - min_pdp_y
+    lines = lines - np.array([0, min_pdp_y], dtype=lines.dtype) # don't touch ice's points
     pdp_curve = avg_y - min_pdp_y
 
     # plot predicted values for each category at each observation point
@@ -292,10 +384,14 @@ def plot_catice(ice, colname, targetname,
     else:
         xlocs = np.arange(1,ncats+1)
     # print(f"shape {lines.shape}, ncats {ncats}, nx {nx}, len(pdp) {len(pdp_curve)}")
-    for i in range(nobs): # for each observation
-        ax.scatter(xlocs, lines[i,:,1], # lines[i] is ith observation
-                   alpha=alpha, marker='o', s=marker_size,
-                   c=color)
+    # All observations' dots at once: row i of lines is ith observation
+    x = np.tile(xlocs, nobs)
+    y = lines[:,:,1].ravel()
+    if render=='hist2d':
+        plot_density(ax, x, y, xedges=bin_edges(xlocs), ybins=hist_bins, cmap=hist_cmap)
+    else:
+        ax.scatter(x, y, alpha=alpha, marker='o', s=marker_size, c=color,
+                   rasterized=render=='raster')
 
     pdpy = pdp_curve
     if min_y_shifted_to_zero:
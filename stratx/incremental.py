@@ -0,0 +1,290 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import pickle
+
+import numpy as np
+from numba import jit
+from scipy.sparse import csc_matrix
+
+import stratx.partdep as partdep
+from stratx.datasource import as_datasource
+
+
+class PartialDependenceState:
+    """
+    The sufficient statistics behind StratPD or CatStratPD for X[colname], kept so we
+    can fold in new rows without refitting the stratification forest or looking at
+    old rows again. For tables that grow a little every day, that avoids
+    recomputing the curve from scratch.
+
+    Once the forest's leaves are fixed, all partial_dependence() needs from the data is
+    the sum and count of y for each (leaf, unique x) pair: the mean y at each x in a
+    leaf gives the leaf's finite-difference slopes. (For CatStratPD, the means per
+    (leaf, category) give the leaf deltas.) We also need the sum and count of y
+    for each unique x overall. update() routes new rows to their leaves in the existing
+    trees with rf.apply() and adds them into those statistics. Only the leaves that
+    received rows get their slopes recomputed. The statistics live in sorted arrays,
+    though, so each update() copies them (np.insert) and costs O(state + batch log
+    batch), where state is the number of (leaf, x) pairs; partial_dependence() then
+    re-integrates every cached slope, O(slopes + unique x). That is far cheaper than
+    refitting the forest and re-stratifying all rows but it is not proportional to
+    the batch alone, so prefer a few large updates to many tiny ones. For
+    categorical variables, the leaf deltas come straight from the statistics and
+    avg_values_at_cat() merges them as usual.
+
+    New rows can only fall into the leaves the forest learned from the original data.
+    As the data drifts, start over with partial_dependence_state().
+
+    Typical use:
+
+        state = partial_dependence_state(X, y, 'x1')
+        state.save('x1.pdstate')
+        ...
+        state = PartialDependenceState.load('x1.pdstate')
+        state.update(X_new, y_new)
+        leaf_xranges, leaf_slopes, slope_counts_at_x, dx, slope_at_x, pdpx, pdpy, ignored = \\
+            state.partial_dependence()
+    """
+    def __init__(self, rf, colname, catcol=False):
+        self.rf = rf
+        self.colname = colname
+        self.catcol = catcol
+        self.n = 0  # how many rows we've seen
+        # A leaf's key is tree index * stride + node id so keys sort by tree then
+        # leaf, the same leaf order group_leaves() uses.
+        self.stride = max(tree.tree_.node_count for tree in rf.estimators_)
+        # Sum and count of y for each (leaf, x) pair, sorted by leaf then x
+        self.leaf_keys = np.empty(shape=(0,), dtype=np.int64)
+        self.leaf_x = np.empty(shape=(0,))
+        self.leaf_sum_y = np.empty(shape=(0,))
+        self.leaf_count = np.empty(shape=(0,), dtype=np.int64)
+        # Sum and count of y for each unique x, sorted by x
+        self.uniq_x = np.empty(shape=(0,))
+        self.x_sum_y = np.empty(shape=(0,))
+        self.x_count = np.empty(shape=(0,), dtype=np.int64)
+        # Slopes of all leaves as of the last partial_dependence() and leaves updated since
+        self._slope_keys = np.empty(shape=(0,), dtype=np.int64)
+        self._slope_xranges = np.empty(shape=(0, 2))
+        self._slopes = np.empty(shape=(0,))
+        self._dirty = np.empty(shape=(0,), dtype=np.int64)
+
+    def update(self, X, y):
+        "Add rows X, y (a dataframe or DataSource with the original columns) to the statistics"
+        src = as_datasource(X)
+        X_col = np.asarray(src.column(self.colname))
+        if self.catcol:
+            if (X_col<0).any():
+                raise ValueError(f"Category codes must be > 0 in column {self.colname}")
+            if not np.issubdtype(X_col.dtype, np.integer):
+                raise ValueError(f"Category codes must be integers in column {self.colname} but is {X_col.dtype}")
+        if len(X_col)==0:
+            return
+        x = X_col.astype(np.float64).round(decimals=10) # same hack as partial_dependence()
+        y = np.asarray(y, dtype=np.float64)
+
+        leaf_ids = self.rf.apply(src.not_column(self.colname)) # (n, n_trees)
+        n_trees = leaf_ids.shape[1]
+        keys = (leaf_ids + np.arange(n_trees) * self.stride).astype(np.int64).ravel()
+        self.leaf_keys, self.leaf_x, self.leaf_sum_y, self.leaf_count = \
+            merge_stats(self.leaf_keys, self.leaf_x, self.leaf_sum_y, self.leaf_count,
+                        keys, np.repeat(x, n_trees), np.repeat(y, n_trees))
+        _, self.uniq_x, self.x_sum_y, self.x_count = \
+            merge_stats(np.zeros(len(self.uniq_x), dtype=np.int64), self.uniq_x, self.x_sum_y, self.x_count,
+                        np.zeros(len(x), dtype=np.int64), x, y)
+        self._dirty = np.union1d(self._dirty, keys)
+        self.n += len(x)
+
+    def partial_dependence(self, min_slopes_per_x=5, parallel_jit=True):
+        """
+        Return leaf_xranges, leaf_slopes, slope_counts_at_x, dx, slope_at_x, pdpx,
+        pdpy, ignored for all rows seen so far, per partdep.partial_dependence().
+        """
+        if self.catcol:
+            raise ValueError(f"{self.colname} is categorical; use cat_partial_dependence()")
+        self._refresh_slopes()
+        leaf_xranges = self._slope_xranges
+        if len(leaf_xranges)==0:
+            leaf_xranges = np.array([]).reshape(0, 0) # per collect_discrete_slopes()
+        slope_counts_at_x, dx, slope_at_x, pdpx, pdpy = \
+            partdep.integrate_slopes(self.uniq_x, leaf_xranges, self._slopes,
+                                     min_slopes_per_x=min_slopes_per_x, parallel_jit=parallel_jit)
+        return leaf_xranges, self._slopes, slope_counts_at_x, dx, slope_at_x, pdpx, pdpy, self.ignored()
+
+    def cat_partial_dependence(self, max_catcode=None, verbose=False):
+        """
+        Return leaf_deltas, leaf_counts, avg_per_cat, count_per_cat, ignored for all
+        rows seen so far, per partdep.cat_partial_dependence().
+        """
+        if not self.catcol:
+            raise ValueError(f"{self.colname} is numeric; use partial_dependence()")
+        if max_catcode is None:
+            max_catcode = int(self.uniq_x[-1])
+        ncats = max_catcode+1
+
+        # Same deltas as catwise_leaves(): leaf's avg y per cat minus its min avg y
+        leaf_starts = self._leaf_starts()
+        n_leaves = len(leaf_starts)
+        leaf_of_group = np.repeat(np.arange(n_leaves), np.diff(np.append(leaf_starts, len(self.leaf_keys))))
+        avg_y_per_group = self.leaf_sum_y / self.leaf_count
+        min_avg_y_per_leaf = np.fmin.reduceat(avg_y_per_group, leaf_starts) if n_leaves>0 else np.empty(shape=(0,))
+        delta_y_per_group = avg_y_per_group - min_avg_y_per_leaf[leaf_of_group]
+        indptr = np.append(leaf_starts, len(self.leaf_keys))
+        cats = self.leaf_x.astype(np.int64)
+        leaf_deltas = csc_matrix((delta_y_per_group, cats, indptr), shape=(ncats, n_leaves))
+        leaf_counts = csc_matrix((self.leaf_count, cats, indptr), shape=(ncats, n_leaves))
+
+        marginal_avg_y_per_cat = np.full(shape=(ncats,), fill_value=np.nan)
+        marginal_avg_y_per_cat[self.uniq_x.astype(np.int64)] = self.x_sum_y / self.x_count
+
+        avg_per_cat, count_per_cat = \
+            partdep.avg_values_at_cat(leaf_deltas, leaf_counts, marginal_avg_y_per_cat, verbose=verbose)
+        # A leaf with a single category says nothing about how categories differ.
+        # We still merge its count but, like the same-x leaves in ignored(), count
+        # its samples as ignored.
+        single_cat = np.diff(indptr)==1
+        ignored = int(np.add.reduceat(self.leaf_count, leaf_starts)[single_cat].sum()) if n_leaves>0 else 0
+        return leaf_deltas, leaf_counts, avg_per_cat, count_per_cat, ignored
+
+    def ignored(self):
+        "How many (sample, tree) pairs fell in leaves whose x values are all the same"
+        leaf_starts = self._leaf_starts()
+        if len(leaf_starts)==0:
+            return 0
+        leaf_stops = np.append(leaf_starts[1:], len(self.leaf_keys))
+        same_x = np.abs(self.leaf_x[leaf_stops-1] - self.leaf_x[leaf_starts]) < 1.e-8
+        return int(np.add.reduceat(self.leaf_count, leaf_starts)[same_x].sum())
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(filename) -> 'PartialDependenceState':
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+    def _leaf_starts(self):
+        if len(self.leaf_keys)==0:
+            return np.empty(shape=(0,), dtype=np.int64)
+        return np.flatnonzero(np.concatenate([[True], self.leaf_keys[1:] != self.leaf_keys[:-1]]))
+
+    def _refresh_slopes(self):
+        "Recompute slopes for just the leaves that got new rows since last time"
+        if len(self._dirty)==0:
+            return
+        lo = np.searchsorted(self.leaf_keys, self._dirty, side='left')
+        hi = np.searchsorted(self.leaf_keys, self._dirty, side='right')
+        sizes = hi - lo
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        idxs = np.arange(offsets[-1]) - np.repeat(offsets[:-1] - lo, sizes)
+        # Each (leaf, x) pair is a run of one so we get a slope per adjacent pair of x
+        leaf_xranges, leaf_slopes, _ = \
+            partdep.leaf_finite_differences_jit(offsets, self.leaf_x[idxs],
+                                                self.leaf_sum_y[idxs] / self.leaf_count[idxs])
+        same_x = np.abs(self.leaf_x[hi-1] - self.leaf_x[lo]) < 1.e-8
+        slope_keys = np.repeat(self._dirty, np.where(same_x, 0, sizes-1))
+
+        keep = ~np.isin(self._slope_keys, self._dirty)
+        keys = np.concatenate([self._slope_keys[keep], slope_keys])
+        order = np.argsort(keys, kind='stable')
+        self._slope_keys = keys[order]
+        self._slope_xranges = np.concatenate([self._slope_xranges[keep], leaf_xranges.reshape(-1, 2)])[order]
+        self._slopes = np.concatenate([self._slopes[keep], leaf_slopes])[order]
+        self._dirty = np.empty(shape=(0,), dtype=np.int64)
+
+
+def partial_dependence_state(X, y, colname, catcol=False,
+                             n_trees=1, min_samples_leaf=None, rf_bootstrap=False, max_features=1.0,
+                             supervised=True,
+                             random_state=None,
+                             verbose=False) -> PartialDependenceState:
+    """
+    Fit the stratification forest for X not colname and return a PartialDependenceState
+    holding the statistics for X, y. min_samples_leaf defaults to that of
+    partial_dependence() or, if catcol, cat_partial_dependence().
+    """
+    if min_samples_leaf is None:
+        min_samples_leaf = 5 if catcol else 15
+    rf = partdep.stratification_forest(X, y, colname,
+                                       n_trees=n_trees, min_samples_leaf=min_samples_leaf,
+                                       rf_bootstrap=rf_bootstrap, max_features=max_features,
+                                       supervised=supervised, random_state=random_state,
+                                       verbose=verbose)
+    state = PartialDependenceState(rf, colname, catcol=catcol)
+    state.update(X, y)
+    return state
+
+
+def merge_stats(keys, x, sum_y, count, new_keys, new_x, new_y):
+    """
+    Add the new (key, x, y) observations into the sum and count of y per (key, x)
+    pair, where keys, x, sum_y, count are sorted by key then x. We only sort the new
+    batch, group it, and binary search for each group, but adding to existing pairs
+    and inserting new ones builds new arrays, so this is O(len(keys)) regardless of
+    batch size. Return the new keys, x, sum_y, count.
+    """
+    order = np.lexsort((new_x, new_keys))
+    new_keys, new_x, new_y = new_keys[order], new_x[order], new_y[order]
+    starts = np.flatnonzero(np.concatenate([[True], (new_keys[1:] != new_keys[:-1]) |
+                                                    (new_x[1:] != new_x[:-1])]))
+    group_keys, group_x = new_keys[starts], new_x[starts]
+    group_sum_y = np.add.reduceat(new_y, starts)
+    group_count = np.diff(np.append(starts, len(new_y)))
+
+    pos, found = locate_pairs_jit(keys, x, group_keys, group_x)
+    sum_y = sum_y.copy()
+    count = count.copy()
+    sum_y[pos[found]] += group_sum_y[found]
+    count[pos[found]] += group_count[found]
+    new = ~found
+    return np.insert(keys, pos[new], group_keys[new]), \
+           np.insert(x, pos[new], group_x[new]), \
+           np.insert(sum_y, pos[new], group_sum_y[new]), \
+           np.insert(count, pos[new], group_count[new])
+
+
+@jit(nopython=True, cache=True)
+def locate_pairs_jit(keys, x, new_keys, new_x):
+    """
+    For each (new_keys[i], new_x[i]) pair, binary search keys, x (sorted by key then
+    x) for the first position not less than that pair. Return the positions and
+    whether the pair is there.
+    """
+    n = keys.shape[0]
+    m = new_keys.shape[0]
+    pos = np.empty(shape=m, dtype=np.int64)
+    found = np.zeros(shape=m, dtype=np.bool_)
+    for i in range(m):
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if keys[mid] < new_keys[i] or (keys[mid] == new_keys[i] and x[mid] < new_x[i]):
+                lo = mid + 1
+            else:
+                hi = mid
+        pos[i] = lo
+        found[i] = lo < n and keys[lo] == new_keys[i] and x[lo] == new_x[i]
+    return pos, found
@@ -0,0 +1,248 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import os
+import multiprocessing
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import numba
+from joblib import Parallel, delayed, effective_n_jobs
+
+
+def trial_seeds(n_trials, random_state=None) -> list:
+    """
+    Return a distinct integer seed for each of n_trials trials. Seeds are spawned
+    from one SeedSequence so they are statistically independent, and the same
+    random_state always gives the same seeds no matter how (or in which process)
+    the trials run. random_state=None gives fresh seeds every call.
+    """
+    children = np.random.SeedSequence(random_state).spawn(n_trials)
+    return [int(child.generate_state(1)[0]) for child in children]
+
+
+def trial_idxs(n, seed, bootstrap=True, subsample_size=.75) -> np.ndarray:
+    "Return row indexes of X for one trial; bootstrap or subsample w/o replacement"
+    rng = np.random.default_rng(seed)
+    if bootstrap:
+        return rng.integers(0, n, size=n)
+    return rng.choice(n, size=int(n * subsample_size), replace=False)
+
+
+def run_trials(trial, X, y, n_trials,
+               bootstrap=True, subsample_size=.75,
+               random_state=None,
+               n_jobs=1,
+               backend='loky') -> list:
+    """
+    Run trial(X_, y_, random_state=seed) once for each of n_trials resampled
+    versions (X_, y_) of (X, y) and return the list of results in trial order.
+    Use functools.partial to bind any other arguments of trial. With a single trial
+    we just call trial(X, y, random_state=random_state) on all the data.
+
+    Each worker gets X, y plus the row indexes for its trial, not a copied X.iloc[idxs]
+    dataframe; X can also be a DataSource, see take_rows(). With the default loky
+    process backend, joblib memory maps large arrays (including a dataframe's
+    column blocks) once, read-only, so all workers share the same copy of X. Use backend='threading' to avoid processes altogether
+    (e.g., for small data sets where process startup dominates).
+
+    The trial indexes and the random_state handed to each trial derive from
+    random_state via trial_seeds() so results don't depend on n_jobs or backend.
+    """
+    if n_trials==1:
+        return [trial(X, y, random_state=random_state)]
+
+    n = len(X)
+    # One seed picks each trial's rows and another seeds that trial's model
+    seeds = trial_seeds(2 * n_trials, random_state)
+    all_idxs = [trial_idxs(n, seed, bootstrap, subsample_size) for seed in seeds[:n_trials]]
+    model_seeds = seeds[n_trials:]
+    if n_jobs==1:
+        return [_run_one_trial(trial, X, y, idxs, seed)
+                for idxs, seed in zip(all_idxs, model_seeds)]
+
+    n_threads = worker_numba_threads(n_jobs, backend)
+    return Parallel(n_jobs=n_jobs, backend=backend, mmap_mode='r', verbose=0) \
+        (delayed(with_numba_threads)(n_threads, _run_one_trial, trial, X, y, idxs, seed)
+         for idxs, seed in zip(all_idxs, model_seeds))
+
+
+def _run_one_trial(trial, X, y, idxs, seed):
+    # Only the worker materializes the resampled rows
+    return trial(take_rows(X, idxs), take_rows(y, idxs), random_state=seed)
+
+
+def take_rows(X, idxs):
+    "Return rows idxs of a dataframe, series, array, or DataSource"
+    if isinstance(X, (pd.DataFrame, pd.Series)):
+        return X.iloc[idxs]
+    if isinstance(X, np.ndarray):
+        return X[idxs]
+    return X.take(idxs)
+
+
+# Which parallel jit'd code can run inside workers? It depends on numba's threading
+# layer. Per the numba docs, tbb and omp are thread-safe but workqueue aborts if two
+# threads launch kernels at once; tbb and workqueue survive fork() after the
+# parent has started its threads but GNU OpenMP (libgomp, what omp is on Linux)
+# can hang. Spawned processes, which is what loky uses, start fresh so any layer is fine.
+THREAD_SAFE_LAYERS = {'tbb', 'omp'}
+FORK_SAFE_LAYERS = {'tbb', 'workqueue'}
+
+
+def numba_threading_layer() -> str:
+    """
+    Return the threading layer numba uses for parallel jit'd kernels: 'tbb', 'omp',
+    or 'workqueue'. Once a parallel kernel has run, we just ask numba. Before that,
+    we predict the layer numba will pick per NUMBA_THREADING_LAYER ('default',
+    'safe', 'threadsafe', 'forksafe', or a layer name) without starting any
+    threads, which matters if we are about to fork.
+    """
+    try:
+        return numba.threading_layer()
+    except ValueError: # no parallel kernel has run yet
+        pass
+    requested = numba.config.THREADING_LAYER
+    priority = getattr(numba.config, 'THREADING_LAYER_PRIORITY', ['tbb', 'omp', 'workqueue'])
+    candidates = {'default': priority,
+                  'safe': ['tbb'],
+                  'threadsafe': ['tbb', 'omp'],
+                  'forksafe': ['tbb', 'omp', 'workqueue']}.get(requested, [requested])
+    for layer in candidates:
+        if layer=='omp' and requested=='forksafe' and _openmp_vendor()=='GNU':
+            continue
+        if _layer_available(layer):
+            return layer
+    return 'workqueue' # always built with numba
+
+
+def set_threading_layer(layer:str):
+    """
+    Tell numba which threading layer to use for parallel jit'd kernels: 'tbb',
+    'omp', 'workqueue', or one of numba's safety levels 'safe', 'threadsafe',
+    'forksafe'. Same as setting NUMBA_THREADING_LAYER in the environment, which
+    also reaches spawned worker processes. It has to happen before any parallel
+    kernel runs; numba can't switch layers after that.
+    """
+    try:
+        current = numba.threading_layer()
+    except ValueError:
+        current = None
+    if current is not None and layer!=current:
+        raise ValueError(f"numba already launched its {current} threading layer; "
+                         f"call set_threading_layer('{layer}') before any parallel jit'd code runs")
+    numba.config.THREADING_LAYER = layer
+    os.environ['NUMBA_THREADING_LAYER'] = layer
+
+
+def parallel_jit_safe(n_jobs=1, backend='loky') -> bool:
+    """
+    Return whether parallel jit'd kernels, such as avg_slopes_at_x_jit(), can run
+    inside n_jobs workers of joblib's backend without crashing or deadlocking
+    under numba's threading layer. Processes started by loky always can; worker
+    threads need a thread-safe layer and forked processes ('multiprocessing' on
+    Linux) need a fork-safe one.
+    """
+    if n_jobs==1:
+        return True
+    if backend=='threading':
+        return numba_threading_layer() in THREAD_SAFE_LAYERS
+    if backend=='multiprocessing' and _fork_is_default():
+        return numba_threading_layer() in FORK_SAFE_LAYERS
+    return True
+
+
+def available_cores() -> int:
+    "Cores this process may run on, which can be fewer than os.cpu_count()"
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def worker_numba_threads(n_jobs, backend='loky'):
+    """
+    Return how many numba threads each of n_jobs joblib workers should use so that
+    workers * threads <= cores; e.g., 4 workers on 16 cores get 4 threads each.
+    Return None if workers shouldn't touch numba's threads at all because
+    parallel_jit_safe() says they can't run parallel kernels anyway.
+    """
+    if not parallel_jit_safe(n_jobs, backend):
+        return None
+    if backend=='threading':
+        # Start numba's thread pool from this thread; when a worker thread starts
+        # it, tbb can hang at interpreter exit
+        numba.get_num_threads()
+    n_workers = min(effective_n_jobs(n_jobs), available_cores())
+    return max(1, available_cores() // n_workers)
+
+
+@contextmanager
+def numba_threads(n_threads):
+    """
+    Limit parallel jit'd kernels launched by this thread to n_threads threads
+    (at most NUMBA_NUM_THREADS) in a with statement. numba's thread count is per
+    thread, so this is safe in joblib worker threads as well as processes.
+    """
+    if n_threads is None:
+        yield
+        return
+    prev = numba.get_num_threads()
+    numba.set_num_threads(max(1, min(n_threads, numba.config.NUMBA_NUM_THREADS)))
+    try:
+        yield
+    finally:
+        numba.set_num_threads(prev)
+
+
+def with_numba_threads(n_threads, f, *args, **kwargs):
+    "Call f(*args, **kwargs) with numba_threads(n_threads); use as a joblib job"
+    with numba_threads(n_threads):
+        return f(*args, **kwargs)
+
+
+def _layer_available(layer) -> bool:
+    module = {'tbb': 'tbbpool', 'omp': 'omppool', 'workqueue': 'workqueue'}.get(layer)
+    if module is None:
+        return False
+    try:
+        __import__(f"numba.np.ufunc.{module}")
+    except ImportError:
+        return False
+    return True
+
+
+def _openmp_vendor():
+    try:
+        from numba.np.ufunc import omppool
+    except ImportError:
+        return None
+    return getattr(omppool, 'openmp_vendor', None)
+
+
+def _fork_is_default() -> bool:
+    "Does joblib's 'multiprocessing' backend fork? First of get_all_start_methods() is the default"
+    method = multiprocessing.get_start_method(allow_none=True) or multiprocessing.get_all_start_methods()[0]
+    return method=='fork'
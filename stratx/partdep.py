@@ -24,19 +24,27 @@ SOFTWARE.
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-from  matplotlib.collections import LineCollection
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
-import warnings
 from sklearn.utils import resample
-from collections import defaultdict
 from typing import Sequence
 
 from numba import jit, prange
+from scipy.sparse import csr_matrix, csc_matrix, issparse
 
 import stratx.featimp as featimp
+from stratx.cache import StratificationCache, cached_call, check_seeded
+from stratx.datasource import as_datasource
+from stratx.stratifiers import Stratifier
+import copy
+from stratx.parallel import run_trials, parallel_jit_safe
+from stratx.lazy import LazyModule
+from functools import partial
+
+# Only the plot_* functions need matplotlib so don't load it until then
+plt = LazyModule('matplotlib.pyplot')
+mpl = LazyModule('matplotlib')
+mcollections = LazyModule('matplotlib.collections')
 
 
 def leaf_samples(rf, X_not_col:np.ndarray) -> Sequence:
@@ -48,34 +56,196 @@ def leaf_samples(rf, X_not_col:np.ndarray) -> Sequence:
         array([array([0, 1, 2, 3, 4, 5, 6, 7, 8, 9]),
            array([10, 11, 12, 13, 14, 15]), array([16, 17, 18, 19, 20]),
            array([21, 22, 23, 24, 25, 26, 27, 28, 29]))
+
+    This is just a convenience view of leaf_samples_csr(); the StratPD and
+    CatStratPD computations use the CSR layout directly.
+    """
+    leaf_offsets, leaf_sample_idxs = leaf_samples_csr(rf, X_not_col)
+    return np.split(leaf_sample_idxs, leaf_offsets[1:-1])
+
+
+def leaf_samples_csr(rf, X_not_col:np.ndarray):
+    """
+    Return the leaves of all trees in rf forest in CSR-style layout: an array of
+    leaf_offsets and an array of leaf_sample_idxs. The X sample indexes residing
+    in leaf i are leaf_sample_idxs[leaf_offsets[i]:leaf_offsets[i+1]].
+    See group_leaves().
+    """
+    leaf_ids = rf.apply(X_not_col)  # which leaf does each X_i go to for each tree?
+    return group_leaves(leaf_ids)
+
+
+def group_leaves(leaf_ids:np.ndarray):
     """
-    n_trees = len(rf.estimators_)
-    leaf_samples = []
-    leaf_ids = rf.apply(X_not_col)  # which leaf does each X_i go to for sole tree?
+    Group the sample indexes by leaf id, tree by tree, where leaf_ids is the
+    (n, n_trees) matrix returned from rf.apply(). Rather than testing every sample
+    against every leaf id, which is O(n * leaves) per tree, do one stable argsort
+    of each tree's leaf ids so samples in the same leaf become contiguous.
+    Return leaf_offsets with one entry per leaf plus a final entry for the end
+    and leaf_sample_idxs with n * n_trees sample indexes.  For example, if
+    leaf_ids is [[4],[2],[4],[2],[3]] then we get:
+
+        leaf_offsets     = [0, 2, 3, 5]
+        leaf_sample_idxs = [1, 3, 4, 0, 2]
+
+    Leaves come back in order of tree then leaf id, and the sample indexes within
+    a leaf are sorted, same as np.where(leaf_ids[:,t] == id).
+    """
+    if leaf_ids.ndim==1:
+        leaf_ids = leaf_ids.reshape(-1,1)
+    n, n_trees = leaf_ids.shape
+    leaf_offsets = []
+    leaf_sample_idxs = []
     for t in range(n_trees):
-        # Group by id and return sample indexes
-        uniq_ids = np.unique(leaf_ids[:,t])
-        sample_idxs_in_leaves = [np.where(leaf_ids[:, t] == id)[0] for id in uniq_ids]
-        leaf_samples.extend(sample_idxs_in_leaves)
-    return leaf_samples
+        tree_leaf_ids = leaf_ids[:, t]
+        sample_idxs = np.argsort(tree_leaf_ids, kind='stable')
+        sorted_ids = tree_leaf_ids[sample_idxs]
+        # A new leaf starts wherever the sorted id changes
+        leaf_starts = np.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1
+        leaf_offsets.append(np.concatenate([[0], leaf_starts]) + t * n)
+        leaf_sample_idxs.append(sample_idxs)
+    leaf_offsets.append([n * n_trees])
+    leaf_offsets = np.concatenate(leaf_offsets).astype(np.intp)
+    if n_trees>0:
+        leaf_sample_idxs = np.concatenate(leaf_sample_idxs).astype(np.intp)
+    else:
+        leaf_sample_idxs = np.empty(shape=(0,), dtype=np.intp)
+    return leaf_offsets, leaf_sample_idxs
 
 
-def partial_dependence(X:pd.DataFrame, y:pd.Series, colname:str,
+def stratify(X, y:pd.Series, colname:str,
+             n_trees=1, min_samples_leaf=15, rf_bootstrap=False, max_features=1.0,
+             supervised=True,
+             random_state=None,
+             stratcache:StratificationCache=None,
+             stratifier:Stratifier=None,
+             verbose=False):
+    """
+    Partition X not colname by training a random forest (usually a single decision
+    tree) on X without colname and return the leaves as leaf_offsets and
+    leaf_sample_idxs, per leaf_samples_csr().  If stratcache is not None, reuse
+    the leaves from an earlier call with the same data and hyper parameters rather
+    than refitting, and remember new leaves for next time.
+
+    X can be a dataframe or anything as_datasource() accepts, such as a memory-mapped
+    array or a directory of .npy columns. We build the X not colname matrix one
+    column at a time, in the float32 sklearn's trees want, so there's never a
+    float64 copy of X (from X.drop()) plus sklearn's own float32 copy. A
+    FeatureMatrix goes further and refills one scratch buffer for every colname.
+
+    If stratifier is not None, partition with it instead of a random forest and
+    ignore the forest hyper parameters; see stratifiers.Stratifier.
+    """
+    if stratcache is not None:
+        hyperparams = dict(n_trees=n_trees, min_samples_leaf=min_samples_leaf,
+                           rf_bootstrap=rf_bootstrap, max_features=max_features,
+                           supervised=supervised, random_state=random_state)
+        if stratifier is not None:
+            hyperparams = dict(stratifier=repr(stratifier))
+        key = stratcache.key(X, y, colname, **hyperparams)
+        leaves = stratcache.get(key)
+        if leaves is not None:
+            return leaves
+
+    X_not_col = as_datasource(X).not_column(colname)
+    if stratifier is not None:
+        # Fit a copy so the caller's stratifier can be shared across features and threads
+        stratifier = copy.deepcopy(stratifier).fit(X_not_col, np.asarray(y))
+        leaf_offsets, leaf_sample_idxs = group_leaves(stratifier.apply(X_not_col))
+        if verbose:
+            print(f"Partitioning 'x not {colname}' with {stratifier}: {len(leaf_offsets)-1} total leaves")
+        if stratcache is not None:
+            stratcache.put(key, leaf_offsets, leaf_sample_idxs)
+        return leaf_offsets, leaf_sample_idxs
+
+    rf = stratification_forest(X, y, colname, X_not_col=X_not_col,
+                               n_trees=n_trees, min_samples_leaf=min_samples_leaf,
+                               rf_bootstrap=rf_bootstrap, max_features=max_features,
+                               supervised=supervised, random_state=random_state,
+                               verbose=verbose)
+    leaf_offsets, leaf_sample_idxs = leaf_samples_csr(rf, X_not_col)
+    if verbose:
+        nnodes = rf.estimators_[0].tree_.node_count
+        print(f"Partitioning 'x not {colname}': {nnodes} nodes in (first) tree, "
+              f"{len(rf.estimators_)} trees, {len(leaf_offsets)-1} total leaves")
+
+    if stratcache is not None:
+        stratcache.put(key, leaf_offsets, leaf_sample_idxs)
+    return leaf_offsets, leaf_sample_idxs
+
+
+def stratification_forest(X, y:pd.Series, colname:str, X_not_col=None,
+                          n_trees=1, min_samples_leaf=15, rf_bootstrap=False, max_features=1.0,
+                          supervised=True,
+                          random_state=None,
+                          verbose=False):
+    """
+    Fit and return the forest whose leaves stratify X not colname; see stratify().
+    Pass X_not_col if you already have it, in which case X can be None. Keep the
+    forest around to route new rows into the same leaves with rf.apply(); see
+    PartialDependenceState and ForestStratifier.
+    """
+    if X_not_col is None:
+        X_not_col = as_datasource(X).not_column(colname)
+    if supervised:
+        rf = RandomForestRegressor(n_estimators=n_trees,
+                                   min_samples_leaf=min_samples_leaf,
+                                   bootstrap=rf_bootstrap,
+                                   max_features=max_features,
+                                   random_state=random_state)
+        rf.fit(X_not_col, y)
+        if verbose:
+            print(f"Strat Partition RF: dropping {colname} training R^2 {rf.score(X_not_col, y):.2f}")
+    else:
+        """
+        Wow. Breiman's trick works in most cases. Falls apart on Boston housing MEDV target vs AGE
+        """
+        if verbose: print("USING UNSUPERVISED MODE")
+        X_synth, y_synth = conjure_twoclass(X_not_col)
+        rf = RandomForestClassifier(n_estimators=n_trees,
+                                    min_samples_leaf=min_samples_leaf,
+                                    bootstrap=rf_bootstrap,
+                                    max_features=max_features,
+                                    oob_score=False,
+                                    random_state=random_state)
+        rf.fit(X_synth, y_synth)
+
+    return rf
+
+
+def partial_dependence(X, y:pd.Series, colname:str,
                        min_slopes_per_x=5,
+                       n_bins=None,
                        parallel_jit=True,
                        n_trees=1, min_samples_leaf=15, rf_bootstrap=False, max_features=1.0,
                        supervised=True,
+                       random_state=None,
+                       stratcache:StratificationCache=None,
+                       stratifier:Stratifier=None,
+                       cache_dir=None,
                        verbose=False):
     """
     Internal computation of partial dependence information about X[colname]'s effect on y.
     Also computes partial derivative of y with respect to X[colname].
 
-    :param X: Dataframe with all explanatory variables
+    :param X: Dataframe with all explanatory variables or a DataSource (e.g.,
+              memory-mapped .npy files) from which we read only the columns we need
     :param y: Series or vector with response variable
     :param colname: which X[colname] (a string) to compute partial dependence for
     :param min_slopes_per_x: ignore pdp y values derived from too few slopes; this is
            same count across all features (tried percentage of max slope count but was
            too variable). Important for getting good starting point of PD.
+    :param n_bins: if not None, replace X[colname] with the center of its quantile bin,
+           for at most n_bins bins, so pdpx has at most n_bins values; see quantile_bins()
+    :param random_state: seed for the stratification forest
+    :param stratcache: a StratificationCache to reuse the stratification forest's leaves
+           across calls with the same X, y, colname, and hyper parameters
+    :param stratifier: a Stratifier to partition X not colname instead of the
+           random forest; see stratifiers.py
+    :param cache_dir: if not None, a directory (or ResultCache) where we store the
+           results on disk, keyed by the content of X, y, colname, and the hyper
+           parameters, so the same call later just loads them; see ResultCache.
+           Requires a random_state.
 
     Returns:
         leaf_xranges    The ranges of X[colname] partitions
@@ -99,43 +269,27 @@ def partial_dependence(X:pd.DataFrame, y:pd.Series, colname:str,
                         ignore because samples in leaves had identical X[colname]
                         values.
   """
-    X_not_col = X.drop(colname, axis=1).values
+    if cache_dir is not None:
+        return cached_call(partial_dependence, locals(),
+                           ignore=('parallel_jit', 'stratcache', 'verbose'))
+
     # For x floating-point numbers that are very close, I noticed that np.unique(x)
     # was treating floating-point numbers different in the 12th decimal point as different.
     # This caused a number of problems likely but I didn't notice it until I tried
     # np.gradient(), which found extremely huge derivatives. I fixed that with a hack:
-    X_col = X[colname].values.round(decimals=10)
+    X_col = np.asarray(as_datasource(X).column(colname)).round(decimals=10)
+    if n_bins is not None:
+        X_col = quantile_bins(X_col, n_bins)
 
-    if supervised:
-        rf = RandomForestRegressor(n_estimators=n_trees,
-                                   min_samples_leaf=min_samples_leaf,
-                                   bootstrap=rf_bootstrap,
-                                   max_features=max_features)
-        rf.fit(X_not_col, y)
-        if verbose:
-            print(f"Strat Partition RF: dropping {colname} training R^2 {rf.score(X_not_col, y):.2f}")
-
-    else:
-        """
-        Wow. Breiman's trick works in most cases. Falls apart on Boston housing MEDV target vs AGE
-        """
-        if verbose: print("USING UNSUPERVISED MODE")
-        X_synth, y_synth = conjure_twoclass(X)
-        rf = RandomForestClassifier(n_estimators=n_trees,
-                                    min_samples_leaf=min_samples_leaf,
-                                    bootstrap=rf_bootstrap,
-                                    max_features=max_features,
-                                    oob_score=False)
-        rf.fit(X_synth.drop(colname, axis=1), y_synth)
-
-    if verbose:
-        leaves = leaf_samples(rf, X_not_col)
-        nnodes = rf.estimators_[0].tree_.node_count
-        print(f"Partitioning 'x not {colname}': {nnodes} nodes in (first) tree, "
-              f"{len(rf.estimators_)} trees, {len(leaves)} total leaves")
+    leaf_offsets, leaf_sample_idxs = \
+        stratify(X, y, colname,
+                 n_trees=n_trees, min_samples_leaf=min_samples_leaf,
+                 rf_bootstrap=rf_bootstrap, max_features=max_features,
+                 supervised=supervised, random_state=random_state,
+                 stratcache=stratcache, stratifier=stratifier, verbose=verbose)
 
     leaf_xranges, leaf_slopes, ignored = \
-        collect_discrete_slopes(rf, X_col, X_not_col, y) # if ignored, won't have entries in leaf_* results
+        collect_discrete_slopes(leaf_offsets, leaf_sample_idxs, X_col, y) # if ignored, won't have entries in leaf_* results
 
     # print('leaf_xranges', leaf_xranges)
     # print('leaf_slopes', leaf_slopes)
@@ -144,6 +298,40 @@ def partial_dependence(X:pd.DataFrame, y:pd.Series, colname:str,
     if verbose:
         print(f"discrete StratPD num samples ignored {ignored}/{len(X)} for {colname}")
 
+    slope_counts_at_x, dx, slope_at_x, pdpx, pdpy = \
+        integrate_slopes(real_uniq_x, leaf_xranges, leaf_slopes,
+                         min_slopes_per_x=min_slopes_per_x, parallel_jit=parallel_jit)
+
+    return leaf_xranges, leaf_slopes, slope_counts_at_x, dx, slope_at_x, pdpx, pdpy, ignored
+
+
+def quantile_bins(X_col:np.ndarray, n_bins:int) -> np.ndarray:
+    """
+    Discretize X_col into at most n_bins quantile bins and return X_col with each
+    value replaced by the mean X_col value of its bin. For continuous variables like
+    latitude, nearly every x is unique so StratPD would track n unique x values,
+    n slope averages, and n plot points. With bins, StratPD sees at most n_bins
+    unique x values and the slopes are between bin centers, so they are still in
+    units of y per unit of x. Duplicate quantiles (many ties) merge bins. If X_col
+    has no more than n_bins unique values, it comes back unchanged.
+    """
+    if n_bins < 1:
+        raise ValueError(f"n_bins must be at least 1 but is {n_bins}")
+    if len(np.unique(X_col)) <= n_bins:
+        return X_col
+    edges = np.unique(np.quantile(X_col, np.linspace(0, 1, n_bins+1)))
+    bins = np.clip(np.searchsorted(edges, X_col, side='right') - 1, 0, len(edges)-2)
+    counts = np.bincount(bins, minlength=len(edges)-1)
+    centers = np.bincount(bins, weights=X_col, minlength=len(edges)-1) / np.maximum(counts, 1)
+    return centers[bins]
+
+
+def integrate_slopes(real_uniq_x, leaf_xranges, leaf_slopes, min_slopes_per_x=5, parallel_jit=True):
+    """
+    Average the leaf slopes at each unique x and integrate them to get the partial
+    dependence curve; the second half of partial_dependence(). Return
+    slope_counts_at_x, dx, slope_at_x, pdpx, pdpy per partial_dependence().
+    """
     #print("uniq x =", len(real_uniq_x), "slopes.shape =", leaf_slopes.shape, "x ranges.shape", leaf_xranges.shape)
     if parallel_jit:
         slope_at_x, slope_counts_at_x = \
@@ -190,11 +378,78 @@ def partial_dependence(X:pd.DataFrame, y:pd.Series, colname:str,
     pdpx = pdpx[idx_not_adjacent_nans]
     pdpy = pdpy[idx_not_adjacent_nans]
 
-    return leaf_xranges, leaf_slopes, slope_counts_at_x, dx, slope_at_x, pdpx, pdpy, ignored
+    return slope_counts_at_x, dx, slope_at_x, pdpx, pdpy
+
+
+def partial_dependence_batch(X_col:np.ndarray, Y:np.ndarray,
+                             leaf_offsets, leaf_sample_idxs,
+                             min_slopes_per_x=5):
+    """
+    Given the stratification leaves from stratify(), compute the partial dependence
+    of X_col for every column of the 2D response matrix Y at once. This is
+    for permutation tests, where we need the PD for many shuffled versions of y
+    but the same leaves.
+
+    Once the leaves are fixed, everything partial_dependence() does after the
+    forest fit is linear in y: a slope is the difference between the mean y of
+    two runs of identical x, divided by dx; the average slope at each x sums
+    slopes; and pdpy is a cumulative sum. Which slopes exist, how many cover each x,
+    and which x survive min_slopes_per_x only depend on x. So, rather than repeat
+    all of that per y, we get all run means from one prefix sum down the columns of Y
+    and sum slopes at each x with a sparse matrix multiply.
+
+    Returns pdpx, pdpy with shape (len(pdpx), Y.shape[1]), and the number of ignored
+    samples, per partial_dependence().
+    """
+    X_col = X_col.round(decimals=10) # same hack as partial_dependence()
+    if Y.ndim==1:
+        Y = Y.reshape(-1, 1)
+    ntrials = Y.shape[1]
+
+    leaf_sizes = np.diff(leaf_offsets)
+    leaf_of_sample = np.repeat(np.arange(len(leaf_sizes)), leaf_sizes)
+    leaf_x = X_col[leaf_sample_idxs]
+    by_leaf_then_x = np.lexsort((leaf_x, leaf_of_sample))
+    leaf_x = leaf_x[by_leaf_then_x]
+    leaf_xranges, starts, mids, stops, ignored = leaf_runs_jit(leaf_offsets, leaf_x)
+
+    leaf_Y = Y[leaf_sample_idxs[by_leaf_then_x]].astype(np.float64)
+    prefix = np.zeros(shape=(len(leaf_Y)+1, ntrials))
+    np.cumsum(leaf_Y, axis=0, out=prefix[1:])
+    avg_y_left = (prefix[mids] - prefix[starts]) / (mids - starts).reshape(-1, 1)
+    avg_y_right = (prefix[stops] - prefix[mids]) / (stops - mids).reshape(-1, 1)
+    leaf_slopes = (avg_y_right - avg_y_left) / (leaf_xranges[:,1] - leaf_xranges[:,0]).reshape(-1, 1)
+
+    # Slope i covers uniq_x[xstarts[i]:xstops[i]]; see sweep_slopes()
+    uniq_x = np.unique(X_col)
+    nx, nslopes = len(uniq_x), len(leaf_slopes)
+    xstarts = np.searchsorted(uniq_x, leaf_xranges[:,0])
+    xstops = np.searchsorted(uniq_x, leaf_xranges[:,1])
+    sweep = csr_matrix((np.concatenate([np.ones(nslopes), -np.ones(nslopes)]),
+                        (np.concatenate([xstarts, xstops]), np.tile(np.arange(nslopes), 2))),
+                       shape=(nx+1, nslopes))
+    sum_slopes_at_x = np.cumsum(sweep @ leaf_slopes, axis=0)[:nx]
+    slope_counts_at_x = np.cumsum(np.bincount(xstarts, minlength=nx+1) -
+                                  np.bincount(xstops, minlength=nx+1))[:nx]
+
+    if min_slopes_per_x <= 0:
+        min_slopes_per_x = 1 # must have at least one slope value
+    has_slope = slope_counts_at_x >= min_slopes_per_x
+
+    # Integrate as partial_dependence() does, treating missing slopes as 0
+    dx = np.diff(uniq_x)
+    slope_at_x = sum_slopes_at_x[:-1] / np.maximum(slope_counts_at_x[:-1], 1).reshape(-1, 1)
+    y_deltas = np.where(has_slope[:-1].reshape(-1, 1), slope_at_x * dx.reshape(-1, 1), 0.0)
+    pdpy = np.concatenate([np.zeros(shape=(1, ntrials)), np.cumsum(y_deltas, axis=0)])
+
+    # Strip positions w/o useful slope info, per partial_dependence()
+    keep = np.concatenate([has_slope[:1], has_slope[1:] | has_slope[:-1]])
+    return uniq_x[keep], pdpy[keep], ignored
 
 
 def plot_stratpd(X:pd.DataFrame, y:pd.Series, colname:str, targetname:str,
                  min_slopes_per_x=5,
+                 n_bins=None,
                  n_trials=1,
                  n_trees=1,
                  min_samples_leaf=15,
@@ -203,6 +458,12 @@ def plot_stratpd(X:pd.DataFrame, y:pd.Series, colname:str, targetname:str,
                  rf_bootstrap=False,
                  max_features=1.0,
                  supervised=True,
+                 n_jobs=1,
+                 backend='loky',
+                 random_state=None,
+                 stratcache:StratificationCache=None,
+                 stratifier:Stratifier=None,
+                 cache_dir=None,
                  ax=None,
                  xrange=None,
                  yrange=None,
@@ -284,6 +545,31 @@ def plot_stratpd(X:pd.DataFrame, y:pd.Series, colname:str, targetname:str,
                              curve. This presents a problem when there are few samples with X[colname]
                              values at the extreme left. Default is 5.
 
+    :param n_bins: If not None, bin X[colname] into at most n_bins quantile bins and plot
+                   the partial dependence at the bin centers, which keeps the time and
+                   the number of points down for continuous variables. Default is None.
+
+    :param n_jobs: How many trials to run in parallel, using joblib's backend
+                   ('loky' processes or 'threading'). Default is 1.
+
+    :param random_state: Seed for the trials' resampling and stratification forests
+                         so that the plot is reproducible. Default is None.
+
+    :param stratcache: a StratificationCache that remembers the leaves of the
+                       stratification forest so that repeated calls on the same
+                       data and hyper parameters don't have to refit. Pass in the same
+                       cache across calls to take advantage of it. Default is None.
+
+    :param stratifier: a Stratifier (see stratifiers.py) to partition X not colname
+                       instead of the random forest described by n_trees,
+                       min_samples_leaf, etc... Default is None.
+
+    :param cache_dir: a directory where we keep each trial's partial dependence
+                      results on disk so that plotting again with the same data,
+                      hyper parameters, and random_state just loads them. Nothing
+                      is cached unless you give one, and then random_state can't
+                      be None (ValueError). Default is None.
+
     Returns:
 
         pdpx            The non-NaN unique X[colname] values
@@ -296,50 +582,34 @@ def plot_stratpd(X:pd.DataFrame, y:pd.Series, colname:str, targetname:str,
                         ignore because samples in leaves had identical X[colname]
                         values.
     """
-    def avg_pd_curve(all_pdpx, all_pdpy):
-        m = defaultdict(float)
-        c = defaultdict(int)
-        for i in range(n_trials):
-            for px, py in zip(all_pdpx, all_pdpy):
-                for x, y in zip(px, py):
-                    m[x] += y
-                    c[x] += 1
-        for x in m.keys():
-            m[x] /= c[x]
-
-        # We now have dict with average pdpy for each pdpx found in any curve
-        # but we need to ensure we get it back in pdpx order
-        pdpx = np.array(sorted(m.keys()))
-        pdpy = np.empty(shape=(len(m),))
-        for i,x in enumerate(pdpx):
-            pdpy[i] = m[x]
-        return pdpx, pdpy
-
+    check_seeded(cache_dir, random_state, 'plot_stratpd')
     X_col = X[colname].values.round(decimals=10)
+    if n_bins is not None:
+        # Bin once up front so all trials' curves land on the same bin centers
+        X_col = quantile_bins(X_col, n_bins)
+        X = X.assign(**{colname: X_col})
+
+    trial = partial(partial_dependence, colname=colname,
+                    min_slopes_per_x=min_slopes_per_x,
+                    n_trees=n_trees, min_samples_leaf=min_samples_leaf,
+                    rf_bootstrap=rf_bootstrap, max_features=max_features,
+                    supervised=supervised,
+                    parallel_jit=parallel_jit_safe(n_jobs, backend),
+                    stratcache=stratcache,
+                    stratifier=stratifier,
+                    cache_dir=cache_dir,
+                    verbose=verbose)
+    trials = run_trials(trial, X, y, n_trials=n_trials,
+                        bootstrap=bootstrap, subsample_size=subsample_size,
+                        random_state=random_state,
+                        n_jobs=n_jobs, backend=backend)
 
     all_pdpx = []
     all_pdpy = []
     impacts = []
     importances = []
-    n = len(X)
     ignored = 0
-    for i in range(n_trials):
-        if n_trials>1:
-            if bootstrap:
-                idxs = resample(range(n), n_samples=n, replace=True) # bootstrap
-            else: # subsample
-                idxs = resample(range(n), n_samples=int(n*subsample_size), replace=False)
-            X_, y_ = X.iloc[idxs], y.iloc[idxs]
-        else:
-            X_, y_ = X, y
-
-        leaf_xranges, leaf_slopes, slope_counts_at_x, dx, slope_at_x, pdpx, pdpy, ignored_ = \
-            partial_dependence(X=X_, y=y_, colname=colname,
-                               min_slopes_per_x=min_slopes_per_x,
-                               n_trees=n_trees, min_samples_leaf=min_samples_leaf,
-                               rf_bootstrap=rf_bootstrap, max_features=max_features,
-                               supervised=supervised,
-                               verbose=verbose)
+    for leaf_xranges, leaf_slopes, slope_counts_at_x, dx, slope_at_x, pdpx, pdpy, ignored_ in trials:
         ignored += ignored_
         # print("ignored", ignored_, "pdpy", pdpy)
         all_pdpx.append(pdpx)
@@ -367,7 +637,8 @@ def plot_stratpd(X:pd.DataFrame, y:pd.Series, colname:str, targetname:str,
         avg_pdp_marker_size += 2
 
     # Get avg curve, reset pdpx and pdpy to the average
-    pdpx, pdpy = avg_pd_curve(all_pdpx, all_pdpy)
+    curve = avg_pd_curve(all_pdpx, all_pdpy)
+    pdpx, pdpy = curve['pdpx'].values, curve['pdpy'].values
     ax.plot(pdpx, pdpy, '.', c=pdp_marker_color, markersize=avg_pdp_marker_size, label=colname)
 
     if show_pdp_line:
@@ -394,7 +665,7 @@ def plot_stratpd(X:pd.DataFrame, y:pd.Series, colname:str, targetname:str,
             elif slope_line_endpoint_y > max_y:
                 max_y = slope_line_endpoint_y
 
-        lines = LineCollection(segments, alpha=slope_line_alpha, color=slope_line_color, linewidths=slope_line_width)
+        lines = mcollections.LineCollection(segments, alpha=slope_line_alpha, color=slope_line_color, linewidths=slope_line_width)
         ax.add_collection(lines)
 
     if xrange is not None:
@@ -503,6 +774,43 @@ def plot_stratpd(X:pd.DataFrame, y:pd.Series, colname:str, targetname:str,
     return pdpx, pdpy, ignored
 
 
+def avg_pd_curve(all_pdpx, all_pdpy, quantiles=(.05, .5, .95)) -> pd.DataFrame:
+    """
+    Combine the partial dependence curves from multiple trials, such as
+    the bootstrapped curves in plot_stratpd(), into one curve. Curve i has
+    pdpy values all_pdpy[i] at all_pdpx[i] and the curves don't have to share
+    x values. Return a dataframe with a row for each unique x in any curve, in
+    x order, with columns pdpx, pdpy (the average of the curves' y values at that
+    x), count (how many curves have that x), std, and a q<quantile> column per
+    quantile, e.g. 'q0.05', which shows how much the trials disagree.
+
+    It's vectorized: we group all curves' points by x with np.unique(return_inverse)
+    then sum per group with np.bincount and, for the quantiles, sort the points by
+    group and y so each group's quantile is an interpolation between two
+    neighbors.
+    """
+    x = np.concatenate([np.asarray(px, dtype=float) for px in all_pdpx]) if len(all_pdpx) else np.empty(0)
+    y = np.concatenate([np.asarray(py, dtype=float) for py in all_pdpy]) if len(all_pdpy) else np.empty(0)
+    pdpx, group = np.unique(x, return_inverse=True)
+    counts = np.bincount(group, minlength=len(pdpx))
+    pdpy = np.bincount(group, weights=y, minlength=len(pdpx)) / counts
+    std = np.sqrt(np.bincount(group, weights=(y - pdpy[group])**2, minlength=len(pdpx)) / counts)
+    curve = pd.DataFrame({'pdpx': pdpx, 'pdpy': pdpy, 'count': counts, 'std': std})
+
+    if len(quantiles)>0 and len(pdpx)>0:
+        order = np.lexsort((y, group)) # by group then y
+        sorted_y = y[order]
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        for q in quantiles:
+            # same as np.quantile's default linear interpolation within each group
+            pos = starts + q * (counts - 1)
+            lo = np.floor(pos).astype(int)
+            hi = np.ceil(pos).astype(int)
+            frac = pos - lo
+            curve[f'q{q}'] = sorted_y[lo] + (sorted_y[hi] - sorted_y[lo]) * frac
+    return curve
+
+
 def finite_differences(x: np.ndarray, y: np.ndarray):
     """
     Use the unique x values within a leaf to compute finite differences. Given, n unique
@@ -540,22 +848,19 @@ def finite_differences(x: np.ndarray, y: np.ndarray):
 
     If there is exactly one unique x value in the leaf, the leaf provides no information
     about how X[colname] contributes to changes in y. We have to ignore this leaf.
-    """
-    ignored = 0
 
-    # Group by x, take mean of all y with same x value (they come back sorted too)
-    uniq_x = np.unique(x)
-    avg_y = np.array([y[x==ux].mean() for ux in uniq_x])
+    This treats x,y as a single leaf and uses the same kernel, leaf_finite_differences_jit(),
+    that collect_discrete_slopes() uses for all leaves at once.
+    """
+    leaf_offsets = np.array([0, len(x)])
+    leaf_xranges, leaf_slopes, ignored = \
+        leaf_finite_differences(leaf_offsets, np.arange(len(x)), x, y)
 
-    if len(uniq_x)==1:
+    if ignored>0:
         # print(f"ignore {len(x)} in discrete_xc_space")
-        ignored += len(x)
         return np.array([[0]],dtype=x.dtype), np.array([0.0]), ignored
 
-    # FORWARD DIFF
-    x_deltas = np.diff(uniq_x)
-    y_deltas = np.diff(avg_y)
-    leaf_slopes = y_deltas / x_deltas  # "rise over run"
+    # FORWARD DIFF is computed by leaf_finite_differences_jit()
 
     # AVERAGE AROUND CENTER DIFF
     # At position i, take average of forward slope from y[i-1] to y[i] and
@@ -575,14 +880,12 @@ def finite_differences(x: np.ndarray, y: np.ndarray):
     # print("ctr",list(leaf_slopes_ctr))
     # print("grd",list(leaf_slopes))
 
-    leaf_xranges = np.array(list(zip(uniq_x, uniq_x[1:])))
-
     return leaf_xranges, leaf_slopes, ignored
 
 
-def collect_discrete_slopes(rf, X_col, X_not_col, y):
+def collect_discrete_slopes(leaf_offsets, leaf_sample_idxs, X_col, y):
     """
-    For each leaf of each tree of the decision tree or RF rf (trained on all features
+    For each leaf of each tree of the decision tree or RF (trained on all features
     except colname), get the leaf samples then isolate the X[colname] values
     and the target y values.  Compute the y deltas between unique X[colname] values.
     Like performing piecewise linear regression of X[colname] vs y
@@ -590,57 +893,137 @@ def collect_discrete_slopes(rf, X_col, X_not_col, y):
     the minimum y value before regressing because the slope won't be different.
     (We are ignoring the intercept of the regression line).
 
+    The leaves arrive in the CSR layout from leaf_samples_csr().
+
     Return for each leaf, the ranges of X[colname] partitions,
     associated slope for each range, and number of ignored samples.
     """
-    # start = timer()
-    leaf_slopes = []   # drop or rise between discrete x values
-    leaf_xranges = []  # drop is from one discrete value to next
-
-    ignored = 0
-
-    leaves = leaf_samples(rf, X_not_col)
-    y = y.values
-
-    if False:
-        nnodes = rf.estimators_[0].tree_.node_count
-        print(f"Partitioning 'x not {colname}': {nnodes} nodes in (first) tree, "
-              f"{len(rf.estimators_)} trees, {len(leaves)} total leaves")
-
-    for samples in leaves:
-        leaf_x = X_col[samples]
-        # leaf_x = one_leaf_samples[]#.reshape(-1,1)
-        leaf_y = y[samples]
+    if isinstance(X_col, pd.Series):
+        X_col = X_col.values
+    if isinstance(y, pd.Series):
+        y = y.values
 
-        if np.abs(np.min(leaf_x) - np.max(leaf_x)) < 1.e-8: # faster than np.isclose()
-            # print(f"ignoring xleft=xright @ {r[0]}")
-            ignored += len(leaf_x)
-            continue
-
-        leaf_xranges_, leaf_slopes_, ignored_ = \
-            finite_differences(leaf_x, leaf_y)
-
-        leaf_slopes.extend(leaf_slopes_)
-        leaf_xranges.extend(leaf_xranges_)
-        ignored += ignored_
+    leaf_xranges, leaf_slopes, ignored = \
+        leaf_finite_differences(leaf_offsets, leaf_sample_idxs, X_col, y)
 
     if len(leaf_xranges)==0:
         # make sure empty list has same shape (jit complains)
         leaf_xranges = np.array([]).reshape(0, 0)
-    else:
-        leaf_xranges = np.array(leaf_xranges)
-    leaf_slopes = np.array(leaf_slopes)
-
-    # stop = timer()
-    # if verbose: print(f"collect_discrete_slopes {stop - start:.3f}s")
     return leaf_xranges, leaf_slopes, ignored
 
 
-# We get about 20% boost from parallel but limits use of other parallelism it seems;
-# i get crashes when using multiprocessing package on top of this.
-# If using n_jobs=1 all the time for importances, then turn jit=False so this
-# method is not used
-@jit(nopython=True, parallel=True) # use prange not range.
+def leaf_finite_differences(leaf_offsets, leaf_sample_idxs, X_col, y):
+    """
+    Gather the x,y values of all leaves into one array, sorted by leaf and then
+    by x within each leaf, and let leaf_finite_differences_jit() compute the
+    finite differences for all leaves in a single pass. The sort is stable so
+    samples with the same x in a leaf are averaged in their original order.
+    """
+    leaf_sizes = np.diff(leaf_offsets)
+    leaf_of_sample = np.repeat(np.arange(len(leaf_sizes)), leaf_sizes)
+    leaf_x = X_col[leaf_sample_idxs]
+    by_leaf_then_x = np.lexsort((leaf_x, leaf_of_sample))
+    leaf_x = leaf_x[by_leaf_then_x]
+    leaf_y = y[leaf_sample_idxs[by_leaf_then_x]].astype(np.float64)
+    return leaf_finite_differences_jit(leaf_offsets, leaf_x, leaf_y)
+
+
+@jit(nopython=True, cache=True)
+def leaf_finite_differences_jit(leaf_offsets, leaf_x, leaf_y):
+    """
+    For leaf i, leaf_x[leaf_offsets[i]:leaf_offsets[i+1]] holds the sorted X[colname]
+    values and leaf_y the associated y values. Walk each leaf's runs of identical x,
+    averaging y for each unique x, and compute the forward difference from one
+    unique x to the next. See finite_differences().
+
+    All leaf x ranges and slopes go into preallocated arrays; a leaf of n samples
+    yields at most n-1 slopes so len(leaf_x) is an upper bound. Leaves whose x values
+    are all the same contribute nothing but their samples are counted as ignored.
+    """
+    n_leaves = leaf_offsets.shape[0] - 1
+    leaf_xranges = np.empty(shape=(leaf_x.shape[0], 2), dtype=leaf_x.dtype)
+    leaf_slopes = np.empty(shape=leaf_x.shape[0], dtype=np.float64)
+    nslopes = 0
+    ignored = 0
+    for leaf in range(n_leaves):
+        start, stop = leaf_offsets[leaf], leaf_offsets[leaf+1]
+        if stop == start:
+            continue
+        if abs(leaf_x[stop-1] - leaf_x[start]) < 1.e-8:  # min and max x are the same
+            ignored += stop - start
+            continue
+        prev_x = leaf_x[start]
+        prev_avg_y = 0.0
+        i = start
+        while i < stop:
+            # Group by x, take mean of all y with same x value
+            x = leaf_x[i]
+            sum_y = leaf_y[i]
+            count = 1
+            i += 1
+            while i < stop and leaf_x[i] == x:
+                sum_y += leaf_y[i]
+                count += 1
+                i += 1
+            avg_y = sum_y / count
+            if i - count > start: # FORWARD DIFF from previous unique x
+                leaf_xranges[nslopes, 0] = prev_x
+                leaf_xranges[nslopes, 1] = x
+                leaf_slopes[nslopes] = (avg_y - prev_avg_y) / (x - prev_x)  # "rise over run"
+                nslopes += 1
+            prev_x = x
+            prev_avg_y = avg_y
+    return leaf_xranges[:nslopes], leaf_slopes[:nslopes], ignored
+
+
+@jit(nopython=True, cache=True)
+def leaf_runs_jit(leaf_offsets, leaf_x):
+    """
+    Same walk over leaves as leaf_finite_differences_jit() but, instead of slopes,
+    return the index ranges in leaf_x of the two runs of identical x behind each
+    forward difference: leaf_x[starts[i]:mids[i]] and leaf_x[mids[i]:stops[i]]. Those
+    don't depend on y so partial_dependence_batch() can compute the slopes for
+    many y vectors at once.
+    """
+    n_leaves = leaf_offsets.shape[0] - 1
+    leaf_xranges = np.empty(shape=(leaf_x.shape[0], 2), dtype=leaf_x.dtype)
+    starts = np.empty(shape=leaf_x.shape[0], dtype=np.int64)
+    mids = np.empty(shape=leaf_x.shape[0], dtype=np.int64)
+    stops = np.empty(shape=leaf_x.shape[0], dtype=np.int64)
+    nslopes = 0
+    ignored = 0
+    for leaf in range(n_leaves):
+        start, stop = leaf_offsets[leaf], leaf_offsets[leaf+1]
+        if stop == start:
+            continue
+        if abs(leaf_x[stop-1] - leaf_x[start]) < 1.e-8:  # min and max x are the same
+            ignored += stop - start
+            continue
+        prev_run = start
+        i = start
+        while i < stop:
+            run = i
+            x = leaf_x[i]
+            i += 1
+            while i < stop and leaf_x[i] == x:
+                i += 1
+            if run > start:
+                leaf_xranges[nslopes, 0] = leaf_x[prev_run]
+                leaf_xranges[nslopes, 1] = x
+                starts[nslopes] = prev_run
+                mids[nslopes] = run
+                stops[nslopes] = i
+                nslopes += 1
+            prev_run = run
+    return leaf_xranges[:nslopes], starts[:nslopes], mids[:nslopes], stops[:nslopes], ignored
+
+
+# The sweep itself is sequential but locating each leaf's x range in uniq_x is
+# done in parallel. Whether that can run inside joblib workers depends on numba's
+# threading layer (e.g., workqueue crashes with worker threads) so callers with
+# n_jobs>1 pass parallel_jit=parallel_jit_safe(n_jobs, backend), which falls
+# back on avg_slopes_at_x_nonparallel_jit() when needed. See parallel.py.
+@jit(nopython=True, parallel=True, cache=True) # use prange not range.
 def avg_slopes_at_x_jit(uniq_x, leaf_ranges, leaf_slopes):
     """
     Compute the average of leaf_slopes at each uniq_x.
@@ -648,77 +1031,100 @@ def avg_slopes_at_x_jit(uniq_x, leaf_ranges, leaf_slopes):
     Value at max(x) is NaN since we have no data beyond that point and so there is
     no forward difference. If last range is 4..5 then slope at 5 is nan since we
     don't know where it's going to go from there.
+
+    A slope for range xr applies to all uniq_x in [xr[0], xr[1]) so, rather than
+    filling a (len(uniq_x), len(leaf_slopes)) matrix with mostly NaN, we find
+    the index range of each slope in sorted uniq_x with a binary search and then
+    sweep across uniq_x. See sweep_slopes().
     """
-    nx = uniq_x.shape[0]
     nslopes = leaf_slopes.shape[0]
-    slopes = np.empty(shape=(nx, nslopes), dtype=np.double)
+    starts = np.zeros(shape=nslopes, dtype=np.int64)
+    stops = np.zeros(shape=nslopes, dtype=np.int64)
     for i in prange(nslopes):
-        xr, slope = leaf_ranges[i], leaf_slopes[i]
-        # Compute slope all the way across uniq_x but then trim line so
-        # slope is only valid in range xr; don't set slope on right edge
-        slopes[:, i] = np.where( (uniq_x < xr[0]) | (uniq_x >= xr[1]), np.nan, slope)
-
-    # Slope values could be genuinely zero so we use nan not 0 for out-of-range.
-
-    # Now average horiz across the matrix, averaging within each range
-    # It's possible that some some rows would be purely NaN, indicating there are no
-    # slopes for that X[colname] value. This can happen when we ignore some leaves,
-    # when they have a single unique X[colname] value.
-
-    # Compute:
-    #   avg_slope_at_x = np.mean(slopes[good], axis=1)  (numba doesn't allow axis arg)
-    #   slope_counts_at_x = nslopes - np.isnan(slopes).sum(axis=1)
-    avg_slope_at_x = np.zeros(shape=nx)
-    slope_counts_at_x = np.zeros(shape=nx)
-    for i in prange(nx):
-        row = slopes[i, :]
-        n_nan = np.sum(np.isnan(row))
-        avg_slope_at_x[i] = np.nan if n_nan==nslopes else np.nanmean(row)
-        slope_counts_at_x[i] = nslopes - n_nan
-
-    # return average slope at each unique x value and how many slopes included in avg at each x
-    return avg_slope_at_x, slope_counts_at_x
+        starts[i] = np.searchsorted(uniq_x, leaf_ranges[i, 0])  # first x >= xr[0]
+        stops[i] = np.searchsorted(uniq_x, leaf_ranges[i, 1])   # first x >= xr[1]
+    return sweep_slopes(uniq_x.shape[0], starts, stops, leaf_slopes)
 
 
-# Hideous copying of avg_values_at_x_jit() to get different kinds of jit'ing. This is slower by 20%
-# than other version but can run in parallel with multiprocessing package.
-@jit(nopython=True)
+# Copy of avg_slopes_at_x_jit() w/o parallel jit'ing so it can run in parallel
+# with multiprocessing package.
+@jit(nopython=True, cache=True)
 def avg_slopes_at_x_nonparallel_jit(uniq_x, leaf_ranges, leaf_slopes):
     """
-    Compute the weighted average of leaf_slopes at each uniq_x.
+    Compute the average of leaf_slopes at each uniq_x.
 
     Value at max(x) is NaN since we have no data beyond that point and so there is
     no forward difference.
     """
-    nx = len(uniq_x)
-    nslopes = len(leaf_slopes)
-    slopes = np.zeros(shape=(nx, nslopes))
+    nslopes = leaf_slopes.shape[0]
+    starts = np.zeros(shape=nslopes, dtype=np.int64)
+    stops = np.zeros(shape=nslopes, dtype=np.int64)
     for i in range(nslopes):
-        xr, slope = leaf_ranges[i], leaf_slopes[i]
-        # Compute slope all the way across uniq_x but then trim line so
-        # slope is only valid in range xr; don't set slope on right edge
-        slopes[:, i] = np.where( (uniq_x < xr[0]) | (uniq_x >= xr[1]), np.nan, slope)
-
-    # Slope values could be genuinely zero so we use nan not 0 for out-of-range.
-
-    # Now average horiz across the matrix, averaging within each range
-    # It's possible that some some rows would be purely NaN, indicating there are no
-    # slopes for that X[colname] value. This can happen when we ignore some leaves,
-    # when they have a single unique X[colname] value.
-
-    # Compute:
-    #   avg_value_at_x = np.mean(slopes[good], axis=1)  (numba doesn't allow axis arg)
-    #   slope_counts_at_x = nslopes - np.isnan(slopes).sum(axis=1)
-    avg_value_at_x = np.zeros(shape=nx)
+        starts[i] = np.searchsorted(uniq_x, leaf_ranges[i, 0])  # first x >= xr[0]
+        stops[i] = np.searchsorted(uniq_x, leaf_ranges[i, 1])   # first x >= xr[1]
+    return sweep_slopes(uniq_x.shape[0], starts, stops, leaf_slopes)
+
+
+@jit(nopython=True, cache=True)
+def sweep_slopes(nx, starts, stops, leaf_slopes):
+    """
+    Slope i covers uniq_x indexes starts[i]..stops[i]-1. Record +slope and +1 count
+    at starts[i] and -slope and -1 count at stops[i] in difference arrays then
+    sweep left to right, accumulating the slope sum and count in effect at each x.
+    That is O(nx + nslopes) rather than O(nx * nslopes).
+
+    The running sums use Neumaier compensated summation, and the sum is reset to exactly 0
+    wherever no slopes are in effect, so that adding and later removing slopes of
+    very different magnitude doesn't leave rounding residue behind; the averages
+    match the per-x nanmean of the dense slope matrix to within an ulp or so.
+    Slopes that are NaN count as missing, as with nanmean.
+
+    Return average slope at each unique x value and how many slopes were included in
+    the average at each x (as float like np.nanmean() world).
+    """
+    nslopes = leaf_slopes.shape[0]
+    sum_delta = np.zeros(shape=nx+1)
+    sum_delta_comp = np.zeros(shape=nx+1)
+    count_delta = np.zeros(shape=nx+1, dtype=np.int64)
+    for i in range(nslopes):
+        slope = leaf_slopes[i]
+        start, stop = starts[i], stops[i]
+        if np.isnan(slope) or start >= stop:
+            continue
+        for j, v in ((start, slope), (stop, -slope)):
+            t = sum_delta[j] + v
+            if abs(sum_delta[j]) >= abs(v):
+                sum_delta_comp[j] += (sum_delta[j] - t) + v
+            else:
+                sum_delta_comp[j] += (v - t) + sum_delta[j]
+            sum_delta[j] = t
+        count_delta[start] += 1
+        count_delta[stop] -= 1
+
+    avg_slope_at_x = np.empty(shape=nx)
     slope_counts_at_x = np.zeros(shape=nx)
+    s = 0.0     # running sum of slopes in effect
+    comp = 0.0  # running compensation for lost low-order bits
+    count = 0
     for i in range(nx):
-        row = slopes[i, :]
-        n_nan = np.sum(np.isnan(row))
-        avg_value_at_x[i] = np.nan if n_nan==nslopes else np.nanmean(row)
-        slope_counts_at_x[i] = nslopes - n_nan
+        count += count_delta[i]
+        if count == 0:
+            s = 0.0
+            comp = 0.0
+            avg_slope_at_x[i] = np.nan
+            continue
+        for v in (sum_delta[i], sum_delta_comp[i]):
+            t = s + v
+            if abs(s) >= abs(v):
+                comp += (s - t) + v
+            else:
+                comp += (v - t) + s
+            s = t
+        avg_slope_at_x[i] = (s + comp) / count
+        slope_counts_at_x[i] = count
 
     # return average slope at each unique x value and how many slopes included in avg at each x
-    return avg_value_at_x, slope_counts_at_x
+    return avg_slope_at_x, slope_counts_at_x
 
 
 def plot_stratpd_gridsearch(X, y, colname, targetname,
@@ -727,6 +1133,7 @@ def plot_stratpd_gridsearch(X, y, colname, targetname,
                             n_trials=1,
                             yrange=None,
                             xrange=None,
+                            stratcache:StratificationCache=None,
                             show_regr_line=False,
                             show_slope_lines=False,
                             show_impact=False,
@@ -740,6 +1147,10 @@ def plot_stratpd_gridsearch(X, y, colname, targetname,
                             ticklabel_fontsize=7,
                             cellwidth=2.5,
                             cellheight=2.5):
+    if stratcache is None:
+        # Each min_samples_leaf column is the same stratification for every
+        # min_slopes_per_x row so only fit those once
+        stratcache = StratificationCache()
     ncols = len(min_samples_leaf_values)
     fig, axes = plt.subplots(len(min_slopes_per_x_values), ncols + 1,
                              figsize=((ncols + 1) * cellwidth, len(min_slopes_per_x_values)*cellheight))
@@ -766,6 +1177,7 @@ def plot_stratpd_gridsearch(X, y, colname, targetname,
                                  xrange=xrange_,
                                  yrange=yrange,
                                  n_trees=1,
+                                 stratcache=stratcache,
                                  show_ylabel=False,
                                  pdp_marker_size=pdp_marker_size,
                                  slope_line_alpha=slope_line_alpha,
@@ -866,7 +1278,7 @@ def plot_catstratpd_gridsearch(X, y, colname, targetname,
         col += 1
 
 
-def catwise_leaves(rf, X_not_col, X_col, y, max_catcode):
+def catwise_leaves(leaf_offsets, leaf_sample_idxs, X_col, y, max_catcode, sparse=False):
     """
     Return a 2D array with the average y value for each category in each leaf.
     Choose the cat code of smallest avg y as the reference category. I used to think it
@@ -901,48 +1313,96 @@ def catwise_leaves(rf, X_not_col, X_col, y, max_catcode):
     a leaf have values.  Shape is (max cat + 1, num leaves).
 
     Within a single leaf, there will typically only be a few categories represented.
-    """
-    leaves = leaf_samples(rf, X_not_col)
 
-    leaf_deltas = np.full(shape=(max_catcode+1, len(leaves)), fill_value=np.nan)
-    leaf_counts = np.zeros(shape=(max_catcode+1, len(leaves)), dtype=int)
-    keep_leaf_idxs = np.full(shape=(len(leaves),), fill_value=True, dtype=bool)
+    The leaves arrive in the CSR layout from leaf_samples_csr().
+
+    Rather than loop over leaves, we group all samples by (leaf, cat) pair at once
+    with group_leaf_cats() and get the average y per pair with np.bincount().
+
+    A dense (max cat + 1, num leaves) matrix gets huge for something like bulldozer
+    ModelID with thousands of codes and tens of thousands of leaves, even though
+    each leaf has just a few cats. With sparse=True, leaf_deltas and leaf_counts come
+    back as scipy.sparse CSC matrices (one compressed column per leaf) instead.
+    Both have the same structure, that of the (leaf, cat) pairs with observations, and
+    leaf_deltas stores its zeros explicitly so don't eliminate_zeros() it; the
+    reference category's delta is 0. Missing entries mean no data, i.e., nan.
+    avg_values_at_cat() accepts either form; see also densify_leaves().
+    """
+    ncats = max_catcode+1
+    n_leaves = len(leaf_offsets)-1
+    leaf_of_group, cat_of_group, group_of_sample, group_counts = \
+        group_leaf_cats(leaf_offsets, leaf_sample_idxs, X_col, ncats)
+
+    # perform a groupby([leaf,catname]).mean()
+    sum_y_per_group = np.bincount(group_of_sample, weights=y[leaf_sample_idxs],
+                                  minlength=len(group_counts))
+    avg_y_per_group = sum_y_per_group / group_counts
+
+    # if a leaf has a single cat then we have single cat avg y and its delta is 0
+    # but keep it as we'll treat as isolated group later and add marginal y for
+    # this cat to get partial dependence value.
+
+    # Can use any cat code as refcat; same "shape" of delta vec regardless of which we
+    # pick. The vector is shifted/up or down but cat y's all still have the same relative
+    # delta y. Might as well just pick the cat of smallest avg y.
+    # Previously, I picked a random# reference category but that is unnecessary.
+    # We will shift this vector during the merge operation so which we pick
+    # here doesn't matter.
+    min_avg_y_per_leaf = np.full(shape=(n_leaves,), fill_value=np.nan)
+    np.fmin.at(min_avg_y_per_leaf, leaf_of_group, avg_y_per_group) # fmin ignores nan like nanargmin
+    delta_y_per_group = avg_y_per_group - min_avg_y_per_leaf[leaf_of_group]
 
     ignored = 0
-    for leaf_i in range(len(leaves)):
-        sample = leaves[leaf_i]
-        leaf_cats = X_col[sample]
-        leaf_y = y[sample]
-        # perform a groupby(catname).mean()
-        uniq_leaf_cats, count_leaf_cats = np.unique(leaf_cats, return_counts=True) # comes back sorted
-        avg_y_per_cat = np.array([leaf_y[leaf_cats==cat].mean() for cat in uniq_leaf_cats])
-        # print("uniq_leaf_cats",uniq_leaf_cats,"count_y_per_cat",count_leaf_cats)
-
-        # if len(uniq_leaf_cats)==1 then we have single cat avg y and its delta is 0
-        # but keep it as we'll treat as isolated group later and add marginal y for
-        # this cat to get partial dependence value.
-
-        # Can use any cat code as refcat; same "shape" of delta vec regardless of which we
-        # pick. The vector is shifted/up or down but cat y's all still have the same relative
-        # delta y. Might as well just pick the cat of smallest avg y.
-        # Previously, I picked a random# reference category but that is unnecessary.
-        # We will shift this vector during the merge operation so which we pick
-        # here doesn't matter.
-        idx_of_ref_cat_in_leaf = np.nanargmin(avg_y_per_cat)
-        delta_y_per_cat = avg_y_per_cat - avg_y_per_cat[idx_of_ref_cat_in_leaf]
-        # print("delta_y_per_cat",delta_y_per_cat)
-
-        # Store into leaf i vector just those deltas we have data for
-        # leave cats w/o representation as nan (uses index to figure out which rows to alter)
-        leaf_deltas[uniq_leaf_cats, leaf_i] = delta_y_per_cat
-        leaf_counts[uniq_leaf_cats, leaf_i] = count_leaf_cats
-
-    # See unit test test_catwise_leaves:test_two_leaves_with_2nd_ignored()
-    leaf_deltas = leaf_deltas[:,keep_leaf_idxs]
-    leaf_counts = leaf_counts[:,keep_leaf_idxs]
+    if sparse:
+        # Groups are sorted by leaf then cat, so they are already in CSC order
+        indptr = np.searchsorted(leaf_of_group, np.arange(n_leaves+1))
+        leaf_deltas = csc_matrix((delta_y_per_group, cat_of_group, indptr), shape=(ncats, n_leaves))
+        leaf_counts = csc_matrix((group_counts, cat_of_group, indptr), shape=(ncats, n_leaves))
+        return leaf_deltas, leaf_counts, ignored
+
+    # Store into leaf vectors just those deltas we have data for
+    # leave cats w/o representation as nan
+    leaf_deltas = np.full(shape=(ncats, n_leaves), fill_value=np.nan)
+    leaf_counts = np.zeros(shape=(ncats, n_leaves), dtype=int)
+    leaf_deltas[cat_of_group, leaf_of_group] = delta_y_per_group
+    leaf_counts[cat_of_group, leaf_of_group] = group_counts
     return leaf_deltas, leaf_counts, ignored
 
 
+def group_leaf_cats(leaf_offsets, leaf_sample_idxs, X_col, ncats):
+    """
+    Group the samples in all leaves by (leaf, X_col category) pair. Return the leaf and
+    cat of each group, sorted by leaf then cat, the group of each sample in
+    leaf_sample_idxs, and the number of samples in each group.
+    """
+    leaf_sizes = np.diff(leaf_offsets)
+    leaf_of_sample = np.repeat(np.arange(len(leaf_sizes)), leaf_sizes)
+    groups, group_of_sample, group_counts = \
+        np.unique(leaf_of_sample * ncats + X_col[leaf_sample_idxs],
+                  return_inverse=True, return_counts=True)
+    return groups // ncats, groups % ncats, group_of_sample, group_counts
+
+
+def densify_leaves(leaf_deltas, leaf_counts):
+    "Return dense versions of sparse leaf_deltas, leaf_counts from catwise_leaves()"
+    if not issparse(leaf_deltas):
+        return leaf_deltas, leaf_counts
+    dense_deltas = np.full(shape=leaf_deltas.shape, fill_value=np.nan)
+    coo = leaf_deltas.tocoo()
+    dense_deltas[coo.row, coo.col] = coo.data
+    return dense_deltas, leaf_counts.toarray()
+
+
+def leaf_column(leaf_matrix, j, fill_value=np.nan):
+    "Return leaf j's column of dense or sparse leaf_deltas or leaf_counts as dense vector"
+    if not issparse(leaf_matrix):
+        return leaf_matrix[:, j].copy()
+    col = np.full(shape=(leaf_matrix.shape[0],), fill_value=fill_value, dtype=leaf_matrix.dtype)
+    start, stop = leaf_matrix.indptr[j], leaf_matrix.indptr[j+1]
+    col[leaf_matrix.indices[start:stop]] = leaf_matrix.data[start:stop]
+    return col
+
+
 def cat_partial_dependence(X, y,
                            colname,  # X[colname] expected to be numeric codes
                            max_catcode=None,  # if we're bootstrapping, might see diff max's so normalize to one max
@@ -951,37 +1411,30 @@ def cat_partial_dependence(X, y,
                            max_features=1.0,
                            rf_bootstrap=False,
                            supervised=True,
+                           random_state=None,
+                           stratcache:StratificationCache=None,
+                           stratifier:Stratifier=None,
+                           cache_dir=None,
                            verbose=False):
-    X_not_col = X.drop(colname, axis=1).values
-    X_col = X[colname].values
+    if cache_dir is not None:
+        return cached_call(cat_partial_dependence, locals(), ignore=('stratcache', 'verbose'))
+
+    X_col = np.asarray(as_datasource(X).column(colname))
     if (X_col<0).any():
         raise ValueError(f"Category codes must be > 0 in column {colname}")
     if not np.issubdtype(X_col.dtype, np.integer):
         raise ValueError(f"Category codes must be integers in column {colname} but is {X_col.dtype}")
     if max_catcode is None:
         max_catcode = np.max(X_col)
-    if supervised:
-        rf = RandomForestRegressor(n_estimators=n_trees,
-                                   min_samples_leaf=min_samples_leaf,
-                                   bootstrap = rf_bootstrap,
-                                   max_features = max_features,
-                                   oob_score=False)
-    else:
-        print("USING UNSUPERVISED MODE")
-        X_synth, y_synth = conjure_twoclass(X)
-        rf = RandomForestClassifier(n_estimators=n_trees,
-                                    min_samples_leaf=min_samples_leaf,  # * 2, # there are 2x as many samples (X,X') so must double leaf size
-                                    bootstrap=rf_bootstrap,
-                                    max_features=max_features,
-                                    oob_score=False)
-        rf.fit(X_synth.drop(colname,axis=1), y_synth)
-
-    rf.fit(X_not_col, y)
-    if verbose and supervised:
-        print(f"CatStrat Partition RF: dropping {colname} training R^2 {rf.score(X_not_col, y):.2f}")
 
+    leaf_offsets, leaf_sample_idxs = \
+        stratify(X, y, colname,
+                 n_trees=n_trees, min_samples_leaf=min_samples_leaf,
+                 rf_bootstrap=rf_bootstrap, max_features=max_features,
+                 supervised=supervised, random_state=random_state,
+                 stratcache=stratcache, stratifier=stratifier, verbose=verbose)
     leaf_deltas, leaf_counts, ignored = \
-        catwise_leaves(rf, X_not_col, X_col, y.values, max_catcode)
+        catwise_leaves(leaf_offsets, leaf_sample_idxs, X_col, y.values, max_catcode, sparse=True)
 
     uniq_x = np.unique(X_col)
     # Ignoring other vars, what is average y for all records with same catcode?
@@ -999,9 +1452,59 @@ def cat_partial_dependence(X, y,
     return leaf_deltas, leaf_counts, avg_per_cat, count_per_cat, ignored
 
 
+def cat_partial_dependence_batch(X_col:np.ndarray, Y:np.ndarray,
+                                 leaf_offsets, leaf_sample_idxs,
+                                 max_catcode=None):
+    """
+    Given the stratification leaves from stratify(), compute CatStratPD's avg_per_cat
+    for every column of the 2D response matrix Y. The average y per category
+    in each leaf, and per category overall, comes from one sparse matrix multiply for all
+    columns of Y but the leaves are merged by avg_values_at_cat() one column at a time.
+
+    Returns avg_per_cat with shape (max_catcode+1, Y.shape[1]) and count_per_cat,
+    which is the same for all columns.
+    """
+    if Y.ndim==1:
+        Y = Y.reshape(-1, 1)
+    if max_catcode is None:
+        max_catcode = np.max(X_col)
+    ncats = max_catcode+1
+    n, ntrials = Y.shape
+    Y = Y.astype(np.float64)
+
+    # Group samples by (leaf, cat) and average y down each column of Y per group
+    n_leaves = len(leaf_offsets)-1
+    leaf_of_group, cat_of_group, group_of_sample, group_counts = \
+        group_leaf_cats(leaf_offsets, leaf_sample_idxs, X_col, ncats)
+    group_sums = csr_matrix((np.ones(len(leaf_sample_idxs)),
+                             (group_of_sample, np.arange(len(leaf_sample_idxs)))),
+                            shape=(len(group_counts), len(leaf_sample_idxs))) @ Y[leaf_sample_idxs]
+    group_avgs = group_sums / group_counts.reshape(-1, 1)
+    # Subtract each leaf's min avg, per catwise_leaves()
+    min_group_avgs = np.full(shape=(n_leaves, ntrials), fill_value=np.nan)
+    np.fmin.at(min_group_avgs, leaf_of_group, group_avgs)
+    group_deltas = group_avgs - min_group_avgs[leaf_of_group]
+
+    indptr = np.searchsorted(leaf_of_group, np.arange(n_leaves+1))
+    leaf_counts = csc_matrix((group_counts, cat_of_group, indptr), shape=(ncats, n_leaves))
+
+    cat_counts = np.bincount(X_col, minlength=ncats)
+    cat_sums = csr_matrix((np.ones(n), (X_col, np.arange(n))), shape=(ncats, n)) @ Y
+    with np.errstate(invalid='ignore', divide='ignore'):
+        marginal_avg_y_per_cat = np.where(cat_counts.reshape(-1, 1) > 0,
+                                          cat_sums / cat_counts.reshape(-1, 1), np.nan)
+
+    avg_per_cat = np.empty(shape=(ncats, ntrials))
+    for j in range(ntrials):
+        leaf_deltas = csc_matrix((group_deltas[:,j], cat_of_group, indptr), shape=(ncats, n_leaves))
+        avg_per_cat[:,j], count_per_cat = \
+            avg_values_at_cat(leaf_deltas, leaf_counts, marginal_avg_y_per_cat[:,j])
+    return avg_per_cat, count_per_cat
+
+
 def avg_values_at_cat(leaf_deltas, leaf_counts,
                       marginal_avg_y_per_cat=None, # only used if disjoint cat sets exist
-                      max_iter=3, verbose=False):
+                      verbose=False):
     """
     Merge the deltas for categories from all of the leaves. If there
     is at least one category in common, then to groups of deltas can
@@ -1041,37 +1544,40 @@ def avg_values_at_cat(leaf_deltas, leaf_counts,
     the average price of a bulldozer in both categories, and use that
     to shift the two meta-cats relative to each other.
 
-    Rather than a complicated data structure and algorithm to find all
-    disjoint subsets of intersecting categories, it's easier to use the
-    existing algorithm I had already that merged leaves with categories in
-    common.  After merging all possible, there remains a set of leaf
-    indexes indicating what leaves remain to process. So, just call function
-    avg_values_at_cat_one_disjoint_region() repeatedly until the work
-    set comes back as empty. That indicates all leaves have been
-    integrated. The count per category vectors can simply be added
-    together to get the final count per category. The catavg is the
-    running vector average computed in each pass over the leaves. For
-    that, we can add them vectors together to get a single vector
-    (like a set union), but we still need to keep track of the different
-    disjoint category groups. We can do this by collecting a list
-    of cat sets.  Then we compute the average y for those categories
-    for each group. Then update the catavg vector values for each
-    group.
+    To find the disjoint groups, think of leaves and categories as nodes of a
+    graph with an edge between each leaf and each category it has data for. The
+    disjoint groups are then the connected components of that graph and a
+    breadth-first search from a component's first leaf visits every leaf in
+    the component right after some leaf it shares a category with; see
+    bfs_leaf_order(). Merging leaves in that order means every leaf intersects the
+    running average when it's merged, so we need a single pass per component.
+    (I used to make up to max_iter passes over the remaining leaves,
+    merging whatever intersected, which silently dropped leaves if max_iter
+    was too small.) The count per category vectors can simply be added
+    together to get the final count per category. The catavg for each
+    component goes into a single vector (like a set union), but we still need
+    to keep track of the different disjoint category groups. We can do
+    this by collecting a list of cat sets.  Then we compute the average y
+    for those categories for each group. Then update the catavg vector
+    values for each group.
+
+    leaf_deltas and leaf_counts can be dense matrices or the sparse CSC matrices
+    from catwise_leaves(..., sparse=True).
 
     See comment for avg_values_at_cat_one_disjoint_region()
     """
-    # catavg is the running average vector and starts out as the first column (1st leaf's deltas)
-    catavg = np.full(shape=(leaf_deltas.shape[0],), fill_value=np.nan, dtype=np.float)
+    leaf_deltas, leaf_counts = sparsify_leaves(leaf_deltas, leaf_counts)
+    ncats = leaf_deltas.shape[0]
+    # catavg is the running average vector
+    catavg = np.full(shape=(ncats,), fill_value=np.nan, dtype=float)
     catgroups = []
-    count_per_cat = np.zeros(shape=(leaf_deltas.shape[0],), dtype=np.int)
-    work = range(0, leaf_deltas.shape[1])  # all leaf indexes added to work list
-    # print("START work", work)
-    while len(work)>0:
-        catavg_, count_per_cat_, work = \
-            avg_values_at_cat_one_disjoint_region(work, leaf_counts, leaf_deltas, max_iter, verbose)
+    count_per_cat = np.zeros(shape=(ncats,), dtype=int)
+    order, component_offsets = bfs_leaf_order(leaf_deltas)
+    for start, stop in zip(component_offsets[:-1], component_offsets[1:]):
+        catavg_, count_per_cat_ = \
+            avg_values_at_cat_one_disjoint_region(order[start:stop], leaf_deltas, leaf_counts, verbose)
         # print("catavg", catavg_)
         # print("count_per_cat", count_per_cat_)
-        # print("remaining work",work)
         catgroup = np.where(count_per_cat_>0)[0]
         # print("catgroup", catgroup)
         catgroups.append(catgroup)
@@ -1096,7 +1602,79 @@ def avg_values_at_cat(leaf_deltas, leaf_counts,
     return catavg, count_per_cat
 
 
-def avg_values_at_cat_one_disjoint_region(work, leaf_counts, leaf_deltas, max_iter, verbose):
+def sparsify_leaves(leaf_deltas, leaf_counts):
+    """
+    Return leaf_deltas, leaf_counts as sparse CSC matrices per catwise_leaves(..., sparse=True),
+    keeping an entry wherever dense leaf_deltas is not nan (even if the count is 0).
+    """
+    if issparse(leaf_deltas):
+        return leaf_deltas.tocsc(), leaf_counts.tocsc()
+    ncats, n_leaves = leaf_deltas.shape
+    leaf_idx, cat_idx = np.nonzero(~np.isnan(leaf_deltas.T)) # by leaf then cat
+    indptr = np.searchsorted(leaf_idx, np.arange(n_leaves+1))
+    return csc_matrix((leaf_deltas[cat_idx, leaf_idx], cat_idx, indptr), shape=(ncats, n_leaves)), \
+           csc_matrix((np.asarray(leaf_counts)[cat_idx, leaf_idx], cat_idx, indptr), shape=(ncats, n_leaves))
+
+
+def bfs_leaf_order(leaf_deltas):
+    """
+    Given sparse CSC leaf_deltas, return the order in which to merge leaves and the
+    offsets into that order where each group of leaves with categories in common
+    (connected component) starts, plus a final offset for the end. Groups are
+    ordered by their lowest leaf index. Leaves without any categories are left out.
+    """
+    ncats, n_leaves = leaf_deltas.shape
+    # Same structure, but as ones so tocsr() can't lose explicit zero deltas
+    structure = csc_matrix((np.ones(len(leaf_deltas.indices)), leaf_deltas.indices, leaf_deltas.indptr),
+                           shape=(ncats, n_leaves))
+    leaves_of_cat = structure.tocsr()
+    return bfs_leaf_order_jit(structure.indptr, structure.indices,
+                              leaves_of_cat.indptr, leaves_of_cat.indices, ncats)
+
+
+@jit(nopython=True, cache=True)
+def bfs_leaf_order_jit(leaf_indptr, leaf_cats, cat_indptr, cat_leaves, ncats):
+    """
+    Breadth-first search of the bipartite leaf-category graph from each leaf not yet
+    visited, in increasing leaf order. leaf_cats[leaf_indptr[i]:leaf_indptr[i+1]] are the
+    categories of leaf i and cat_leaves[cat_indptr[c]:cat_indptr[c+1]] are the leaves
+    with category c. Each leaf and category is visited once.
+    """
+    n_leaves = leaf_indptr.shape[0] - 1
+    order = np.empty(shape=n_leaves, dtype=np.int64)
+    component_offsets = np.empty(shape=n_leaves+1, dtype=np.int64)
+    visited_leaf = np.zeros(shape=n_leaves, dtype=np.bool_)
+    visited_cat = np.zeros(shape=ncats, dtype=np.bool_)
+    head = 0
+    tail = 0
+    ncomponents = 0
+    for seed in range(n_leaves):
+        if visited_leaf[seed] or leaf_indptr[seed] == leaf_indptr[seed+1]:
+            continue
+        component_offsets[ncomponents] = tail
+        ncomponents += 1
+        visited_leaf[seed] = True
+        order[tail] = seed
+        tail += 1
+        while head < tail:
+            leaf = order[head]
+            head += 1
+            for k in range(leaf_indptr[leaf], leaf_indptr[leaf+1]):
+                cat = leaf_cats[k]
+                if visited_cat[cat]:
+                    continue
+                visited_cat[cat] = True
+                for m in range(cat_indptr[cat], cat_indptr[cat+1]):
+                    other = cat_leaves[m]
+                    if not visited_leaf[other]:
+                        visited_leaf[other] = True
+                        order[tail] = other
+                        tail += 1
+    component_offsets[ncomponents] = tail
+    return order[:tail], component_offsets[:ncomponents+1]
+
+
+def avg_values_at_cat_one_disjoint_region(leaves, leaf_deltas, leaf_counts, verbose):
     """
     In leaf_deltas, we have information from the leaves indicating how
     much above or below each category was from the reference category
@@ -1106,18 +1684,16 @@ def avg_values_at_cat_one_disjoint_region(work, leaf_counts, leaf_deltas, max_it
     and the relative y for the reference category is 0.  Categories
     not mentioned in the leaf, will have NAN values.
 
-    The goal is to merge all of the columns in leaf_deltas, despite
-    the fact that they do not have the same reference category. We
-    init a running average vector to be the first column of category
-    deltas. Then we attempt to merge each of the other columns into
-    the running average. We make multiple passes over the columns of
-    leaf_deltas until nothing changes, we hit the maximum number of
-    iterations, or everything has merged.
-
-    To merge vector v (column j of leaf_deltas) into catavg, select a
-    category, index ix, in common at random.  Subtract v[ix] from v so
-    that ix is v's new reference and v[ix]=0. Add catavg[ix] to the
-    adjusted v so that v is now comparable to catavg. We can now do a
+    The goal is to merge all of the leaves, columns in leaf_deltas, of a
+    single connected component despite the fact that they do not have
+    the same reference category. We init a running average vector to be
+    the first leaf's category deltas. Then we merge each of the other
+    leaves into the running average in BFS order from bfs_leaf_order(),
+    which guarantees each leaf has a category in common with the running average.
+
+    To merge vector v (column j of leaf_deltas) into catavg, shift v
+    so that it is comparable to catavg at the categories in common;
+    see merge_leaves_jit(). We can now do a
     weighted average of catavg and v, paying careful attention of NaN.
 
     Previously, I was picking a random category for merging in an
@@ -1126,9 +1702,7 @@ def avg_values_at_cat_one_disjoint_region(work, leaf_counts, leaf_deltas, max_it
     running average vector and a new vector, randomly picking one
     means a 1/5 chance of picking the outlier.  Outliers as reference
     categories shift the outlierness to all other categories. Boooo
-
-    Now, I select the category in common that has the most evidence:
-    the category associated with the most number of observations.
+    Now we effectively use all categories in common as the reference.
 
     It's possible that more than a single value within a leaf_deltas
     vector is 0.  I.e., the reference category value is always 0 in
@@ -1157,80 +1731,68 @@ def avg_values_at_cat_one_disjoint_region(work, leaf_counts, leaf_deltas, max_it
      [1 0 0]
      [1 0 0]]
     """
-    initial_leaf_idx = work[0]
-    work = set(work[1:])
-    catavg = leaf_deltas[:, initial_leaf_idx]  # init with first ref category (column)
-    catavg_weight = leaf_counts[:, initial_leaf_idx]
-    completed = {-1}  # init to any nonempty set to enter loop
-    iteration = 1
-    # Three passes should be sufficient to merge all possible vectors, but
-    # I'm being paranoid here and allowing it to run until completion or some maximum iterations
-    while len(work) > 0 and len(completed) > 0 and iteration <= max_iter:
-        # print(f"PASS {iteration} len(work)", len(work))
-        completed = set()
-        for j in work:  # for remaining leaf index in work list, avg in the vectors
-            v = leaf_deltas[:, j]
-            are_intersecting = ~np.isnan(catavg) & ~np.isnan(v)
-            intersection_idx = np.where(are_intersecting)[0]
-
-            # print(intersection_idx)
-            if len(intersection_idx) == 0:  # found something to merge into catavg?
-                continue
-
-            # Merge column j into catavg vector
-            # cat for merging is the one with most supporting evidence
-            cur_weight = leaf_counts[:, j]
-
-            PICK_MOST_CONF = False
-            if PICK_MOST_CONF:
-                ix = np.argmax(np.where((cur_weight > 0) & are_intersecting, cur_weight, 0))
-                shifted_v = v - v[ix]  # make ix the reference cat in common
-                relative_to_value = catavg[ix]  # corresponding value in catavg
-                adjusted_v = shifted_v + relative_to_value  # adjust so v is mergeable with catavg
-            else:
-                adjusted_v = compute_avg_merge_candidate(catavg, v, intersection_idx)
+    catavg, catavg_weight = \
+        merge_leaves_jit(np.asarray(leaves, dtype=np.int64),
+                         leaf_deltas.indptr, leaf_deltas.indices,
+                         leaf_deltas.data.astype(np.float64),
+                         leaf_counts.data.astype(np.int64),
+                         leaf_deltas.shape[0])
+    if verbose:
+        print(f"merged {len(leaves)} leaves starting at leaf {leaves[0]}:", parray(catavg))
+    return catavg, catavg_weight
+
 
-            prev_catavg = catavg  # track only for verbose/debugging purposes
-            catavg = nanavg_vectors(catavg, adjusted_v, catavg_weight, cur_weight)
+@jit(nopython=True, cache=True)
+def merge_leaves_jit(leaves, indptr, cats, deltas, counts, ncats):
+    """
+    Merge the leaves, in order, into a running average vector per
+    avg_values_at_cat_one_disjoint_region(). Leaf j's categories are
+    cats[indptr[j]:indptr[j+1]] with deltas and counts at the same positions
+    (sparse CSC leaf_deltas and leaf_counts). Shifting and averaging in a leaf
+    touches just that leaf's categories, not all ncats.
+
+    Given intersecting deltas in catavg and v, we merge the average delta over
+    all possible reference cats in common. If one cat is an outlier, picking
+    that really distorts the vector we merge into running average vector.
+    When there is no noise in y, the average merge candidate is the same as any
+    single candidate, so averaging doesn't cost us anything. It only helps to
+    spread noise across categories. The candidate for ref cat i is
+    v - v[i] + catavg[i], so the average candidate is just v shifted by
+    mean(catavg[I] - v[I]) for intersection I; no need to build all |I|
+    candidate vectors. The average with catavg is nanavg_vectors() one
+    category at a time.
+    """
+    catavg = np.full(shape=ncats, fill_value=np.nan)
+    catavg_weight = np.zeros(shape=ncats, dtype=np.int64)
+    first = leaves[0]
+    for k in range(indptr[first], indptr[first+1]):
+        catavg[cats[k]] = deltas[k]
+        catavg_weight[cats[k]] = counts[k]
+
+    for j in leaves[1:]:
+        start, stop = indptr[j], indptr[j+1]
+        # Shift leaf j's deltas to be comparable with catavg: mean(catavg[I] - v[I])
+        sum_diffs = 0.0
+        nintersecting = 0
+        for k in range(start, stop):
+            if not np.isnan(catavg[cats[k]]) and not np.isnan(deltas[k]):
+                sum_diffs += catavg[cats[k]] - deltas[k]
+                nintersecting += 1
+        shift = sum_diffs / nintersecting if nintersecting > 0 else np.nan
+
+        for k in range(start, stop):
+            cat = cats[k]
+            v = deltas[k] + shift
+            if np.isnan(catavg[cat]):  # copy where b has only value (unweighted)
+                catavg[cat] = v
+            elif not np.isnan(v):      # weighted avg where both are non-nan
+                wsum = catavg_weight[cat] + counts[k]
+                if wsum == 0:
+                    wsum = 1
+                catavg[cat] = (catavg[cat] * catavg_weight[cat] + v * counts[k]) / wsum
             # Update weight of running avg to incorporate "mass" from v
-            catavg_weight += cur_weight
-            if verbose:
-                # TODO: broken
-                print(f"{ix:-2d} : vec to add =", parray(v), f"- {v[ix]:.2f}")
-                print("     shifted    =", parray(shifted_v),
-                      f"+ {relative_to_value:.2f}")
-                print("     adjusted   =", parray(adjusted_v), "*", cur_weight)
-                print("     prev avg   =", parray(prev_catavg), "*",
-                      catavg_weight - cur_weight)
-                print("     new avg    =", parray(catavg))
-                print()
-            completed.add(j)
-        iteration += 1
-        work = work - completed
-    return catavg, catavg_weight, list(work)
-
-
-def compute_avg_merge_candidate(catavg, v, intersection_idx):
-    """
-    Given intersecting deltas in catavg and v, compute average delta
-    one could merge into running average.  If one cat is an outlier,
-    picking that really distorts the vector we merge into running
-    average vector. So, effectively merge using all as the ref
-    cat in common by merging in average of all possible refcats.
-
-    When there is no noise in y, the average merge candidate is
-    the same as any single candidate. So, with no noise, we get
-    exact answer; averaging here doesn't cost us anything. It
-    only helps to spread noise across categories.
-    """
-    merge_candidates = []
-    for i in intersection_idx:
-        merge_candidates.append(v - v[i] + catavg[i])
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", category=RuntimeWarning)
-        # We get "Mean of empty slice" when all entries are Nan but we want that.
-        v = np.nanmean(merge_candidates, axis=0)
-    return v
+            catavg_weight[cat] += counts[k]
+    return catavg, catavg_weight
 
 
 def plot_catstratpd(X, y,
@@ -1245,6 +1807,12 @@ def plot_catstratpd(X, y,
                     rf_bootstrap=False,
                     min_samples_leaf=5,
                     max_features=1.0,
+                    n_jobs=1,
+                    backend='loky',
+                    random_state=None,
+                    stratcache:StratificationCache=None,
+                    stratifier:Stratifier=None,
+                    cache_dir=None,
                     yrange=None,
                     title=None,
                     show_x_counts=True,
@@ -1308,7 +1876,22 @@ def plot_catstratpd(X, y,
                             of a single leaf node containing all
                             observations, leading to a marginal not
                             partial dependence curve.
+
+    :param n_jobs: How many trials to run in parallel, using joblib's backend
+                   ('loky' processes or 'threading'). Default is 1.
+
+    :param random_state: Seed for the trials' resampling and stratification forests
+                         so that the plot is reproducible. Default is None.
+
+    :param stratcache: a StratificationCache to reuse stratification forest leaves
+                       across calls with the same data and hyper parameters
+
+    :param cache_dir: a directory where we keep each trial's results on disk so
+                      plotting again with the same data, hyper parameters, and
+                      random_state just loads them; random_state can't be None
+                      then (ValueError). Default is None (no caching).
     """
+    check_seeded(cache_dir, random_state, 'plot_catstratpd')
     if ax is None:
         if figsize is not None:
             fig, ax = plt.subplots(1, 1, figsize=figsize)
@@ -1338,29 +1921,27 @@ def plot_catstratpd(X, y,
         return m
     '''
 
+    trial = partial(cat_partial_dependence,
+                    max_catcode=np.max(X_col),
+                    colname=colname,
+                    n_trees=n_trees,
+                    min_samples_leaf=min_samples_leaf,
+                    max_features=max_features,
+                    rf_bootstrap=rf_bootstrap,
+                    stratcache=stratcache,
+                    stratifier=stratifier,
+                    cache_dir=cache_dir,
+                    verbose=verbose)
+    trials = run_trials(trial, X, y, n_trials=n_trials,
+                        bootstrap=bootstrap, subsample_size=subsample_size,
+                        random_state=random_state,
+                        n_jobs=n_jobs, backend=backend)
+
     impacts = []
     importances = []
     all_avg_per_cat = []
     ignored = 0
-    for i in range(n_trials):
-        if n_trials>1:
-            if bootstrap:
-                idxs = resample(range(n), n_samples=n, replace=True)
-            else: # use subsetting
-                idxs = resample(range(n), n_samples=int(n * subsample_size), replace=False)
-            X_, y_ = X.iloc[idxs], y.iloc[idxs]
-        else:
-            X_, y_ = X, y
-
-        leaf_deltas, leaf_counts, avg_per_cat, count_per_cat, ignored_ = \
-            cat_partial_dependence(X_, y_,
-                                   max_catcode=np.max(X_col),
-                                   colname=colname,
-                                   n_trees=n_trees,
-                                   min_samples_leaf=min_samples_leaf,
-                                   max_features=max_features,
-                                   rf_bootstrap=rf_bootstrap,
-                                   verbose=verbose)
+    for leaf_deltas, leaf_counts, avg_per_cat, count_per_cat, ignored_ in trials:
         impact, importance = featimp.cat_compute_importance(avg_per_cat, count_per_cat)
         impacts.append(impact)
         importances.append(importance)
@@ -1420,7 +2001,7 @@ def plot_catstratpd(X, y,
         # ax.plot([cat-0.5,cat+0.5], [delta,delta], '-',
         #         lw=1.0, c=pdp_color, alpha=pdp_marker_alpha)
         # ax.plot(range(len(uniq_catcodes)), avg_delta, '.', c='k', markersize=pdp_marker_size + 1)
-    lines = LineCollection(segments, alpha=pdp_marker_alpha, color=pdp_color, linewidths=pdp_marker_lw)
+    lines = mcollections.LineCollection(segments, alpha=pdp_marker_alpha, color=pdp_color, linewidths=pdp_marker_lw)
     ax.add_collection(lines)
     '''
 
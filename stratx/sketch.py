@@ -0,0 +1,167 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import numpy as np
+from scipy.sparse import csc_matrix
+
+import stratx.partdep as partdep
+from stratx.datasource import as_datasource
+
+
+def pd_sketch(X, y, colname, catcol=False,
+              n_trees=1, min_samples_leaf=None, rf_bootstrap=False, max_features=1.0,
+              supervised=True,
+              random_state=None,
+              verbose=False) -> dict:
+    """
+    Map step for computing StratPD or CatStratPD on data sharded across machines.
+    Stratify this shard's X, y and return a compact summary of what
+    partial_dependence() (or, if catcol, cat_partial_dependence()) needs from it:
+
+    numerical:   the leaf x ranges and slopes, the unique x values with their counts,
+                 and the number of ignored samples
+    categorical: the sparse leaf deltas and counts from catwise_leaves() plus the
+                 sum and count of y per category (for the marginal avg y per cat)
+
+    A sketch is a plain dict of arrays, so it pickles and travels between processes easily,
+    and is roughly the size of the leaves not the data. Combine sketches with
+    merge_sketches() and get the curve from sketch_partial_dependence() or
+    sketch_cat_partial_dependence().
+
+    Each shard's forest stratifies only its own rows so merging sketches is like
+    pooling the leaves of one forest with a tree per shard. StratPD averages
+    slopes across leaves and CatStratPD merges leaf deltas, regardless of which tree
+    a leaf comes from. Give each shard its own random_state. If you use
+    multiprocessing locally, use the 'spawn' start method because forking a process
+    after numba's parallel jit has started its threads can deadlock.
+    """
+    if min_samples_leaf is None:
+        min_samples_leaf = 5 if catcol else 15
+    X_col = np.asarray(as_datasource(X).column(colname))
+    leaf_offsets, leaf_sample_idxs = \
+        partdep.stratify(X, y, colname,
+                         n_trees=n_trees, min_samples_leaf=min_samples_leaf,
+                         rf_bootstrap=rf_bootstrap, max_features=max_features,
+                         supervised=supervised, random_state=random_state,
+                         verbose=verbose)
+    y = np.asarray(y, dtype=np.float64)
+    if catcol:
+        max_catcode = np.max(X_col)
+        leaf_deltas, leaf_counts, ignored = \
+            partdep.catwise_leaves(leaf_offsets, leaf_sample_idxs, X_col, y, max_catcode, sparse=True)
+        uniq_x, x_idx, x_counts = np.unique(X_col, return_inverse=True, return_counts=True)
+        return {'colname': colname, 'catcol': True, 'n': len(X_col),
+                'leaf_deltas': leaf_deltas, 'leaf_counts': leaf_counts,
+                'uniq_x': uniq_x, 'x_sum_y': np.bincount(x_idx, weights=y),
+                'x_counts': x_counts, 'ignored': ignored}
+
+    X_col = X_col.round(decimals=10) # same hack as partial_dependence()
+    leaf_xranges, leaf_slopes, ignored = \
+        partdep.collect_discrete_slopes(leaf_offsets, leaf_sample_idxs, X_col, y)
+    uniq_x, x_counts = np.unique(X_col, return_counts=True)
+    return {'colname': colname, 'catcol': False, 'n': len(X_col),
+            'leaf_xranges': leaf_xranges.reshape(-1, 2), 'leaf_slopes': leaf_slopes,
+            'uniq_x': uniq_x, 'x_counts': x_counts, 'ignored': ignored}
+
+
+def merge_sketches(sketches) -> dict:
+    """
+    Reduce step: merge sketches from pd_sketch() (or earlier merges) of the same
+    column into one sketch. Merging is associative and only concatenates leaves and
+    adds counts so reducers can merge in any grouping, e.g., in a tree.
+    """
+    sketches = list(sketches)
+    if len(sketches)==0:
+        raise ValueError("No sketches to merge")
+    colname, catcol = sketches[0]['colname'], sketches[0]['catcol']
+    for s in sketches:
+        if s['colname'] != colname or s['catcol'] != catcol:
+            raise ValueError(f"Can't merge sketch of {s['colname']} with sketch of {colname}")
+
+    uniq_x, x_idx = np.unique(np.concatenate([s['uniq_x'] for s in sketches]), return_inverse=True)
+    merged = {'colname': colname, 'catcol': catcol,
+              'n': sum(s['n'] for s in sketches),
+              'uniq_x': uniq_x,
+              'x_counts': np.bincount(x_idx, weights=np.concatenate([s['x_counts'] for s in sketches]),
+                                      minlength=len(uniq_x)).astype(np.int64),
+              'ignored': sum(s['ignored'] for s in sketches)}
+    if catcol:
+        merged['x_sum_y'] = np.bincount(x_idx, weights=np.concatenate([s['x_sum_y'] for s in sketches]),
+                                        minlength=len(uniq_x))
+        ncats = int(uniq_x[-1]) + 1
+        merged['leaf_deltas'] = hstack_leaves([s['leaf_deltas'] for s in sketches], ncats)
+        merged['leaf_counts'] = hstack_leaves([s['leaf_counts'] for s in sketches], ncats)
+    else:
+        merged['leaf_xranges'] = np.concatenate([s['leaf_xranges'] for s in sketches])
+        merged['leaf_slopes'] = np.concatenate([s['leaf_slopes'] for s in sketches])
+    return merged
+
+
+def sketch_partial_dependence(sketch, min_slopes_per_x=5, parallel_jit=True):
+    """
+    Return leaf_xranges, leaf_slopes, slope_counts_at_x, dx, slope_at_x, pdpx, pdpy,
+    ignored from a numerical sketch, per partdep.partial_dependence().
+    """
+    if sketch['catcol']:
+        raise ValueError(f"{sketch['colname']} is categorical; use sketch_cat_partial_dependence()")
+    leaf_xranges = sketch['leaf_xranges']
+    if len(leaf_xranges)==0:
+        leaf_xranges = np.array([]).reshape(0, 0) # per collect_discrete_slopes()
+    slope_counts_at_x, dx, slope_at_x, pdpx, pdpy = \
+        partdep.integrate_slopes(sketch['uniq_x'], leaf_xranges, sketch['leaf_slopes'],
+                                 min_slopes_per_x=min_slopes_per_x, parallel_jit=parallel_jit)
+    return leaf_xranges, sketch['leaf_slopes'], slope_counts_at_x, dx, slope_at_x, pdpx, pdpy, \
+           sketch['ignored']
+
+
+def sketch_cat_partial_dependence(sketch, verbose=False):
+    """
+    Return leaf_deltas, leaf_counts, avg_per_cat, count_per_cat, ignored from a
+    categorical sketch, per partdep.cat_partial_dependence().
+    """
+    if not sketch['catcol']:
+        raise ValueError(f"{sketch['colname']} is numerical; use sketch_partial_dependence()")
+    leaf_deltas, leaf_counts = sketch['leaf_deltas'], sketch['leaf_counts']
+    marginal_avg_y_per_cat = np.full(shape=(leaf_deltas.shape[0],), fill_value=np.nan)
+    marginal_avg_y_per_cat[sketch['uniq_x']] = sketch['x_sum_y'] / sketch['x_counts']
+    avg_per_cat, count_per_cat = \
+        partdep.avg_values_at_cat(leaf_deltas, leaf_counts, marginal_avg_y_per_cat, verbose=verbose)
+    return leaf_deltas, leaf_counts, avg_per_cat, count_per_cat, sketch['ignored']
+
+
+def hstack_leaves(leaf_matrices, ncats):
+    """
+    Concatenate the leaf columns of sparse CSC leaf_deltas or leaf_counts matrices,
+    making them all ncats rows tall. Done by hand, rather than scipy.sparse.hstack(),
+    to guarantee the explicit 0 deltas of reference categories survive.
+    """
+    nnz = np.cumsum([0] + [M.nnz for M in leaf_matrices])
+    indptr = [M.indptr[:-1] + offset for M, offset in zip(leaf_matrices, nnz)]
+    indptr.append([nnz[-1]])
+    n_leaves = sum(M.shape[1] for M in leaf_matrices)
+    return csc_matrix((np.concatenate([M.data for M in leaf_matrices]),
+                       np.concatenate([M.indices for M in leaf_matrices]),
+                       np.concatenate(indptr)),
+                      shape=(ncats, n_leaves))
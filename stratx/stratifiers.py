@@ -0,0 +1,293 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import numpy as np
+import sklearn
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.tree import DecisionTreeRegressor
+
+
+class Stratifier:
+    """
+    Something that partitions X not colname into groups of similar records, the
+    strata within which StratPD and CatStratPD compare x and y. The protocol mirrors
+    sklearn's forests: fit(X_not_col, y) learns a partitioning and returns self;
+    apply(X_not_col) returns an (n, n_partitions) integer matrix whose column t
+    holds the leaf (stratum) id of each record under partitioning t. Ids only have
+    to be distinct within a column. Pass a stratifier to stratify(),
+    partial_dependence(), cat_partial_dependence(), or importances(); stratify() fits a
+    copy so one stratifier object can be reused across features and threads.
+
+    Subclasses store their hyper parameters as attributes of the same name as
+    their __init__ arguments, which gives us a useful repr() for cache keys.
+    """
+    def fit(self, X_not_col:np.ndarray, y:np.ndarray) -> 'Stratifier':
+        raise NotImplementedError()
+
+    def apply(self, X_not_col:np.ndarray) -> np.ndarray:
+        raise NotImplementedError()
+
+    def __repr__(self):
+        params = ', '.join(f"{k}={v!r}" for k, v in sorted(self.__dict__.items())
+                           if not k.startswith('_') and not k.endswith('_'))
+        return f"{self.__class__.__name__}({params})"
+
+
+class ForestStratifier(Stratifier):
+    """
+    The random forest (usually of a single tree) that stratify() uses by default. If
+    not supervised, use Breiman's trick: train a classifier to distinguish X not
+    colname from a scrambled version of it.
+    """
+    def __init__(self, n_trees=1, min_samples_leaf=15, rf_bootstrap=False, max_features=1.0,
+                 supervised=True, random_state=None):
+        self.n_trees = n_trees
+        self.min_samples_leaf = min_samples_leaf
+        self.rf_bootstrap = rf_bootstrap
+        self.max_features = max_features
+        self.supervised = supervised
+        self.random_state = random_state
+
+    def fit(self, X_not_col, y):
+        from stratx.partdep import stratification_forest
+        self.rf_ = stratification_forest(None, y, None, X_not_col=X_not_col,
+                                         n_trees=self.n_trees, min_samples_leaf=self.min_samples_leaf,
+                                         rf_bootstrap=self.rf_bootstrap, max_features=self.max_features,
+                                         supervised=self.supervised, random_state=self.random_state)
+        return self
+
+    def apply(self, X_not_col):
+        return self.rf_.apply(X_not_col)
+
+
+class DecisionTreeStratifier(Stratifier):
+    """
+    A single decision tree whose size is capped with max_leaf_nodes, which sklearn
+    grows best-first. Fewer, bigger leaves fit faster and give more slopes per
+    leaf but stratify less finely.
+    """
+    def __init__(self, max_leaf_nodes=None, min_samples_leaf=15, max_features=None, random_state=None):
+        self.max_leaf_nodes = max_leaf_nodes
+        self.min_samples_leaf = min_samples_leaf
+        self.max_features = max_features
+        self.random_state = random_state
+
+    def fit(self, X_not_col, y):
+        self.tree_ = DecisionTreeRegressor(max_leaf_nodes=self.max_leaf_nodes,
+                                           min_samples_leaf=self.min_samples_leaf,
+                                           max_features=self.max_features,
+                                           random_state=self.random_state)
+        self.tree_.fit(X_not_col, y)
+        return self
+
+    def apply(self, X_not_col):
+        return self.tree_.apply(X_not_col).reshape(-1, 1)
+
+
+class HistGradientBoostingStratifier(Stratifier):
+    """
+    One tree of sklearn's histogram-based gradient boosting, which bins every
+    feature into at most max_bins values before growing the tree. Binning makes
+    finding splits O(bins) rather than O(n log n) per feature, so it's much faster
+    than a regular tree on big data sets. HistGradientBoostingRegressor has no apply()
+    so we walk its tree ourselves, which relies on its internal predictor nodes; see
+    hist_gradient_boosting_tree(). Those aren't public, so fit() also checks the
+    walk against predict() and fails loudly rather than silently stratifying wrong
+    if a scikit-learn release changes them.
+    """
+    def __init__(self, max_leaf_nodes=31, min_samples_leaf=15, max_bins=255, random_state=None):
+        self.max_leaf_nodes = max_leaf_nodes
+        self.min_samples_leaf = min_samples_leaf
+        self.max_bins = max_bins
+        self.random_state = random_state
+
+    def fit(self, X_not_col, y):
+        self.hgb_ = HistGradientBoostingRegressor(max_iter=1, learning_rate=1.0,
+                                                  early_stopping=False,
+                                                  max_leaf_nodes=self.max_leaf_nodes,
+                                                  min_samples_leaf=self.min_samples_leaf,
+                                                  max_bins=self.max_bins,
+                                                  random_state=self.random_state)
+        self.hgb_.fit(X_not_col, y)
+        self._tree = hist_gradient_boosting_tree(self.hgb_)
+        # Every record in a leaf gets that leaf's prediction
+        leaves = traverse(X_not_col, *self._tree)
+        predictions = self.hgb_.predict(X_not_col)
+        order = np.argsort(leaves, kind='stable')
+        starts = np.flatnonzero(np.diff(leaves[order], prepend=-1))
+        spread = np.maximum.reduceat(predictions[order], starts) - \
+                 np.minimum.reduceat(predictions[order], starts)
+        if not np.allclose(spread, 0.0, atol=1e-8 * max(1.0, np.abs(predictions).max())):
+            raise RuntimeError(_HGB_MISMATCH)
+        return self
+
+    def apply(self, X_not_col):
+        return traverse(X_not_col, *self._tree).reshape(-1, 1)
+
+
+class KDTreeStratifier(Stratifier):
+    """
+    A k-d tree that ignores y and needs no training beyond median splits: split
+    a node on the feature with the biggest spread (relative to that feature's
+    overall spread) at its median until the node has fewer than
+    2*min_samples_leaf records. It builds in O(n log n) but, since it doesn't look at y,
+    its leaves group records by proximity in X not colname, not by what matters to y.
+
+    Records with the same value must go the same way, so with many ties the
+    median isn't always a usable split. We split between runs of tied values
+    instead, at the boundary nearest the median that leaves both sides at least
+    min_samples_leaf records, trying features in order of spread; see
+    split_boundary(). Every leaf then has at least min_samples_leaf records.
+    """
+    def __init__(self, min_samples_leaf=15):
+        self.min_samples_leaf = min_samples_leaf
+
+    def fit(self, X_not_col, y=None):
+        X_not_col = np.asarray(X_not_col, dtype=np.float64)
+        scale = np.ptp(X_not_col, axis=0)
+        scale[scale==0] = 1.0
+        feature, threshold, left, right = [], [], [], []
+        stack = [(0, np.arange(len(X_not_col)))]
+        feature.append(-1); threshold.append(np.nan); left.append(-1); right.append(-1)
+        while stack:
+            node, idxs = stack.pop()
+            if len(idxs) < 2 * self.min_samples_leaf:
+                continue
+            X_node = X_not_col[idxs]
+            split = None
+            for j in np.argsort(-np.ptp(X_node, axis=0) / scale, kind='stable'):
+                split = split_boundary(X_node[:, j], self.min_samples_leaf)
+                if split is not None:
+                    break
+            if split is None: # too many ties to split anywhere
+                continue
+            goes_left = X_node[:, j] <= split
+            for child_idxs, children in ((idxs[goes_left], left), (idxs[~goes_left], right)):
+                children[node] = len(feature)
+                stack.append((len(feature), child_idxs))
+                feature.append(-1); threshold.append(np.nan); left.append(-1); right.append(-1)
+            feature[node] = j
+            threshold[node] = split
+        feature = np.array(feature, dtype=np.intp)
+        self._tree = (feature, np.array(threshold), np.array(left, dtype=np.intp),
+                      np.array(right, dtype=np.intp), feature < 0, np.zeros(len(feature), dtype=bool))
+        return self
+
+    def apply(self, X_not_col):
+        return traverse(X_not_col, *self._tree).reshape(-1, 1)
+
+
+def split_boundary(x:np.ndarray, min_samples_leaf:int):
+    """
+    Return the threshold t closest to splitting x in half such that x <= t and x > t
+    both have at least min_samples_leaf values, or None if ties make that impossible.
+    Candidate splits are the boundaries between runs of equal values in sorted x.
+    """
+    x = np.sort(x)
+    n = len(x)
+    nleft = np.flatnonzero(x[1:] != x[:-1]) + 1 # sizes of left side at run boundaries
+    nleft = nleft[(nleft >= min_samples_leaf) & (n - nleft >= min_samples_leaf)]
+    if len(nleft)==0:
+        return None
+    best = nleft[np.argmin(np.abs(2*nleft - n))]
+    return x[best-1]
+
+
+class QuantileGridStratifier(Stratifier):
+    """
+    No training at all: cut each feature of X not colname into n_bins quantile
+    bins and make every occupied cell of the resulting grid a leaf. Cells
+    multiply with the number of features, so this is useful for few features or
+    as a fast baseline. If n_features is not None, use only that many features with
+    the most distinct values.  Leaf ids are consistent within one apply().
+    """
+    def __init__(self, n_bins=4, n_features=None):
+        self.n_bins = n_bins
+        self.n_features = n_features
+
+    def fit(self, X_not_col, y=None):
+        X_not_col = np.asarray(X_not_col)
+        features = np.arange(X_not_col.shape[1])
+        if self.n_features is not None:
+            nuniq = [len(np.unique(X_not_col[:, j])) for j in features]
+            features = np.sort(np.argsort(nuniq, kind='stable')[::-1][:self.n_features])
+        self._features = features
+        qs = np.linspace(0, 1, self.n_bins+1)[1:-1]
+        self._edges = [np.unique(np.quantile(X_not_col[:, j], qs)) for j in features]
+        return self
+
+    def apply(self, X_not_col):
+        X_not_col = np.asarray(X_not_col)
+        codes = np.column_stack([np.searchsorted(edges, X_not_col[:, j], side='left')
+                                 for j, edges in zip(self._features, self._edges)]) \
+            if len(self._features)>0 else np.zeros(shape=(len(X_not_col), 1), dtype=np.intp)
+        _, leaf_ids = np.unique(codes, axis=0, return_inverse=True)
+        return leaf_ids.reshape(-1, 1)
+
+
+# The predictor node fields hist_gradient_boosting_tree() needs; checked with scikit-learn 1.2
+HGB_NODE_FIELDS = ('feature_idx', 'num_threshold', 'left', 'right', 'is_leaf', 'missing_go_to_left')
+
+_HGB_MISMATCH = (f"HistGradientBoostingStratifier can't read the tree of a "
+                 f"HistGradientBoostingRegressor from scikit-learn {sklearn.__version__}; it "
+                 f"relies on internals checked with scikit-learn 1.2. Use DecisionTreeStratifier "
+                 f"or another scikit-learn version")
+
+
+def hist_gradient_boosting_tree(hgb) -> tuple:
+    """
+    Return the per-node arrays traverse() needs for the first tree of fitted
+    HistGradientBoostingRegressor hgb. scikit-learn keeps them in the private
+    hgb._predictors[0][0].nodes structured array; raise a RuntimeError saying so
+    if it's not there or lacks a field we need.
+    """
+    try:
+        nodes = hgb._predictors[0][0].nodes
+        fields = nodes.dtype.names or ()
+    except (AttributeError, IndexError, TypeError) as e:
+        raise RuntimeError(_HGB_MISMATCH) from e
+    if any(field not in fields for field in HGB_NODE_FIELDS):
+        raise RuntimeError(_HGB_MISMATCH)
+    return (nodes['feature_idx'].astype(np.intp), nodes['num_threshold'],
+            nodes['left'].astype(np.intp), nodes['right'].astype(np.intp),
+            nodes['is_leaf'].astype(bool), nodes['missing_go_to_left'].astype(bool))
+
+
+def traverse(X, feature, threshold, left, right, is_leaf, missing_go_to_left) -> np.ndarray:
+    """
+    Return the leaf node id of each row of X in a binary tree described by per-node
+    arrays: go left if X[i, feature] <= threshold (or x is NaN and missing_go_to_left).
+    We move all rows down one level at a time so it's vectorized over rows.
+    """
+    X = np.asarray(X)
+    node = np.zeros(shape=len(X), dtype=np.intp)
+    active = np.flatnonzero(~is_leaf[node])
+    while len(active) > 0:
+        n = node[active]
+        x = X[active, feature[n]]
+        go_left = (x <= threshold[n]) | (np.isnan(x) & missing_go_to_left[n])
+        node[active] = np.where(go_left, left[n], right[n])
+        active = active[~is_leaf[node[active]]]
+    return node
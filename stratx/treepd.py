@@ -0,0 +1,169 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import numpy as np
+import pandas as pd
+from numba import jit
+from sklearn.base import is_regressor
+from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
+
+"""
+Partial dependence and ICE straight from the arrays of fitted sklearn regression
+trees, rather than calling predict() on len(X) rows for every grid value.
+
+Setting X[colname]=v for all rows only changes which way rows go at splits on
+colname. So we walk each tree once, sending each row of X down the only branch
+its other features allow but sending all rows down both branches at splits
+on colname, narrowing the interval (lo,hi] of v that reaches that branch. Each
+leaf then knows which rows reach it and for which grid values, which gives
+exactly what predict() would average, without predicting at n*numx rows.
+"""
+
+
+def tree_regressors(model):
+    """
+    Return the fitted sklearn Tree objects whose average is model's prediction, if
+    model is a single-output regression tree or a random forest / extra trees
+    regressor; else return None.
+    """
+    if not is_regressor(model):
+        return None
+    if hasattr(model, 'tree_'):
+        trees = [model.tree_]
+    elif isinstance(model, (RandomForestRegressor, ExtraTreesRegressor)) and hasattr(model, 'estimators_'):
+        trees = [e.tree_ for e in model.estimators_]
+    else:
+        return None
+    if trees[0].n_outputs!=1:
+        return None
+    return trees
+
+
+def tree_partial_dependence(model, X:pd.DataFrame, colname:str, values) -> np.ndarray:
+    """
+    Return the average prediction of model over all rows of X with X[colname] set
+    to each of values, same as predict_at_values(model, X, colname, values).mean(axis=1)
+    but computed by walking the trees; see tree_regressors() for which models work.
+    X must have the columns the model was trained on, in the same order.
+    """
+    pdpy, _ = _tree_predict(model, X, colname, values, ice=False)
+    return pdpy
+
+
+def tree_ice(model, X:pd.DataFrame, colname:str, values) -> np.ndarray:
+    """
+    Return a (len(values), len(X)) matrix of ICE predictions, same as
+    predict_at_values(model, X, colname, values), computed by walking the trees.
+    """
+    _, ice = _tree_predict(model, X, colname, values, ice=True)
+    return ice
+
+
+def _tree_predict(model, X, colname, values, ice):
+    trees = tree_regressors(model)
+    if trees is None:
+        raise ValueError(f"Can't walk the trees of {type(model).__name__}; "
+                         "need a single-output sklearn tree or forest regressor")
+    j = list(X.columns).index(colname)
+    X_ = np.asarray(X.values, dtype=np.float32) # sklearn compares float32 features to thresholds
+    values = np.asarray(values)
+    grid = values.astype(np.float32).astype(np.float64)
+    order = np.argsort(grid, kind='stable')
+    sorted_grid = grid[order]
+    n = len(X_)
+    pd_sums = np.zeros(len(grid))
+    ice_sums = np.zeros((n, len(grid)) if ice else (0, 0))
+    for tree in trees:
+        tree_predict_jit(tree.children_left, tree.children_right, tree.feature, tree.threshold,
+                         tree.value[:, 0, 0], X_, j, sorted_grid, pd_sums, ice_sums)
+    # put back in caller's order of values
+    pdpy = np.empty(len(grid))
+    pdpy[order] = pd_sums / (max(n, 1) * len(trees))
+    if not ice:
+        return pdpy, None
+    ice_preds = np.empty((len(grid), n))
+    ice_preds[order] = ice_sums.T / len(trees)
+    return pdpy, ice_preds
+
+
+@jit(nopython=True, cache=True)
+def tree_predict_jit(children_left, children_right, feature, threshold, leaf_value,
+                     X, j, grid, pd_sums, ice_sums):
+    """
+    Add one tree's predictions for all rows of X with X[:,j] set to each of the sorted
+    grid values: pd_sums[g] gets the sum over rows and, if ice_sums has rows,
+    ice_sums[i,g] gets row i's prediction. Like sklearn, rows go left when
+    x <= threshold so a branch below splits on j is reached by grid values in (lo,hi].
+    """
+    n = X.shape[0]
+    ngrid = grid.shape[0]
+    do_ice = ice_sums.shape[0] > 0
+    diff = np.zeros(ngrid + 1) # pd_sums contributions as difference array
+    nodes = [0]
+    los = [-np.inf]
+    his = [np.inf]
+    rows_stack = [np.arange(n)]
+    while len(nodes) > 0:
+        node = nodes.pop()
+        lo = los.pop()
+        hi = his.pop()
+        rows = rows_stack.pop()
+        start = np.searchsorted(grid, lo, side='right') # first grid value > lo
+        stop = np.searchsorted(grid, hi, side='right')  # first grid value > hi
+        if len(rows)==0 or start>=stop:
+            continue # no rows or no grid values get here
+        left = children_left[node]
+        right = children_right[node]
+        if left==-1: # leaf
+            v = leaf_value[node]
+            diff[start] += v * len(rows)
+            diff[stop] -= v * len(rows)
+            if do_ice:
+                for r in rows:
+                    for g in range(start, stop):
+                        ice_sums[r, g] += v
+            continue
+        f = feature[node]
+        t = threshold[node]
+        if f==j: # all rows go both ways, but for different grid values
+            nodes.append(left)
+            los.append(lo)
+            his.append(min(hi, t))
+            rows_stack.append(rows)
+            nodes.append(right)
+            los.append(max(lo, t))
+            his.append(hi)
+            rows_stack.append(rows)
+        else:
+            goes_left = X[rows, f] <= t
+            nodes.append(left)
+            los.append(lo)
+            his.append(hi)
+            rows_stack.append(rows[goes_left])
+            nodes.append(right)
+            los.append(lo)
+            his.append(hi)
+            rows_stack.append(rows[~goes_left])
+    pd_sums += np.cumsum(diff)[:ngrid]
@@ -18,7 +18,7 @@ def speed_ModelID():
         stratify_cats(X,y,colname="ModelID",min_samples_leaf=min_samples_leaf)
 
     start = timer()
-    avg_values_at_cat(leaf_deltas, leaf_counts, max_iter=10)
+    avg_values_at_cat(leaf_deltas, leaf_counts)
     stop = timer()
 
     nunique = len(np.unique(X['ModelID']))
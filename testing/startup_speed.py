@@ -0,0 +1,91 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+"""
+How long does a short-lived job wait before stratx gets going? Each run below is a
+fresh interpreter that imports stratx, computes one numerical and one categorical
+partial dependence, and reports the time for the import, the first calls (which
+pay for numba compilation unless the jit cache has them), and the same calls
+again. The first run starts with an empty jit cache, then the rest load the
+compiled kernels from it. We also check that computing never loads matplotlib.
+"""
+
+import glob
+import json
+import os
+import subprocess
+import sys
+
+import stratx
+
+STRATX_DIR = os.path.dirname(stratx.__file__)
+
+JOB = """
+import sys, json
+from timeit import default_timer as timer
+start = timer()
+import stratx.featimp
+from stratx.partdep import partial_dependence, cat_partial_dependence
+import_time = timer() - start
+
+import numpy as np
+import pandas as pd
+np.random.seed(1)
+n = 2000
+X = pd.DataFrame({'x1': np.random.uniform(0, 10, size=n).round(1),
+                  'x2': np.random.uniform(0, 10, size=n).round(1),
+                  'state': np.random.randint(0, 50, size=n)})
+y = X['x1']**2 + X['x2'] + 2*X['state']
+
+def compute():
+    start = timer()
+    partial_dependence(X, y, 'x1', random_state=1)
+    cat_partial_dependence(X, y, 'state', random_state=1)
+    return timer() - start
+
+first_call = compute()
+second_call = compute()
+print(json.dumps({'import': import_time, 'first call': first_call, 'second call': second_call,
+                  'matplotlib loaded': 'matplotlib' in sys.modules}))
+"""
+
+
+def clear_jit_cache():
+    for filename in glob.glob(os.path.join(STRATX_DIR, '__pycache__', '*.nb[ic]')):
+        os.remove(filename)
+
+
+def startup(n_runs=3):
+    clear_jit_cache()
+    print(f"{'run':10s} {'import':>8s} {'1st call':>9s} {'2nd call':>9s}  matplotlib loaded")
+    for i in range(n_runs):
+        result = subprocess.run([sys.executable, '-c', JOB], capture_output=True, text=True, check=True)
+        t = json.loads(result.stdout.strip().splitlines()[-1])
+        label = 'cold jit' if i==0 else 'cached jit'
+        print(f"{label:10s} {t['import']:7.2f}s {t['first call']:8.2f}s {t['second call']:8.2f}s  {t['matplotlib loaded']}")
+
+
+if __name__ == '__main__':
+    startup()
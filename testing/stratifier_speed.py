@@ -0,0 +1,99 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+
+from stratx.partdep import *
+from stratx.stratifiers import *
+
+
+def synthetic_poly_data(n, p=4):
+    "y = x1 + ... + xp + 100 so every partial dependence is a line of slope 1"
+    X = pd.DataFrame({f'x{i+1}': np.random.uniform(0, 10, size=n).round(2) for i in range(p)})
+    return X, X.sum(axis=1) + 100
+
+
+def toy_weight_data(n):
+    "Codependent height and sex; weight rises 10 per inch of height, 40 if pregnant"
+    sex = np.random.randint(0, 2, size=n)
+    pregnant = np.where(sex==1, np.random.randint(0, 2, size=n), 0)
+    height = np.where(sex==1, 65 + np.random.uniform(-4.5, 5, size=n),
+                              68 + np.random.uniform(-7, 8, size=n)).round(1)
+    education = np.where(sex==1, 12, 10) + np.random.randint(0, 8, size=n)
+    X = pd.DataFrame({'sex':sex, 'pregnant':pregnant, 'height':height, 'education':education})
+    y = 120 + (height - height.min()) * 10 + pregnant * 40 - education * 1.5
+    return X, pd.Series(y)
+
+
+def toy_state_data(n, p=50):
+    "Categorical state with effect 2*state plus seasonal ramp in dayofyear"
+    X = pd.DataFrame({'dayofyear': np.random.randint(1, 366, size=n),
+                      'state': np.random.randint(0, p, size=n)})
+    return X, pd.Series(.1 * X['dayofyear'] + 2 * X['state'] + np.random.normal(0, 1, size=n))
+
+
+def stratifiers(min_samples_leaf):
+    return [('default forest', None),
+            ('ForestStratifier 5 trees', ForestStratifier(n_trees=5, min_samples_leaf=min_samples_leaf, rf_bootstrap=True)),
+            ('DecisionTree 64 leaves', DecisionTreeStratifier(max_leaf_nodes=64, min_samples_leaf=min_samples_leaf)),
+            ('HistGradientBoosting', HistGradientBoostingStratifier(max_leaf_nodes=64, min_samples_leaf=min_samples_leaf)),
+            ('KDTree', KDTreeStratifier(min_samples_leaf=min_samples_leaf)),
+            ('QuantileGrid 8 bins', QuantileGridStratifier(n_bins=8))]
+
+
+def speed_vs_quality(name, X, y, colname, true_pd, catcol=False, min_samples_leaf=15):
+    print(f"{name} n={len(X):,}, {colname}:")
+    print(f"    {'stratifier':28s} {'time':>8s} {'leaves':>7s} {'RMSE':>8s}")
+    for label, stratifier in stratifiers(min_samples_leaf):
+        start = timer()
+        leaf_offsets, leaf_sample_idxs = \
+            stratify(X, y, colname, min_samples_leaf=min_samples_leaf, stratifier=stratifier)
+        stop = timer()
+        if catcol:
+            leaf_deltas, leaf_counts, pdpy, count_per_cat, ignored = \
+                cat_partial_dependence(X, y, colname, min_samples_leaf=min_samples_leaf,
+                                       stratifier=stratifier)
+            pdpx = np.arange(len(pdpy))
+            pdpy = pdpy - np.nanmin(pdpy)
+        else:
+            leaf_xranges, leaf_slopes, slope_counts_at_x, dx, slope_at_x, pdpx, pdpy, ignored = \
+                partial_dependence(X, y, colname, min_samples_leaf=min_samples_leaf,
+                                   stratifier=stratifier)
+        rmse = np.sqrt(np.nanmean((pdpy - (true_pd(pdpx) - true_pd(pdpx[0])))**2))
+        print(f"    {label:28s} {stop-start:7.3f}s {len(leaf_offsets)-1:7d} {rmse:8.3f}")
+
+
+if __name__ == '__main__':
+    np.random.seed(1)
+    n = 100_000
+    X, y = synthetic_poly_data(n)
+    speed_vs_quality("poly", X, y, 'x1', lambda x: x)
+    X, y = toy_weight_data(n)
+    speed_vs_quality("weight", X, y, 'height', lambda x: 10 * x)
+    X, y = toy_state_data(n)
+    speed_vs_quality("state", X, y, 'state', lambda x: 2 * x, catcol=True, min_samples_leaf=5)
@@ -0,0 +1,54 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import numpy as np
+import pandas as pd
+
+
+def synthetic_xy(n=500, seed=1, decimals=None, ncats=5, noise=0.0, target=None):
+    """
+    Return X, y for the tests: numerical x1, x2 uniform in [0,10) and categorical
+    x3 with codes 0..ncats-1 (no x3 if ncats is 0). Round x1 to decimals to get
+    repeated x values. y is x1**2 + x2 + 3*x3 unless target, a function of X,
+    says otherwise, plus normal(0, noise) noise. Columns are drawn in order so
+    the same arguments always give the same data.
+    """
+    np.random.seed(seed)
+    X = pd.DataFrame()
+    X['x1'] = np.random.uniform(0, 10, size=n)
+    if decimals is not None:
+        X['x1'] = X['x1'].round(decimals)
+    X['x2'] = np.random.uniform(0, 10, size=n)
+    if ncats > 0:
+        X['x3'] = np.random.randint(0, ncats, size=n)
+    if target is not None:
+        y = target(X)
+    else:
+        y = X['x1']**2 + X['x2']
+        if ncats > 0:
+            y += 3*X['x3']
+    if noise > 0:
+        y = y + np.random.normal(0, noise, size=n)
+    return X, y.rename('y')
@@ -0,0 +1,86 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+from collections import defaultdict
+
+import numpy as np
+
+from stratx.partdep import avg_pd_curve
+
+
+def dict_avg_pd_curve(all_pdpx, all_pdpy):
+    "The way plot_stratpd used to average trial curves"
+    m = defaultdict(float)
+    c = defaultdict(int)
+    for px, py in zip(all_pdpx, all_pdpy):
+        for x, y in zip(px, py):
+            m[x] += y
+            c[x] += 1
+    pdpx = np.array(sorted(m.keys()))
+    return pdpx, np.array([m[x]/c[x] for x in pdpx]), np.array([c[x] for x in pdpx])
+
+
+def random_curves(n_trials=10, seed=1):
+    np.random.seed(seed)
+    all_pdpx, all_pdpy = [], []
+    for i in range(n_trials):
+        # curves sample different subsets of x
+        pdpx = np.unique(np.random.randint(0, 50, size=30)).astype(float)
+        all_pdpx.append(pdpx)
+        all_pdpy.append(pdpx**2 + np.random.normal(0, 5, size=len(pdpx)))
+    return all_pdpx, all_pdpy
+
+
+def test_same_as_dict_average():
+    all_pdpx, all_pdpy = random_curves()
+    curve = avg_pd_curve(all_pdpx, all_pdpy)
+    pdpx, pdpy, counts = dict_avg_pd_curve(all_pdpx, all_pdpy)
+    np.testing.assert_array_equal(curve['pdpx'].values, pdpx)
+    np.testing.assert_allclose(curve['pdpy'].values, pdpy)
+    np.testing.assert_array_equal(curve['count'].values, counts)
+
+
+def test_spread_per_x():
+    all_pdpx, all_pdpy = random_curves()
+    quantiles = (0, .1, .5, .9, 1)
+    curve = avg_pd_curve(all_pdpx, all_pdpy, quantiles=quantiles)
+    x = np.concatenate(all_pdpx)
+    y = np.concatenate(all_pdpy)
+    for i, px in enumerate(curve['pdpx']):
+        ys = y[x==px]
+        assert np.isclose(curve['std'].iloc[i], np.std(ys))
+        for q in quantiles:
+            assert np.isclose(curve[f'q{q}'].iloc[i], np.quantile(ys, q))
+
+
+def test_curves_with_no_overlap():
+    curve = avg_pd_curve([np.array([3., 1.]), np.array([2.])],
+                         [np.array([30., 10.]), np.array([20.])],
+                         quantiles=())
+    np.testing.assert_array_equal(curve['pdpx'].values, [1, 2, 3])
+    np.testing.assert_array_equal(curve['pdpy'].values, [10, 20, 30])
+    np.testing.assert_array_equal(curve['count'].values, [1, 1, 1])
+    np.testing.assert_array_equal(curve['std'].values, [0, 0, 0])
+    assert list(curve.columns)==['pdpx', 'pdpy', 'count', 'std']
@@ -0,0 +1,124 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import numpy as np
+from numpy import nan
+from numba import jit
+
+from stratx.partdep import *
+
+
+# Reference implementation: the original dense (len(uniq_x), nslopes) matrix version
+@jit(nopython=True)
+def dense_avg_slopes_at_x_jit(uniq_x, leaf_ranges, leaf_slopes):
+    nx = len(uniq_x)
+    nslopes = len(leaf_slopes)
+    slopes = np.zeros(shape=(nx, nslopes))
+    for i in range(nslopes):
+        xr, slope = leaf_ranges[i], leaf_slopes[i]
+        # Compute slope all the way across uniq_x but then trim line so
+        # slope is only valid in range xr; don't set slope on right edge
+        slopes[:, i] = np.where( (uniq_x < xr[0]) | (uniq_x >= xr[1]), np.nan, slope)
+    avg_value_at_x = np.zeros(shape=nx)
+    slope_counts_at_x = np.zeros(shape=nx)
+    for i in range(nx):
+        row = slopes[i, :]
+        n_nan = np.sum(np.isnan(row))
+        avg_value_at_x[i] = np.nan if n_nan==nslopes else np.nanmean(row)
+        slope_counts_at_x[i] = nslopes - n_nan
+    return avg_value_at_x, slope_counts_at_x
+
+
+def check(uniq_x, leaf_ranges, leaf_slopes):
+    expected_slope_at_x, expected_counts = \
+        dense_avg_slopes_at_x_jit(uniq_x, leaf_ranges, leaf_slopes)
+    for f in [avg_slopes_at_x_jit, avg_slopes_at_x_nonparallel_jit]:
+        slope_at_x, slope_counts_at_x = f(uniq_x, leaf_ranges, leaf_slopes)
+        np.testing.assert_array_equal(slope_counts_at_x, expected_counts)
+        np.testing.assert_allclose(slope_at_x, expected_slope_at_x, rtol=1e-12, atol=1e-12)
+
+
+def random_ranges(uniq_x, nslopes, max_width=5, scale=1.0):
+    starts = np.random.randint(0, len(uniq_x) - 1, size=nslopes)
+    widths = np.random.randint(1, max_width + 1, size=nslopes)
+    stops = np.minimum(starts + widths, len(uniq_x) - 1)
+    leaf_ranges = np.column_stack([uniq_x[starts], uniq_x[stops]])
+    leaf_slopes = np.random.normal(0, scale, size=nslopes)
+    return leaf_ranges, leaf_slopes
+
+
+def test_one_range():
+    uniq_x = np.array([1, 2, 3])
+    check(uniq_x, np.array([[1, 3]]), np.array([2.0]))
+
+
+def test_last_x_has_no_slope():
+    uniq_x = np.array([1., 2., 3.])
+    slope_at_x, slope_counts_at_x = \
+        avg_slopes_at_x_jit(uniq_x, np.array([[1., 2.], [2., 3.]]), np.array([1., 3.]))
+    np.testing.assert_array_equal(slope_at_x, [1, 3, nan])
+    np.testing.assert_array_equal(slope_counts_at_x, [1, 1, 0])
+
+
+def test_no_slopes():
+    uniq_x = np.array([1., 2., 3.])
+    check(uniq_x, np.array([]).reshape(0, 0), np.array([]))
+
+
+def test_gap_between_ranges():
+    uniq_x = np.array([1., 2., 3., 10., 11.])
+    check(uniq_x, np.array([[1., 3.], [10., 11.]]), np.array([1., -1.]))
+
+
+def test_ranges_not_on_uniq_x():
+    uniq_x = np.array([1., 2., 3., 4., 5.])
+    check(uniq_x, np.array([[1.5, 3.5], [0., 9.], [2., 2.5]]), np.array([1., 2., 3.]))
+
+
+def test_nan_slope_is_ignored():
+    uniq_x = np.array([1., 2., 3.])
+    check(uniq_x, np.array([[1., 3.], [1., 2.]]), np.array([nan, 5.]))
+
+
+def test_random_int_x():
+    np.random.seed(1)
+    uniq_x = np.arange(0, 200)
+    leaf_ranges, leaf_slopes = random_ranges(uniq_x, 1000)
+    check(uniq_x, leaf_ranges, leaf_slopes)
+
+
+def test_random_float_x_wide_ranges():
+    np.random.seed(2)
+    uniq_x = np.unique(np.random.random(size=500).round(decimals=10))
+    leaf_ranges, leaf_slopes = random_ranges(uniq_x, 2000, max_width=100)
+    check(uniq_x, leaf_ranges, leaf_slopes)
+
+
+def test_slopes_of_very_different_magnitudes():
+    np.random.seed(3)
+    uniq_x = np.arange(0, 100, dtype=float)
+    leaf_ranges, leaf_slopes = random_ranges(uniq_x, 500, max_width=20)
+    leaf_slopes[::7] *= 1e9
+    check(uniq_x, leaf_ranges, leaf_slopes)
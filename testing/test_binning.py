@@ -0,0 +1,88 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import numpy as np
+import pandas as pd
+
+from stratx.partdep import *
+from stratx.featimp import importances, importances_pvalues
+import stratx.partdep
+from synthetic_data import synthetic_xy
+
+
+def test_quantile_bins():
+    x = np.random.uniform(0, 10, size=1000)
+    binned = quantile_bins(x, 10)
+    assert len(np.unique(binned)) == 10
+    # bins are contiguous x ranges and centers are the mean x of each bin
+    for c in np.unique(binned):
+        assert np.isclose(c, x[binned == c].mean())
+    order = np.argsort(x)
+    assert np.all(np.diff(binned[order]) >= 0)
+
+
+def test_quantile_bins_with_few_unique_x_unchanged():
+    x = np.array([1, 1, 2, 5, 5, 5, 9], dtype=float)
+    np.testing.assert_array_equal(quantile_bins(x, 4), x)
+    binned = quantile_bins(np.repeat(x, 10), 2)  # ties collapse duplicate quantiles
+    assert len(np.unique(binned)) <= 2
+
+
+def test_binned_partial_dependence():
+    X, y = synthetic_xy(n=3000, ncats=0)
+    leaf_xranges, leaf_slopes, slope_counts_at_x, dx, slope_at_x, pdpx, pdpy, ignored = \
+        partial_dependence(X, y, 'x1', n_bins=30, random_state=1)
+    assert len(pdpx) <= 30
+    assert len(slope_counts_at_x) <= 30
+    # still close to x1^2 with curve starting at 0
+    np.testing.assert_allclose(pdpy, pdpx**2 - pdpx[0]**2, atol=2)
+
+
+def test_binning_with_enough_bins_changes_nothing():
+    X, y = synthetic_xy(n=500, ncats=0)
+    X['x1'] = X['x1'].round(0)
+    expected = partial_dependence(X, y, 'x1', random_state=1)
+    result = partial_dependence(X, y, 'x1', n_bins=100, random_state=1)
+    np.testing.assert_array_equal(expected[5], result[5])
+    np.testing.assert_array_equal(expected[6], result[6])
+
+
+def test_binned_pvalues_use_bins(monkeypatch):
+    X, y = synthetic_xy(n=3000, ncats=0)
+    grids = []
+    def recording_batch(X_col, Y, *args, **kwargs):
+        grids.append(np.unique(X_col))
+        return partial_dependence_batch(X_col, Y, *args, **kwargs)
+    monkeypatch.setattr(stratx.partdep, 'partial_dependence_batch', recording_batch)
+    impact_pvalues, importance_pvalues = \
+        importances_pvalues(X, y, n_bins=10, n_trials=20, random_state=1)
+    assert all(len(grid) <= 10 for grid in grids) # real and shuffled y on the same bins
+    assert importance_pvalues[0] < 0.05
+
+
+def test_binned_importances():
+    X, y = synthetic_xy(n=3000, ncats=0)
+    I = importances(X, y, n_bins=20, random_state=1)
+    assert I.index[0] == 'x1'
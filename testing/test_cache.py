@@ -0,0 +1,187 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import os
+import pytest
+import numpy as np
+import pandas as pd
+
+from stratx.partdep import *
+from stratx.cache import StratificationCache, ResultCache, fingerprint
+from stratx.featimp import importances
+from synthetic_data import synthetic_xy
+
+
+def test_fingerprint_sensitive_to_data_and_colname():
+    X, y = synthetic_xy()
+    assert fingerprint(X, y, 'x1') == fingerprint(X.copy(), y.copy(), 'x1')
+    assert fingerprint(X, y, 'x1') != fingerprint(X, y, 'x2')
+    X2 = X.copy()
+    X2.iloc[3, 0] += 1e-9
+    assert fingerprint(X, y, 'x1') != fingerprint(X2, y, 'x1')
+
+
+def test_lru_eviction():
+    cache = StratificationCache(maxsize=2)
+    a = np.array([0, 2]), np.array([1, 0])
+    cache.put('a', *a)
+    cache.put('b', *a)
+    cache.get('a')      # a is now most recently used
+    cache.put('c', *a)  # so b gets evicted
+    assert len(cache)==2
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.hits==1 and cache.misses==1
+
+
+def test_key_hashes_data_once(monkeypatch):
+    import stratx.cache
+    X, y = synthetic_xy()
+    data_hashes = []
+    def counting_fingerprint(*data):
+        data_hashes.extend(d for d in data if isinstance(d, pd.DataFrame))
+        return fingerprint(*data)
+    monkeypatch.setattr(stratx.cache, 'fingerprint', counting_fingerprint)
+    cache = StratificationCache()
+    keys = [cache.key(X, y, colname, random_state=1) for colname in X.columns]
+    assert len(set(keys))==3
+    assert len(data_hashes)==1
+    assert cache.key(X.copy(), y, 'x1', random_state=1)==keys[0] # same data, new object
+    assert len(data_hashes)==2
+    X2 = X.copy()
+    X2.iloc[0, 0] += 1
+    assert cache.key(X2, y, 'x1', random_state=1)!=keys[0]
+
+
+def test_disk_round_trip(tmp_path):
+    leaf_offsets = np.array([0, 3, 5])
+    leaf_sample_idxs = np.array([4, 0, 2, 1, 3])
+    StratificationCache(cache_dir=tmp_path).put('k', leaf_offsets, leaf_sample_idxs)
+    cache = StratificationCache(cache_dir=tmp_path) # e.g., another process
+    assert 'k' in cache
+    offsets, idxs = cache.get('k')
+    np.testing.assert_array_equal(offsets, leaf_offsets)
+    np.testing.assert_array_equal(idxs, leaf_sample_idxs)
+    assert cache.hits==1
+
+
+def test_partial_dependence_reuses_stratification():
+    X, y = synthetic_xy()
+    cache = StratificationCache()
+    results1 = partial_dependence(X, y, 'x1', random_state=1, stratcache=cache)
+    results2 = partial_dependence(X, y, 'x1', random_state=1, stratcache=cache)
+    assert cache.misses==1 and cache.hits==1
+    results = partial_dependence(X, y, 'x1', random_state=1)
+    for r1, r2, r in zip(results1, results2, results):
+        np.testing.assert_array_equal(r1, r2)
+        np.testing.assert_array_equal(r1, r)
+
+    partial_dependence(X, y, 'x1', random_state=1, min_samples_leaf=5, stratcache=cache)
+    assert cache.misses==2 # different hyper parameters means a new forest
+
+
+def test_cat_partial_dependence_reuses_stratification():
+    X, y = synthetic_xy()
+    cache = StratificationCache()
+    _, _, avg_per_cat1, count_per_cat1, _ = \
+        cat_partial_dependence(X, y, 'x3', random_state=1, stratcache=cache)
+    _, _, avg_per_cat2, count_per_cat2, _ = \
+        cat_partial_dependence(X, y, 'x3', random_state=1, stratcache=cache)
+    assert cache.misses==1 and cache.hits==1
+    np.testing.assert_array_equal(avg_per_cat1, avg_per_cat2)
+    np.testing.assert_array_equal(count_per_cat1, count_per_cat2)
+
+
+def test_result_cache_round_trip(tmp_path):
+    X, y = synthetic_xy()
+    leaf_deltas, leaf_counts, avg_per_cat, count_per_cat, ignored = \
+        cat_partial_dependence(X, y, 'x3', random_state=1)
+    I = pd.DataFrame({'Importance': [.7, .3], 'Impact': [2.0, 1.0]},
+                     index=pd.Index(['x1', 'x2'], name='Feature'))
+    values = [leaf_deltas, leaf_counts, avg_per_cat, count_per_cat, ignored, I]
+    ResultCache(tmp_path).put('k', values)
+    cache = ResultCache(tmp_path) # e.g., another run
+    leaf_deltas2, leaf_counts2, avg_per_cat2, count_per_cat2, ignored2, I2 = cache.get('k')
+    assert (leaf_deltas2 != leaf_deltas).nnz==0 and leaf_deltas2.nnz==leaf_deltas.nnz
+    assert (leaf_counts2 != leaf_counts).nnz==0
+    np.testing.assert_array_equal(avg_per_cat2, avg_per_cat)
+    np.testing.assert_array_equal(count_per_cat2, count_per_cat)
+    assert ignored2==ignored
+    pd.testing.assert_frame_equal(I2, I)
+    assert cache.get('missing') is None
+    assert cache.hits==1 and cache.misses==1
+
+
+def test_result_cache_size_cap_evicts_lru(tmp_path):
+    cache = ResultCache(tmp_path, max_bytes=10**9)
+    values = [np.random.RandomState(1).normal(size=1000)] # doesn't compress much
+    for key in ['a', 'b', 'c']:
+        cache.put(key, values)
+    size = os.path.getsize(cache._filename('a'))
+    os.utime(cache._filename('a'), ns=(1, 1))
+    os.utime(cache._filename('b'), ns=(2, 2))
+    os.utime(cache._filename('c'), ns=(3, 3))
+    cache.get('a')   # a is now most recently used
+    cache.max_bytes = 3 * size
+    cache.put('d', values) # so b, the least recently used, gets evicted
+    assert cache.get('b') is None
+    assert all(cache.get(key) is not None for key in ['a', 'c', 'd'])
+
+
+def test_partial_dependence_cache_dir(tmp_path):
+    X, y = synthetic_xy()
+    results1 = partial_dependence(X, y, 'x1', random_state=1, cache_dir=tmp_path)
+    assert len(os.listdir(tmp_path))==1
+    results2 = partial_dependence(X, y, 'x1', random_state=1, cache_dir=tmp_path, verbose=True)
+    assert len(os.listdir(tmp_path))==1 # verbose doesn't change the results
+    for r1, r2 in zip(results1, results2):
+        np.testing.assert_array_equal(r1, r2)
+    partial_dependence(X, y, 'x1', random_state=1, min_samples_leaf=5, cache_dir=tmp_path)
+    partial_dependence(X, y, 'x2', random_state=1, cache_dir=tmp_path)
+    assert len(os.listdir(tmp_path))==3
+
+
+def test_importances_cache_dir(tmp_path):
+    X, y = synthetic_xy()
+    I1 = importances(X, y, catcolnames={'x3'}, random_state=1, cache_dir=tmp_path)
+    assert len(os.listdir(tmp_path))==1
+    I2 = importances(X, y, catcolnames={'x3'}, random_state=1, n_jobs=2, cache_dir=tmp_path)
+    assert len(os.listdir(tmp_path))==1
+    pd.testing.assert_frame_equal(I1, I2)
+    I = importances(X, y, catcolnames={'x3'}, random_state=1)
+    pd.testing.assert_frame_equal(I1, I)
+
+
+def test_cache_dir_needs_random_state(tmp_path):
+    X, y = synthetic_xy()
+    with pytest.raises(ValueError, match="random_state"):
+        partial_dependence(X, y, 'x1', cache_dir=tmp_path)
+    with pytest.raises(ValueError, match="random_state"):
+        cat_partial_dependence(X, y, 'x3', cache_dir=tmp_path)
+    with pytest.raises(ValueError, match="random_state"):
+        importances(X, y, catcolnames={'x3'}, cache_dir=tmp_path)
+    with pytest.raises(ValueError, match="random_state"):
+        plot_stratpd(X, y, 'x1', 'y', n_trials=3, cache_dir=tmp_path)
+    assert len(os.listdir(tmp_path))==0
@@ -31,7 +31,8 @@ from sklearn.utils import resample
 
 import shap
 
-from stratx.partdep import leaf_samples, conjure_twoclass, catwise_leaves, avg_values_at_cat
+from stratx.partdep import leaf_samples, leaf_samples_csr, conjure_twoclass, catwise_leaves, avg_values_at_cat, \
+    merge_leaves_jit, nanavg_vectors
 
 import numpy as np
 import pandas as pd
@@ -91,8 +92,9 @@ def stratify_cats(X, y,
     # leaf_deltas, leaf_counts, leaf_avgs, leaf_sizes, leaf_catcounts, ignored = \
     #     catwise_leaves(rf, X, y, colname, verbose=verbose)
 
+    leaf_offsets, leaf_sample_idxs = leaf_samples_csr(rf, X_not_col)
     leaf_deltas, leaf_counts, ignored = \
-        catwise_leaves(rf, X_not_col, X_col, y.values, max_catcode)
+        catwise_leaves(leaf_offsets, leaf_sample_idxs, X_col, y.values, max_catcode)
     print("leaf_deltas\n",leaf_deltas)
     print("leaf_counts\n",leaf_counts)
 
@@ -369,4 +371,53 @@ def test_temperature():
 
 
 def set_random_seed(s):
-    np.random.seed(s)
\ No newline at end of file
+    np.random.seed(s)
+
+def merge_leaves_by_candidates(leaf_deltas, leaf_counts, leaves):
+    """
+    The original merge on dense leaf_deltas (nan where a leaf lacks a cat): average
+    the candidates v - v[i] + catavg[i] over the cats i in common, then nanavg_vectors().
+    """
+    catavg = leaf_deltas[:, leaves[0]].copy()
+    catavg_weight = leaf_counts[:, leaves[0]].copy()
+    for j in leaves[1:]:
+        v = leaf_deltas[:, j]
+        intersection_idx = np.where(~np.isnan(catavg) & ~np.isnan(v))[0]
+        merge_candidates = np.array([v - v[i] + catavg[i] for i in intersection_idx])
+        # Candidates are nan exactly where v is; average only the other cats
+        adjusted_v = np.full(shape=v.shape, fill_value=np.nan)
+        adjusted_v[~np.isnan(v)] = merge_candidates[:, ~np.isnan(v)].mean(axis=0)
+        catavg = nanavg_vectors(catavg, adjusted_v, catavg_weight, leaf_counts[:, j])
+        catavg_weight = catavg_weight + leaf_counts[:, j]
+    return catavg, catavg_weight
+
+
+def test_merge_leaves_jit_same_as_candidates():
+    np.random.seed(1)
+    ncats, nleaves = 20, 30
+    indptr, cats, deltas, counts = [0], [], [], []
+    prev_cats = np.arange(ncats)
+    for j in range(nleaves):
+        # share a cat with the previous leaf so merging in order always intersects
+        leaf_cats = np.unique(np.append(np.random.choice(ncats, size=np.random.randint(1, 6), replace=False),
+                                        np.random.choice(prev_cats)))
+        leaf_deltas = np.random.uniform(0, 10, size=len(leaf_cats))
+        leaf_deltas[np.random.randint(len(leaf_cats))] = 0.0 # the leaf's reference cat
+        cats.extend(leaf_cats)
+        deltas.extend(leaf_deltas)
+        counts.extend(np.random.randint(1, 10, size=len(leaf_cats)))
+        indptr.append(len(cats))
+        prev_cats = leaf_cats
+    indptr, cats = np.array(indptr, dtype=np.int32), np.array(cats, dtype=np.int32)
+    deltas, counts = np.array(deltas), np.array(counts, dtype=np.int64)
+    dense_deltas = np.full(shape=(ncats, nleaves), fill_value=np.nan)
+    dense_counts = np.zeros(shape=(ncats, nleaves), dtype=np.int64)
+    for j in range(nleaves):
+        dense_deltas[cats[indptr[j]:indptr[j+1]], j] = deltas[indptr[j]:indptr[j+1]]
+        dense_counts[cats[indptr[j]:indptr[j+1]], j] = counts[indptr[j]:indptr[j+1]]
+
+    leaves = np.arange(nleaves)
+    expected_avg, expected_weight = merge_leaves_by_candidates(dense_deltas, dense_counts, leaves)
+    catavg, catavg_weight = merge_leaves_jit(leaves, indptr, cats, deltas, counts, ncats)
+    np.testing.assert_allclose(catavg, expected_avg, atol=1e-10)
+    np.testing.assert_array_equal(catavg_weight, expected_weight)
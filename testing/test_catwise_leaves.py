@@ -38,6 +38,7 @@ import matplotlib.pyplot as plt
 
 from numpy import nan
 
+from stratx.partdep import stratify, catwise_leaves, densify_leaves, avg_values_at_cat
 from test_catmerge import stratify_cats, get_leaves
 
 def test_single_leaf():
@@ -187,3 +188,29 @@ def test_three_leaves_no_overlap():
     np.testing.assert_array_almost_equal(leaf_deltas, expected_leaf_deltas, decimal=1)
     np.testing.assert_array_equal(leaf_counts, expected_leaf_counts)
     assert ignored==0
+
+
+def test_sparse_same_as_dense():
+    np.random.seed(1)
+    n = 2000
+    df = pd.DataFrame()
+    df['x1'] = np.random.randint(0, 50, size=n)
+    df['x2'] = np.random.randint(0, 300, size=n)
+    df['y'] = df['x1'] + 3*df['x2'] + np.random.normal(0, 1, size=n)
+    X = df.drop('y', axis=1)
+    y = df['y']
+    leaf_offsets, leaf_sample_idxs = stratify(X, y, 'x2', min_samples_leaf=5, random_state=1)
+    X_col = X['x2'].values
+    dense = catwise_leaves(leaf_offsets, leaf_sample_idxs, X_col, y.values, max_catcode=299)
+    sparse = catwise_leaves(leaf_offsets, leaf_sample_idxs, X_col, y.values, max_catcode=299, sparse=True)
+    assert sparse[0].shape==dense[0].shape
+    # every leaf has a reference category whose 0 delta must be kept
+    assert sparse[0].nnz==sparse[1].nnz==np.sum(dense[1]>0)
+    leaf_deltas, leaf_counts = densify_leaves(sparse[0], sparse[1])
+    np.testing.assert_array_equal(leaf_deltas, dense[0])
+    np.testing.assert_array_equal(leaf_counts, dense[1])
+
+    avg_per_cat, count_per_cat = avg_values_at_cat(dense[0], dense[1])
+    sparse_avg_per_cat, sparse_count_per_cat = avg_values_at_cat(sparse[0], sparse[1])
+    np.testing.assert_array_equal(avg_per_cat, sparse_avg_per_cat)
+    np.testing.assert_array_equal(count_per_cat, sparse_count_per_cat)
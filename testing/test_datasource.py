@@ -0,0 +1,174 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from stratx.partdep import *
+from stratx.featimp import importances
+from stratx.datasource import *
+from stratx.cache import StratificationCache
+from synthetic_data import synthetic_xy
+
+
+def memmap_source(X, tmp_path):
+    filename = str(tmp_path / "X.dat")
+    M = np.memmap(filename, dtype=np.float64, mode='w+', shape=X.shape, order='F')
+    M[:] = X.values
+    M.flush()
+    M = np.memmap(filename, dtype=np.float64, mode='r', shape=X.shape, order='F')
+    return ArraySource(M, columns=X.columns)
+
+
+def test_sources_read_same_columns(tmp_path):
+    X, y = synthetic_xy()
+    save_npy_dir(X, str(tmp_path / "npy"))
+    sources = [as_datasource(X), memmap_source(X, tmp_path),
+               as_datasource(str(tmp_path / "npy"))]
+    for src in sources:
+        assert src.columns == ['x1', 'x2', 'x3']
+        assert src.shape == X.shape
+        np.testing.assert_array_equal(src.column('x2'), X['x2'].values)
+        M = src.not_column('x2')
+        assert M.shape == (len(X), 2) and M.dtype == np.float32 and M.flags.f_contiguous
+        np.testing.assert_array_equal(M, X.drop('x2', axis=1).values.astype(np.float32))
+
+
+def test_npy_dir_columns_are_memory_mapped(tmp_path):
+    X, y = synthetic_xy()
+    save_npy_dir(X, str(tmp_path))
+    src = NpyDirSource(str(tmp_path))
+    assert isinstance(src.column('x1'), np.memmap)
+    assert src.column('x3').dtype == X['x3'].dtype
+
+
+def test_partial_dependence_same_from_source(tmp_path):
+    X, y = synthetic_xy()
+    save_npy_dir(X, str(tmp_path))
+    expected = partial_dependence(X, y, 'x1', random_state=1)
+    for src in [memmap_source(X, tmp_path), NpyDirSource(str(tmp_path))]:
+        result = partial_dependence(src, y, 'x1', random_state=1)
+        for a, b in zip(expected[-3:-1], result[-3:-1]):  # pdpx, pdpy
+            np.testing.assert_array_equal(a, b)
+
+    expected = cat_partial_dependence(X, y, 'x3', random_state=1)
+    result = cat_partial_dependence(NpyDirSource(str(tmp_path)), y, 'x3', random_state=1)
+    np.testing.assert_array_equal(expected[2], result[2])  # avg_per_cat
+
+
+def test_importances_same_from_source(tmp_path):
+    X, y = synthetic_xy()
+    save_npy_dir(X, str(tmp_path))
+    src = NpyDirSource(str(tmp_path))
+    for n_trials in [1, 3]:
+        expected = importances(X, y, catcolnames={'x3'}, n_trials=n_trials, random_state=1)
+        result = importances(src, y, catcolnames={'x3'}, n_trials=n_trials, random_state=1)
+        pd.testing.assert_frame_equal(expected, result)
+
+
+def test_file_source_cache_key_uses_file_stats(tmp_path):
+    X, y = synthetic_xy()
+    save_npy_dir(X, str(tmp_path))
+    stratcache = StratificationCache()
+    stratify(NpyDirSource(str(tmp_path)), y, 'x1', random_state=1, stratcache=stratcache)
+    stratify(NpyDirSource(str(tmp_path)), y, 'x1', random_state=1, stratcache=stratcache)
+    assert stratcache.hits == 1
+
+
+def test_parquet_source(tmp_path):
+    pytest.importorskip('pyarrow')
+    X, y = synthetic_xy()
+    filename = str(tmp_path / "X.parquet")
+    X.to_parquet(filename)
+    src = as_datasource(filename)
+    assert src.columns == list(X.columns)
+    np.testing.assert_array_equal(src.column('x1'), X['x1'].values)
+
+
+def test_parquet_source_keeps_recent_columns(tmp_path):
+    pytest.importorskip('pyarrow')
+    X, y = synthetic_xy()
+    filename = str(tmp_path / "X.parquet")
+    X.to_parquet(filename)
+    src = ParquetSource(filename, maxsize=2)
+    assert src.column('x1') is src.column('x1')  # decoded once
+    x2 = src.column('x2')
+    src.column('x3')  # evicts x1
+    assert src.column('x2') is x2
+    np.testing.assert_array_equal(src.column('x1'), X['x1'].values)
+    src = pickle.loads(pickle.dumps(src))
+    np.testing.assert_array_equal(src.column('x3'), X['x3'].values)
+
+
+def test_feature_matrix_reuses_scratch_in_any_order():
+    X, y = synthetic_xy()
+    X['x4'] = X['x1'] * 2
+    fm = FeatureMatrix(X)
+    for colname in ['x1', 'x2', 'x3', 'x4', 'x2', 'x4', 'x1', 'x3']:
+        M = fm.not_column(colname)
+        assert M.flags.f_contiguous
+        np.testing.assert_array_equal(M, X.drop(colname, axis=1).values.astype(np.float32))
+    assert fm.allocations == 1  # just the scratch buffer
+    assert fm.allocated_bytes == len(X) * 3 * 4
+    np.testing.assert_array_equal(fm.column('x3'), X['x3'].values)  # exact, not float32
+
+
+def test_feature_matrix_importances_allocations():
+    X, y = synthetic_xy()
+    fm = FeatureMatrix(X)
+    I = importances(fm, y, catcolnames={'x3'}, random_state=1)
+    assert fm.allocations == 1
+    pd.testing.assert_frame_equal(I, importances(X, y, catcolnames={'x3'}, random_state=1))
+
+
+def test_feature_matrix_never_copies_out_of_core_X(tmp_path):
+    import tracemalloc
+    n, p = 100_000, 6
+    np.random.seed(1)
+    X = pd.DataFrame({f"x{j}": np.random.uniform(0, 10, size=n) for j in range(p)})
+    save_npy_dir(X, str(tmp_path))
+    src = NpyDirSource(str(tmp_path))
+    tracemalloc.start()
+    try:
+        fm = FeatureMatrix(src)
+        for colname in src.columns + src.columns[::-1]:
+            fm.not_column(colname)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert fm.allocated_bytes == n * (p-1) * 4
+    assert peak < n * p * 4 # not even one float32 copy of X, let alone a float64 one
+
+
+def test_feature_matrix_pickles_without_scratch():
+    import pickle
+    X, y = synthetic_xy()
+    fm = FeatureMatrix(X)
+    fm.not_column('x1')
+    fm2 = pickle.loads(pickle.dumps(fm))
+    np.testing.assert_array_equal(fm2.not_column('x2'), fm.not_column('x2'))
@@ -47,6 +47,7 @@ def check(X, y, colname,
           min_samples_leaf=15):
     leaf_deltas, leaf_counts, avg_per_cat, count_per_cat, ignored = \
         cat_partial_dependence(X, y, colname, min_samples_leaf=min_samples_leaf)
+    leaf_deltas, leaf_counts = densify_leaves(leaf_deltas, leaf_counts)
 
     print(leaf_deltas, avg_per_cat)
 
@@ -76,3 +76,19 @@ def test_center_diff():
     expected_slopes = np.array([0.5, 2.0, 1, 0.6666666667])
     print(np.gradient(y,x))
     check(x, y, expected_xranges, expected_slopes)
+
+
+def test_all_leaves_in_one_pass():
+    # leaf 0 has x=[1,3,3,4], leaf 1 has a single unique x so is ignored, leaf 2 is x=[5,2]
+    x = np.array([3, 1, 4, 3, 7, 7, 5, 2])
+    y = np.array([6, 5, 7, 8, 1, 2, 3, 9])
+    leaf_offsets = np.array([0, 4, 6, 8])
+    leaf_sample_idxs = np.array([0, 1, 2, 3, 4, 5, 6, 7])
+    leaf_xranges, leaf_slopes, ignored = \
+        leaf_finite_differences(leaf_offsets, leaf_sample_idxs, x, y)
+
+    expected_xranges = np.array([[1, 3], [3, 4], [2, 5]])
+    expected_slopes = np.array([1, 0, -2])
+    assert ignored==2
+    np.testing.assert_array_equal(leaf_xranges, expected_xranges)
+    np.testing.assert_allclose(leaf_slopes, expected_slopes)
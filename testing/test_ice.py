@@ -0,0 +1,147 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+from stratx.ice import *
+
+
+class CountingModel:
+    "Wrap a model to count predict() calls and the rows it saw"
+    def __init__(self, model):
+        self.model = model
+        self.calls = 0
+        self.rows = 0
+
+    def predict(self, X):
+        self.calls += 1
+        self.rows += len(X)
+        return self.model.predict(X)
+
+
+def synthetic_model(n=300):
+    np.random.seed(1)
+    X = pd.DataFrame({'x1': np.random.uniform(0, 10, size=n),
+                      'x2': np.random.randint(0, 5, size=n)})
+    y = X['x1']**2 + 3*X['x2']
+    rf = RandomForestRegressor(n_estimators=10, random_state=1).fit(X, y)
+    return X, rf
+
+
+def looped_predictions(model, X, colname, values):
+    X = X.copy()
+    preds = []
+    for v in values:
+        X[colname] = v
+        preds.append(model.predict(X))
+    return np.array(preds)
+
+
+def test_predict_at_values_same_as_loop():
+    X, rf = synthetic_model()
+    values = np.linspace(0, 10, 7)
+    np.testing.assert_allclose(predict_at_values(rf, X, 'x1', values),
+                               looped_predictions(rf, X, 'x1', values))
+
+
+def test_predict_at_values_respects_memory_budget():
+    X, rf = synthetic_model()
+    values = np.linspace(0, 10, 10)
+    model = CountingModel(rf)
+    predict_at_values(model, X, 'x1', values)
+    assert model.calls==1
+    model = CountingModel(rf)
+    preds = predict_at_values(model, X, 'x1', values, max_bytes=3 * X.memory_usage(index=False).sum())
+    assert model.calls==4 and model.rows==len(values) * len(X) # chunks of 3, 3, 3, 1
+    np.testing.assert_allclose(preds, looped_predictions(rf, X, 'x1', values))
+
+
+def test_predict_ice_does_not_mutate_X():
+    X, rf = synthetic_model()
+    before = X.copy()
+    ice = predict_ice(rf, X, 'x1', numx=20)
+    pd.testing.assert_frame_equal(X, before)
+    assert ice.lines.shape==(len(X), 20)
+    np.testing.assert_allclose(ice.lines.T, looped_predictions(rf, X, 'x1', ice.linex), rtol=1e-6)
+
+    pdpx, pdpy = friedman_partial_dependence(rf, X, 'x2', numx=None, mean_centered=False)
+    pd.testing.assert_frame_equal(X, before)
+    np.testing.assert_allclose(pdpy, looped_predictions(rf, X, 'x2', pdpx).mean(axis=1))
+
+
+def test_sampled_ice_in_row_chunks():
+    X, rf = synthetic_model()
+    model = CountingModel(rf)
+    linex_bytes = 10 * (X.memory_usage(index=False).sum() / len(X) + 8)
+    ice = predict_ice(model, X, 'x1', numx=10, nlines=50, random_state=1,
+                      max_bytes=20 * linex_bytes) # about 20 rows per chunk
+    assert ice.lines.dtype==np.float32 and ice.lines.shape==(50, 10)
+    assert len(np.unique(ice.rows))==50
+    assert model.calls==3 and model.rows==50 * 10 # only sampled rows get predicted
+    np.testing.assert_allclose(ice.lines.T, looped_predictions(rf, X.iloc[ice.rows], 'x1', ice.linex),
+                               rtol=1e-6)
+    ice2 = predict_ice(rf, X, 'x1', numx=10, nlines=50, random_state=1)
+    np.testing.assert_array_equal(ice.rows, ice2.rows)
+
+
+def test_ice2lines_is_a_view():
+    X, rf = synthetic_model()
+    ice = predict_ice(rf, X, 'x1', numx=10, nlines=5, random_state=1)
+    lines = ice2lines(ice)
+    assert lines.shape==(5, 10, 2)
+    assert np.shares_memory(lines, ice.lines)
+    np.testing.assert_allclose(lines[:, :, 0], np.tile(ice.linex, (5, 1)), rtol=1e-6)
+    ice.linex = np.arange(10)
+    np.testing.assert_array_equal(lines[0, :, 0], np.arange(10))
+    df = ice.to_frame()
+    assert df.shape==(6, 10)
+    np.testing.assert_array_equal(df.iloc[0], np.arange(10))
+
+
+def test_plots_use_one_collection_per_render_mode():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    X, rf = synthetic_model()
+    ice = predict_ice(rf, X, 'x1', numx=10)
+    catice = predict_catice(rf, X, 'x2')
+    before = ice.points.copy()
+    for render in ['vector', 'raster', 'hist2d']:
+        fig, ax = plt.subplots(1, 1)
+        plot_ice(ice, 'x1', 'y', ax=ax, min_y_shifted_to_zero=True, render=render)
+        assert len(ax.collections)==1 # not one artist per observation
+        fig, ax = plt.subplots(1, 1)
+        plot_catice(catice, 'x2', 'y', catnames={i: str(i) for i in range(5)}, ax=ax, render=render)
+        assert len(ax.collections)==2 # observations and the PDP
+        plt.close('all')
+    np.testing.assert_array_equal(ice.points, before)
+
+
+def test_bin_edges():
+    np.testing.assert_array_equal(bin_edges([1, 2, 3]), [.5, 1.5, 2.5, 3.5])
+    np.testing.assert_array_equal(bin_edges([0, 2, 3]), [-1, 1, 2.5, 3.5])
+    np.testing.assert_array_equal(bin_edges([5]), [4.5, 5.5])
@@ -0,0 +1,110 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csc_matrix
+
+from stratx.partdep import *
+from stratx.incremental import *
+from synthetic_data import synthetic_xy
+
+
+def test_state_same_as_partial_dependence():
+    X, y = synthetic_xy(n=1000, decimals=1, ncats=8, noise=1)
+    for min_samples_leaf in [2, 15]: # small leaves give ignored samples
+        expected = partial_dependence(X, y, 'x1', min_samples_leaf=min_samples_leaf, random_state=1)
+        state = partial_dependence_state(X, y, 'x1', min_samples_leaf=min_samples_leaf, random_state=1)
+        result = state.partial_dependence()
+        np.testing.assert_array_equal(expected[5], result[5])  # pdpx
+        np.testing.assert_allclose(expected[6], result[6], atol=1e-10)  # pdpy
+        assert expected[7] == result[7]  # ignored
+
+
+def test_state_same_as_cat_partial_dependence():
+    X, y = synthetic_xy(n=1000, decimals=1, ncats=8, noise=1)
+    expected = cat_partial_dependence(X, y, 'x3', random_state=1)
+    state = partial_dependence_state(X, y, 'x3', catcol=True, random_state=1)
+    result = state.cat_partial_dependence()
+    np.testing.assert_allclose(expected[2], result[2], atol=1e-10)  # avg_per_cat
+    np.testing.assert_array_equal(expected[3], result[3])  # count_per_cat
+
+
+class ForestLeaves:
+    "A stand-in StratificationCache that returns rf's leaves for X not colname"
+    def __init__(self, rf, X, colname):
+        self.leaves = leaf_samples_csr(rf, X.drop(colname, axis=1).values.astype(np.float32))
+    def key(self, *args, **kwargs):
+        return None
+    def get(self, key):
+        return self.leaves
+
+
+def test_appended_cat_ignored_same_as_recompute():
+    X, y = synthetic_xy(n=1000, decimals=1, ncats=8, noise=1)
+    # tiny leaves so some leaves have a single category
+    state = partial_dependence_state(X.iloc[:600], y.iloc[:600], 'x3', catcol=True,
+                                     min_samples_leaf=2, random_state=1)
+    state.update(X.iloc[600:], y.iloc[600:])
+    expected = cat_partial_dependence(X, y, 'x3', stratcache=ForestLeaves(state.rf, X, 'x3'))
+    result = state.cat_partial_dependence()
+    # The state counts samples in leaves with a single category as ignored
+    leaf_counts = csc_matrix(expected[1])
+    single_cat = np.diff(leaf_counts.indptr)==1
+    expected_ignored = np.asarray(leaf_counts.sum(axis=0)).ravel()[single_cat].sum()
+    assert result[4] > 0
+    assert expected_ignored == result[4]
+    np.testing.assert_allclose(expected[2], result[2], atol=1e-10)  # avg_per_cat
+    np.testing.assert_array_equal(expected[3], result[3])  # count_per_cat
+
+
+def test_incremental_updates_same_as_all_at_once():
+    X, y = synthetic_xy(n=1000, decimals=1, ncats=8, noise=1)
+    for colname, catcol in [('x1', False), ('x3', True)]:
+        state = partial_dependence_state(X.iloc[:600], y.iloc[:600], colname, catcol=catcol, random_state=1)
+        all_at_once = PartialDependenceState(state.rf, colname, catcol=catcol)
+        all_at_once.update(X, y)
+        for start, stop in [(600, 900), (900, 990), (990, 1000)]:
+            state.partial_dependence() if not catcol else state.cat_partial_dependence()
+            state.update(X.iloc[start:stop], y.iloc[start:stop])
+        assert state.n == all_at_once.n == len(X)
+        if catcol:
+            np.testing.assert_allclose(state.cat_partial_dependence()[2],
+                                       all_at_once.cat_partial_dependence()[2], atol=1e-10)
+        else:
+            result, expected = state.partial_dependence(), all_at_once.partial_dependence()
+            np.testing.assert_array_equal(expected[5], result[5])
+            np.testing.assert_allclose(expected[6], result[6], atol=1e-10)
+
+
+def test_save_and_load(tmp_path):
+    X, y = synthetic_xy(n=1000, decimals=1, ncats=8, noise=1)
+    state = partial_dependence_state(X.iloc[:800], y.iloc[:800], 'x1', random_state=1)
+    filename = str(tmp_path / "x1.pdstate")
+    state.save(filename)
+    loaded = PartialDependenceState.load(filename)
+    state.update(X.iloc[800:], y.iloc[800:])
+    loaded.update(X.iloc[800:], y.iloc[800:])
+    np.testing.assert_array_equal(state.partial_dependence()[6], loaded.partial_dependence()[6])
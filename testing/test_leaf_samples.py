@@ -0,0 +1,84 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+from stratx.partdep import *
+
+
+def where_leaf_samples(leaf_ids):
+    "The original O(n * leaves) grouping, one np.where per leaf id"
+    leaves = []
+    for t in range(leaf_ids.shape[1]):
+        uniq_ids = np.unique(leaf_ids[:,t])
+        leaves.extend([np.where(leaf_ids[:, t] == id)[0] for id in uniq_ids])
+    return leaves
+
+
+def check(leaf_ids):
+    leaf_offsets, leaf_sample_idxs = group_leaves(leaf_ids)
+    expected = where_leaf_samples(leaf_ids)
+    assert len(leaf_offsets)==len(expected)+1
+    assert leaf_offsets[-1]==len(leaf_sample_idxs)
+    for i in range(len(expected)):
+        np.testing.assert_array_equal(leaf_sample_idxs[leaf_offsets[i]:leaf_offsets[i+1]], expected[i])
+
+
+def test_one_leaf():
+    leaf_ids = np.array([[7],[7],[7]])
+    leaf_offsets, leaf_sample_idxs = group_leaves(leaf_ids)
+    np.testing.assert_array_equal(leaf_offsets, [0, 3])
+    np.testing.assert_array_equal(leaf_sample_idxs, [0, 1, 2])
+
+
+def test_docstring_example():
+    leaf_ids = np.array([[4],[2],[4],[2],[3]])
+    leaf_offsets, leaf_sample_idxs = group_leaves(leaf_ids)
+    np.testing.assert_array_equal(leaf_offsets, [0, 2, 3, 5])
+    np.testing.assert_array_equal(leaf_sample_idxs, [1, 3, 4, 0, 2])
+
+
+def test_random_leaf_ids_multiple_trees():
+    np.random.seed(1)
+    leaf_ids = np.random.randint(0, 50, size=(1000, 3))
+    check(leaf_ids)
+
+
+def test_rf_leaves():
+    np.random.seed(1)
+    n = 500
+    X = pd.DataFrame(np.random.random(size=(n, 3)), columns=['x1','x2','x3'])
+    y = X['x1'] + X['x2']**2
+    X_not_col = X.drop('x1', axis=1).values
+    rf = RandomForestRegressor(n_estimators=5, min_samples_leaf=5, bootstrap=False)
+    rf.fit(X_not_col, y)
+    check(rf.apply(X_not_col))
+    leaves = leaf_samples(rf, X_not_col)
+    expected = where_leaf_samples(rf.apply(X_not_col))
+    assert len(leaves)==len(expected)
+    for a, b in zip(leaves, expected):
+        np.testing.assert_array_equal(a, b)
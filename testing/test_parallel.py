@@ -0,0 +1,136 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from stratx.featimp import importances, importances_, feature_costs, lpt_order
+import numba
+
+import stratx.parallel as parallel
+from stratx.parallel import trial_seeds, trial_idxs, run_trials, parallel_jit_safe, \
+    worker_numba_threads, numba_threads, numba_threading_layer
+from synthetic_data import synthetic_xy
+
+
+def sum_trial(X, y, random_state, offset=0):
+    return y.sum() + offset, random_state
+
+
+def test_trial_seeds_deterministic():
+    assert trial_seeds(5, 42)==trial_seeds(5, 42)
+    assert len(set(trial_seeds(5, 42)))==5
+    assert trial_seeds(5, 42)!=trial_seeds(5, 43)
+
+
+def test_trial_idxs():
+    idxs = trial_idxs(100, seed=3, bootstrap=False, subsample_size=.5)
+    assert len(idxs)==50 and len(np.unique(idxs))==50
+    idxs = trial_idxs(100, seed=3)
+    assert len(idxs)==100 and idxs.max() < 100
+    np.testing.assert_array_equal(idxs, trial_idxs(100, seed=3))
+
+
+def test_run_trials_same_across_backends():
+    X, y = synthetic_xy(n=400)
+    trial = partial(sum_trial, offset=1)
+    serial = run_trials(trial, X, y, n_trials=6, random_state=7)
+    threads = run_trials(trial, X, y, n_trials=6, random_state=7, n_jobs=3, backend='threading')
+    processes = run_trials(trial, X, y, n_trials=6, random_state=7, n_jobs=2, backend='loky')
+    assert serial==threads==processes
+    assert len(set(serial))==6 # resampled differently each trial
+
+
+def test_run_one_trial_uses_all_data():
+    X, y = synthetic_xy(n=400)
+    assert run_trials(sum_trial, X, y, n_trials=1, random_state=7)==[(y.sum(), 7)]
+
+
+def test_parallel_importances_reproducible():
+    X, y = synthetic_xy(n=400)
+    I1 = importances(X, y, catcolnames={'x3'}, n_trials=4, random_state=1)
+    I2 = importances(X, y, catcolnames={'x3'}, n_trials=4, random_state=1,
+                     n_jobs=2, backend='threading')
+    pd.testing.assert_frame_equal(I1, I2)
+
+
+def test_lpt_order():
+    np.testing.assert_array_equal(lpt_order([3, 10, 1, 10, 5]), [1, 3, 4, 0, 2])
+    X, y = synthetic_xy(n=400)
+    costs = feature_costs(X, X.columns)
+    np.testing.assert_array_equal(costs, [len(np.unique(X[c])) for c in X.columns])
+
+
+def test_parallel_features_same_as_serial():
+    X, y = synthetic_xy(n=400)
+    serial = importances_(X, y, catcolnames={'x3'}, normalize=False, random_state=1)
+    parallel = importances_(X, y, catcolnames={'x3'}, normalize=False, random_state=1,
+                            n_jobs=2)
+    np.testing.assert_allclose(serial, parallel)
+
+
+def test_parallel_jit_safe_depends_on_layer(monkeypatch):
+    assert parallel_jit_safe(1, 'threading') # no workers
+    assert parallel_jit_safe(4, 'loky')      # fresh processes
+    assert numba_threading_layer() in {'tbb', 'omp', 'workqueue'}
+    monkeypatch.setattr(parallel, 'numba_threading_layer', lambda: 'workqueue')
+    assert not parallel_jit_safe(4, 'threading')
+    assert worker_numba_threads(4, 'threading') is None
+    monkeypatch.setattr(parallel, 'numba_threading_layer', lambda: 'omp')
+    assert parallel_jit_safe(4, 'threading')
+    monkeypatch.setattr(parallel, '_fork_is_default', lambda: True)
+    assert not parallel_jit_safe(4, 'multiprocessing') # GNU OpenMP can hang after fork
+
+
+def test_worker_numba_threads_never_oversubscribe(monkeypatch):
+    monkeypatch.setattr(parallel, 'available_cores', lambda: 16)
+    assert worker_numba_threads(4, 'loky')==4
+    assert worker_numba_threads(3, 'loky')==5
+    assert worker_numba_threads(32, 'loky')==1
+    assert worker_numba_threads(-1, 'loky')>=1
+
+
+def test_numba_threads_restores_count():
+    before = numba.get_num_threads()
+    with numba_threads(1):
+        assert numba.get_num_threads()==1
+    assert numba.get_num_threads()==before
+    with numba_threads(None): # leave numba alone
+        assert numba.get_num_threads()==before
+
+
+def test_threaded_trials_with_parallel_jit():
+    "Parallel kernels inside worker threads must neither crash nor deadlock"
+    from stratx.partdep import plot_stratpd
+    import matplotlib
+    matplotlib.use('Agg')
+    X, y = synthetic_xy(n=400)
+    pdpx1, pdpy1, _ = plot_stratpd(X, y, 'x1', 'y', n_trials=4, random_state=1)
+    pdpx2, pdpy2, _ = plot_stratpd(X, y, 'x1', 'y', n_trials=4, random_state=1,
+                                   n_jobs=2, backend='threading')
+    np.testing.assert_array_equal(pdpx1, pdpx2)
+    np.testing.assert_allclose(pdpy1, pdpy2)
@@ -0,0 +1,159 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from stratx.partdep import *
+from stratx.featimp import importances, importances_pvalues, compute_importance, \
+    cat_compute_importance, pvalue_decided
+from synthetic_data import synthetic_xy
+
+
+def noisy_xy():
+    "x2 plays no part in y so call it noise"
+    X, y = synthetic_xy(n=1000, decimals=0, noise=1,
+                        target=lambda X: X['x1']**2 + 10*X['x3'])
+    X['x2'] = X['x2'].round(0)
+    return X.rename(columns={'x2': 'noise'}), y
+
+
+def test_batch_matches_partial_dependence():
+    X, y = noisy_xy()
+    leaf_offsets, leaf_sample_idxs = stratify(X, y, 'x1', random_state=1)
+    Y = np.column_stack([y, 2*y, np.random.permutation(y)])
+    pdpx, pdpy, ignored = \
+        partial_dependence_batch(X['x1'].values, Y, leaf_offsets, leaf_sample_idxs)
+    for j in range(Y.shape[1]):
+        _, _, _, _, _, pdpx_, pdpy_, ignored_ = \
+            partial_dependence(X, pd.Series(Y[:,j]), 'x1', random_state=1,
+                               stratcache=FixedLeaves(leaf_offsets, leaf_sample_idxs))
+        np.testing.assert_array_equal(pdpx, pdpx_)
+        np.testing.assert_allclose(pdpy[:,j], pdpy_, atol=1e-9)
+        assert ignored==ignored_
+
+
+def test_cat_batch_matches_cat_partial_dependence():
+    X, y = noisy_xy()
+    leaf_offsets, leaf_sample_idxs = stratify(X, y, 'x3', min_samples_leaf=5, random_state=1)
+    Y = np.column_stack([y, np.random.permutation(y)])
+    avg_per_cat, count_per_cat = \
+        cat_partial_dependence_batch(X['x3'].values, Y, leaf_offsets, leaf_sample_idxs)
+    for j in range(Y.shape[1]):
+        _, _, avg_per_cat_, count_per_cat_, _ = \
+            cat_partial_dependence(X, pd.Series(Y[:,j]), 'x3', random_state=1,
+                                   stratcache=FixedLeaves(leaf_offsets, leaf_sample_idxs))
+        np.testing.assert_allclose(avg_per_cat[:,j], avg_per_cat_, atol=1e-9)
+        np.testing.assert_array_equal(count_per_cat, count_per_cat_)
+
+
+def test_importance_of_matrix_is_importance_per_column():
+    X_col = np.array([1, 1, 2, 3, 3, 3])
+    pdpx = np.array([1, 2, 3])
+    pdpy = np.array([[0, 0], [1, -2], [3, 5]])
+    impacts, importances = compute_importance(X_col, pdpx, pdpy)
+    for j in range(2):
+        assert (impacts[j], importances[j])==compute_importance(X_col, pdpx, pdpy[:,j])
+
+    avg_per_cat = np.array([[np.nan, np.nan], [0, 1], [2, 0], [5, 3]])
+    count_per_cat = np.array([0, 4, 1, 2])
+    impacts, importances = cat_compute_importance(avg_per_cat, count_per_cat)
+    for j in range(2):
+        assert (impacts[j], importances[j])==cat_compute_importance(avg_per_cat[:,j], count_per_cat)
+
+
+def test_pvalue_decided():
+    assert pvalue_decided(10, 20, alpha=0.05)     # obviously not significant
+    assert not pvalue_decided(0, 20, alpha=0.05)  # might be significant; keep going
+    assert pvalue_decided(0, 200, alpha=0.05)
+
+
+def test_pvalues():
+    X, y = noisy_xy()
+    impact_pvalues, importance_pvalues = \
+        importances_pvalues(X, y, catcolnames={'x3'}, n_trials=40, random_state=1)
+    assert importance_pvalues[0] < 0.05   # x1
+    assert importance_pvalues[1] > 0.05   # noise
+    assert importance_pvalues[2] < 0.05   # x3
+    assert impact_pvalues[0] < 0.05
+    again = importances_pvalues(X, y, catcolnames={'x3'}, n_trials=40, random_state=1, n_jobs=2)
+    np.testing.assert_array_equal(importance_pvalues, again[1])
+    threaded = importances_pvalues(X, y, catcolnames={'x3'}, n_trials=40, random_state=1,
+                                   n_jobs=2, backend='threading')
+    np.testing.assert_array_equal(importance_pvalues, threaded[1])
+
+
+def test_pvalues_deprecated_args():
+    X, y = noisy_xy()
+    with pytest.warns(DeprecationWarning):
+        importances_pvalues(X, y, catcolnames={'x3'}, normalize=False, n_trials=5, random_state=1)
+
+
+class FixedLeaves:
+    "A stand-in StratificationCache that always returns the same leaves"
+    def __init__(self, leaf_offsets, leaf_sample_idxs):
+        self.leaves = leaf_offsets, leaf_sample_idxs
+    def key(self, *args, **kwargs):
+        return None
+    def get(self, key):
+        return self.leaves
+
+
+def test_besag_clifford_stops_early_for_useless_feature():
+    X, y = noisy_xy()
+    P = importances_pvalues(X, y, catcolnames={'x3'}, n_trials=200, h=5,
+                            early_stopping=False, random_state=1, return_details=True)
+    noise = P.loc['noise']
+    assert noise['p-value shuffles'] < 20
+    assert noise['Importance p-value'] >= 5 / noise['p-value shuffles'] # h/n
+    # no exact interval when the stopping rule picked the number of shuffles
+    assert np.isnan(noise['Importance p-value lo']) and np.isnan(noise['Importance p-value hi'])
+    x1 = P.loc['x1']
+    assert x1['p-value shuffles']==200 # never sees h exceedances
+    assert x1['Importance p-value']==1 / 201
+    assert x1['Importance p-value lo']==0.0
+    assert x1['Importance p-value hi'] < 0.05
+
+
+def test_no_interval_after_early_stopping():
+    X, y = noisy_xy()
+    P = importances_pvalues(X, y, catcolnames={'x3'}, n_trials=200, batch_size=10,
+                            random_state=1, return_details=True)
+    stopped = P['p-value shuffles'] < 200
+    assert stopped.any()
+    assert P.loc[stopped, 'Importance p-value lo'].isna().all()
+    assert P.loc[stopped, 'Importance p-value hi'].isna().all()
+    assert P.loc[~stopped, 'Importance p-value lo'].notna().all()
+
+
+def test_importances_reports_pvalue_details():
+    X, y = noisy_xy()
+    I = importances(X, y, catcolnames={'x3'}, pvalues=True, pvalues_n_trials=40,
+                    pvalues_h=5, random_state=1)
+    assert list(I.columns)==['Importance', 'Importance p-value', 'Importance p-value lo',
+                             'Importance p-value hi', 'Impact', 'Impact p-value',
+                             'p-value shuffles']
+    assert I.loc['noise', 'p-value shuffles'] < I.loc['x1', 'p-value shuffles']
@@ -0,0 +1,85 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import multiprocessing
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from stratx.partdep import *
+from stratx.sketch import *
+from synthetic_data import synthetic_xy
+
+
+def shard_sketch(shard, colname, catcol):
+    X, y, seed = shard
+    return pd_sketch(X, y, colname, catcol=catcol, random_state=seed)
+
+
+def sharded_sketches(X, y, colname, catcol, n_shards=4):
+    "Stand in for nodes with processes, each sketching its own shard"
+    shards = [(X.iloc[idxs], y.iloc[idxs], seed)
+              for seed, idxs in enumerate(np.array_split(np.arange(len(X)), n_shards))]
+    # spawn, not fork, since the parent may have started numba's worker threads
+    with multiprocessing.get_context('spawn').Pool(2) as pool:
+        return pool.map(partial(shard_sketch, colname=colname, catcol=catcol), shards)
+
+
+def test_one_shard_same_as_partial_dependence():
+    X, y = synthetic_xy(n=2000, decimals=1, ncats=8, target=lambda X: 2*X['x1'] + X['x2'] + 3*X['x3'])
+    expected = partial_dependence(X, y, 'x1', random_state=1)
+    result = sketch_partial_dependence(merge_sketches([pd_sketch(X, y, 'x1', random_state=1)]))
+    np.testing.assert_array_equal(expected[5], result[5])
+    np.testing.assert_array_equal(expected[6], result[6])
+
+    expected = cat_partial_dependence(X, y, 'x3', random_state=1)
+    result = sketch_cat_partial_dependence(merge_sketches([pd_sketch(X, y, 'x3', catcol=True, random_state=1)]))
+    np.testing.assert_array_equal(expected[2], result[2])
+    np.testing.assert_array_equal(expected[3], result[3])
+
+
+def test_sharded_numerical():
+    X, y = synthetic_xy(n=2000, decimals=1, ncats=8, target=lambda X: 2*X['x1'] + X['x2'] + 3*X['x3'])
+    sketches = sharded_sketches(X, y, 'x1', catcol=False)
+    merged = merge_sketches(sketches)
+    assert merged['n'] == len(X)
+    assert len(merged['leaf_slopes']) == sum(len(s['leaf_slopes']) for s in sketches)
+    leaf_xranges, leaf_slopes, slope_counts_at_x, dx, slope_at_x, pdpx, pdpy, ignored = \
+        sketch_partial_dependence(merged)
+    assert abs(np.polyfit(pdpx, pdpy, 1)[0] - 2) < 0.1
+
+    # any grouping of merges gives the same sketch
+    regrouped = merge_sketches([merge_sketches(sketches[:2]), merge_sketches(sketches[2:])])
+    np.testing.assert_array_equal(sketch_partial_dependence(regrouped)[6], pdpy)
+
+
+def test_sharded_categorical():
+    X, y = synthetic_xy(n=2000, decimals=1, ncats=8, target=lambda X: 2*X['x1'] + X['x2'] + 3*X['x3'])
+    merged = merge_sketches(sharded_sketches(X, y, 'x3', catcol=True))
+    leaf_deltas, leaf_counts, avg_per_cat, count_per_cat, ignored = \
+        sketch_cat_partial_dependence(merged)
+    assert abs(np.polyfit(np.arange(8), avg_per_cat, 1)[0] - 3) < 0.3
+    assert leaf_counts.sum() == len(X)
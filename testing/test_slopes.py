@@ -34,8 +34,10 @@ def slopes(X, y, colname, min_samples_leaf=10):
                                min_samples_leaf=min_samples_leaf,
                                bootstrap=False,
                                max_features=1.0)
-    rf.fit(X.drop(colname, axis=1), y)
-    return collect_discrete_slopes(rf, X[colname], X.drop(colname, axis=1).values, y)
+    X_not_col = X.drop(colname, axis=1).values
+    rf.fit(X_not_col, y)
+    leaf_offsets, leaf_sample_idxs = leaf_samples_csr(rf, X_not_col)
+    return collect_discrete_slopes(leaf_offsets, leaf_sample_idxs, X[colname], y)
 
 
 def check(X, y, colname, expected_xranges, expected_slopes, expected_ignored=0, min_samples_leaf=15):
@@ -0,0 +1,57 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import os
+import subprocess
+import sys
+
+from stratx.lazy import LazyModule
+
+
+def test_lazy_module_imports_on_first_use():
+    json = LazyModule('json')
+    assert 'not loaded' in repr(json)
+    assert json.loads('[1, 2]')==[1, 2]
+    assert 'not loaded' not in repr(json)
+
+
+def test_computing_does_not_load_matplotlib():
+    job = """
+import sys
+import numpy as np
+import pandas as pd
+from stratx.featimp import importances
+from stratx.partdep import partial_dependence
+X = pd.DataFrame({'x1': np.arange(300) % 17, 'x2': np.arange(300) % 5})
+y = X['x1'] * 2 + X['x2']
+partial_dependence(X, y, 'x1', random_state=1)
+importances(X, y, catcolnames={'x2'}, random_state=1)
+print('matplotlib' in sys.modules)
+"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    result = subprocess.run([sys.executable, '-c', job], capture_output=True, text=True,
+                            check=True, env=env)
+    assert result.stdout.strip().splitlines()[-1]=='False'
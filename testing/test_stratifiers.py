@@ -0,0 +1,146 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.tree import DecisionTreeRegressor
+
+from stratx.partdep import *
+from stratx.stratifiers import *
+from stratx.featimp import importances
+from stratx.cache import StratificationCache
+from synthetic_data import synthetic_xy
+
+
+ALL_STRATIFIERS = [ForestStratifier(random_state=1),
+                   ForestStratifier(supervised=False, random_state=1),
+                   DecisionTreeStratifier(max_leaf_nodes=50, random_state=1),
+                   HistGradientBoostingStratifier(random_state=1),
+                   KDTreeStratifier(min_samples_leaf=15),
+                   QuantileGridStratifier(n_bins=8)]
+
+
+def test_forest_stratifier_same_as_default():
+    X, y = synthetic_xy(n=2000, decimals=1, ncats=8)
+    expected = stratify(X, y, 'x1', min_samples_leaf=10, random_state=1)
+    result = stratify(X, y, 'x1', stratifier=ForestStratifier(min_samples_leaf=10, random_state=1))
+    np.testing.assert_array_equal(expected[0], result[0])
+    np.testing.assert_array_equal(expected[1], result[1])
+
+
+def test_all_stratifiers_partition_every_sample():
+    X, y = synthetic_xy(n=2000, decimals=1, ncats=8)
+    for stratifier in ALL_STRATIFIERS:
+        leaf_offsets, leaf_sample_idxs = stratify(X, y, 'x1', stratifier=stratifier)
+        assert len(leaf_offsets) > 2, stratifier
+        np.testing.assert_array_equal(np.sort(leaf_sample_idxs) % len(X),
+                                      np.repeat(np.arange(len(X)), len(leaf_sample_idxs) // len(X)))
+
+
+def test_all_stratifiers_recover_pd():
+    X, y = synthetic_xy(n=2000, decimals=1, ncats=8)
+    for stratifier in ALL_STRATIFIERS:
+        leaf_xranges, leaf_slopes, slope_counts_at_x, dx, slope_at_x, pdpx, pdpy, ignored = \
+            partial_dependence(X, y, 'x1', stratifier=stratifier)
+        assert np.abs(pdpy - (pdpx**2 - pdpx[0]**2)).max() < 5, stratifier
+        leaf_deltas, leaf_counts, avg_per_cat, count_per_cat, ignored = \
+            cat_partial_dependence(X, y, 'x3', stratifier=stratifier)
+        assert abs(np.polyfit(np.arange(8), avg_per_cat, 1)[0] - 3) < 0.5, stratifier
+
+
+def test_traverse_same_as_sklearn_apply():
+    X, y = synthetic_xy(n=2000, decimals=1, ncats=8)
+    tree = DecisionTreeRegressor(min_samples_leaf=10, random_state=1).fit(X.values, y).tree_
+    is_leaf = tree.children_left < 0
+    leaves = traverse(X.values, tree.feature, tree.threshold, tree.children_left,
+                      tree.children_right, is_leaf, np.zeros(len(is_leaf), dtype=bool))
+    np.testing.assert_array_equal(leaves, tree.apply(X.values.astype(np.float32)))
+
+
+def test_hist_gradient_boosting_leaves_give_predictions():
+    X, y = synthetic_xy(n=2000, decimals=1, ncats=8)
+    stratifier = HistGradientBoostingStratifier(max_leaf_nodes=20).fit(X.values, y.values)
+    leaves = stratifier.apply(X.values)[:, 0]
+    values = stratifier.hgb_._predictors[0][0].nodes['value']
+    np.testing.assert_allclose(stratifier.hgb_.predict(X.values),
+                               stratifier.hgb_._baseline_prediction.ravel()[0] + values[leaves])
+
+
+def test_hist_gradient_boosting_internals_missing():
+    with pytest.raises(RuntimeError, match="scikit-learn"):
+        hist_gradient_boosting_tree(HistGradientBoostingRegressor()) # not fit
+
+
+def test_kd_tree_leaves_big_enough_with_ties():
+    np.random.seed(1)
+    n = 2000
+    X = np.column_stack([np.random.randint(0, 3, size=n),       # 3 values
+                         np.where(np.random.uniform(size=n) < .9, 0, np.random.randint(1, 5, size=n)),
+                         np.random.randint(0, 2, size=n)]).astype(float)
+    for min_samples_leaf in [5, 15, 100]:
+        leaves = KDTreeStratifier(min_samples_leaf=min_samples_leaf).fit(X).apply(X)[:, 0]
+        leaf_sizes = np.bincount(leaves)
+        leaf_sizes = leaf_sizes[leaf_sizes > 0]
+        assert len(leaf_sizes) > 1
+        assert leaf_sizes.min() >= min_samples_leaf, min_samples_leaf
+
+
+def test_split_boundary():
+    assert split_boundary(np.array([1, 1, 1, 1, 2, 3]), 2) == 1  # 4 left, 2 right
+    assert split_boundary(np.array([1, 2, 2, 2, 2, 3]), 2) is None
+    assert split_boundary(np.arange(10), 2) == 4                  # median
+
+
+def test_cache_keys_differ_per_stratifier():
+    X, y = synthetic_xy(n=2000, decimals=1, ncats=8)
+    stratcache = StratificationCache()
+    for stratifier in ALL_STRATIFIERS:
+        stratify(X, y, 'x1', stratifier=stratifier, stratcache=stratcache)
+    assert len(stratcache) == len(ALL_STRATIFIERS)
+    stratify(X, y, 'x1', stratifier=KDTreeStratifier(min_samples_leaf=15), stratcache=stratcache)
+    assert stratcache.hits == 1
+
+
+def test_importances_with_stratifier():
+    X, y = synthetic_xy(n=2000, decimals=1, ncats=8)
+    I = importances(X, y, catcolnames={'x3'}, stratifier=DecisionTreeStratifier(max_leaf_nodes=50))
+    assert I.index[0] == 'x1'
+
+
+class CountingStratifier(DecisionTreeStratifier):
+    fits = 0 # stratify() fits copies so count in the class
+    def fit(self, X_not_col, y):
+        CountingStratifier.fits += 1
+        return super().fit(X_not_col, y)
+
+
+def test_pvalues_with_stratifier():
+    X, y = synthetic_xy(n=2000, decimals=1, ncats=8)
+    CountingStratifier.fits = 0
+    I = importances(X, y, catcolnames={'x3'}, stratifier=CountingStratifier(max_leaf_nodes=50),
+                    pvalues=True, pvalues_n_trials=10, random_state=1)
+    assert CountingStratifier.fits == 2 * len(X.columns) # importances and their p-values
+    assert I.loc['x1', 'Importance p-value'] < 0.1
@@ -0,0 +1,77 @@
+"""
+MIT License
+
+Copyright (c) 2019 Terence Parr
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor, GradientBoostingRegressor
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.linear_model import LinearRegression
+
+from stratx.treepd import *
+from stratx.ice import predict_at_values, predict_ice, friedman_partial_dependence
+
+
+def synthetic_xy(n=500, seed=1):
+    np.random.seed(seed)
+    X = pd.DataFrame({'x1': np.random.uniform(0, 10, size=n),
+                      'x2': np.random.randint(0, 5, size=n),
+                      'x3': np.random.normal(size=n)})
+    y = X['x1']**2 + 3*X['x2'] + X['x1']*X['x3']
+    return X, y
+
+
+@pytest.mark.parametrize("model", [RandomForestRegressor(n_estimators=10, min_samples_leaf=3, random_state=1),
+                                   ExtraTreesRegressor(n_estimators=10, random_state=1),
+                                   DecisionTreeRegressor(max_depth=8, random_state=1)])
+def test_tree_walk_same_as_predict(model):
+    X, y = synthetic_xy()
+    model.fit(X, y)
+    for colname in X.columns:
+        # unsorted grid with duplicates, values beyond X's range, and X's own values
+        values = np.concatenate([np.random.choice(X[colname], 20), [-100, 100]])
+        expected = predict_at_values(model, X, colname, values)
+        np.testing.assert_allclose(tree_ice(model, X, colname, values), expected, atol=1e-9)
+        np.testing.assert_allclose(tree_partial_dependence(model, X, colname, values),
+                                   expected.mean(axis=1), atol=1e-9)
+
+
+def test_unsupported_models():
+    X, y = synthetic_xy()
+    lm = LinearRegression().fit(X, y)
+    gb = GradientBoostingRegressor(n_estimators=5).fit(X, y)
+    assert tree_regressors(lm) is None and tree_regressors(gb) is None
+    with pytest.raises(ValueError):
+        tree_partial_dependence(lm, X, 'x1', [1, 2])
+    # those fall back on predict()
+    pdpx, pdpy = friedman_partial_dependence(gb, X, 'x1', numx=None, mean_centered=False)
+    np.testing.assert_allclose(pdpy, predict_at_values(gb, X, 'x1', pdpx).mean(axis=1))
+
+
+def test_ice_uses_tree_walk():
+    X, y = synthetic_xy()
+    rf = RandomForestRegressor(n_estimators=10, random_state=1).fit(X, y)
+    ice = predict_ice(rf, X, 'x1', numx=15)
+    np.testing.assert_allclose(ice.lines.T, predict_at_values(rf, X, 'x1', ice.linex), rtol=1e-6)